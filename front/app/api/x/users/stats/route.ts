@@ -30,34 +30,46 @@ export async function GET() {
       }
     });
 
-    // 获取每个用户的最新文章时间
-    const { data: latestPosts, error: latestError } = await supabase
-      .from('t_x')
-      .select('user_id, created_at')
-      .not('user_id', 'is', null)
-      .order('created_at', { ascending: false });
+    // 每个用户的最新文章时间与累计数来自 t_x_user_stats（写入时增量维护），不再扫描整个 t_x
+    const { data: userRollups, error: rollupError } = await supabase
+      .from('t_x_user_stats')
+      .select('user_id, tweet_count, important_count, first_created_at, last_created_at, last_crawled_at');
 
-    if (latestError) {
-      console.error('Error fetching latest posts:', latestError);
+    if (rollupError) {
+      console.error('Error fetching user rollups:', rollupError);
       return NextResponse.json(
         { success: false, error: 'Failed to fetch latest posts' },
         { status: 500 }
       );
     }
 
-    // 获取每个用户的最新文章时间
     const userLatestPosts: { [key: string]: string } = {};
-    latestPosts?.forEach(item => {
-      if (item.user_id && !userLatestPosts[item.user_id]) {
-        userLatestPosts[item.user_id] = item.created_at;
+    const userTotals: {
+      [key: string]: {
+        tweetCount: number;
+        importantCount: number;
+        firstPostAt: string | null;
+        lastCrawledAt: string | null;
+      };
+    } = {};
+    userRollups?.forEach(item => {
+      if (item.last_created_at) {
+        userLatestPosts[item.user_id] = item.last_created_at;
       }
+      userTotals[item.user_id] = {
+        tweetCount: Number(item.tweet_count),
+        importantCount: Number(item.important_count),
+        firstPostAt: item.first_created_at,
+        lastCrawledAt: item.last_crawled_at
+      };
     });
 
     return NextResponse.json({
       success: true,
       data: {
         stats: userStats,
-        latestPosts: userLatestPosts
+        latestPosts: userLatestPosts,
+        totals: userTotals
       }
     });
   } catch (error) {
@@ -1,10 +1,16 @@
 from openai import OpenAI
+import argparse
 import os
 import json
 import re
-from typing import List, Dict, Any
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+import time
 from datetime import datetime
 
+from metrics import metrics
+
 client = OpenAI(
     api_key=os.environ.get("OPENAI_API_KEY"),
     base_url=os.environ.get("OPENAI_BASE_URL"),
@@ -72,6 +78,7 @@ def call_llm_api(prompt):
             print(f"使用模型: {model_name}")
             print(f"API Base URL: {client.base_url}")
 
+            started = time.perf_counter()
             stream = client.chat.completions.create(
                 model=model_name,
                 max_tokens=20000,
@@ -83,17 +90,32 @@ def call_llm_api(prompt):
             )
 
             content = ""
+            first_token_at = None
+            chunk_count = 0
             for chunk in stream:
+                # 部分服务在最后一个 chunk 中返回 usage
+                usage = getattr(chunk, 'usage', None)
+                if usage:
+                    metrics.inc('llm_prompt_tokens_total', usage.prompt_tokens or 0, model=model_name)
+                    metrics.inc('llm_completion_tokens_total', usage.completion_tokens or 0, model=model_name)
                 if chunk.choices and len(chunk.choices) > 0:
                     delta = chunk.choices[0].delta
                     if delta.content is not None:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            metrics.observe('llm_time_to_first_token_seconds', first_token_at - started, model=model_name)
+                        chunk_count += 1
                         content += delta.content
+            metrics.observe('llm_request_seconds', time.perf_counter() - started, model=model_name)
+            metrics.inc('llm_stream_chunks_total', chunk_count, model=model_name)
+            metrics.inc('llm_output_chars_total', len(content), model=model_name)
             return content
 
         try:
             # 优先使用 base_model
             return run_call(base_model)
         except Exception as inner_e:
+            metrics.inc('llm_errors_total', model=base_model)
             print(f"主模型调用失败: {inner_e}")
             if fallback_model:
                 try:
@@ -111,64 +133,6 @@ def call_llm_api(prompt):
         return f"API调用失败: {str(e)}"
 
 
-# 从数据库读取最新的推文数据，支持过滤已分析的内容
-def get_latest_x_data(limit: int = 20, skip_analyzed: bool = True) -> List[Dict[str, Any]]:
-    """
-    获取最新的推文数据
-    Args:
-        limit: 要获取的数据条数
-        skip_analyzed: 是否跳过已分析的内容
-    Returns:
-        推文数据列表
-    """
-    from db_utils import get_db_connection
-    import psycopg2.extras
-    
-    conn = None
-    try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            if skip_analyzed:
-                # 过滤已分析的内容（more_info中不包含ai_result字段）
-                query = """
-                    SELECT * FROM (
-                    SELECT id, x_id, item_type, data, username, user_id, user_link, created_at, more_info 
-                    FROM t_x 
-                    ORDER BY created_at DESC 
-                    LIMIT %s ) AS t
-                    WHERE NOT (more_info ? 'ai_result')
-                """
-            else:
-                # 获取所有数据
-                query = """
-                    SELECT id, x_id, item_type, data, username, user_id, user_link, created_at, more_info 
-                    FROM t_x 
-                    ORDER BY created_at DESC 
-                    LIMIT %s
-                """
-            
-            cur.execute(query, (limit,))
-            rows = cur.fetchall()
-            
-            # 转换为字典列表
-            results = []
-            for row in rows:
-                result = dict(row)
-                # 确保 created_at 是字符串格式
-                if result['created_at']:
-                    result['created_at'] = result['created_at'].isoformat()
-                results.append(result)
-            
-            return results
-    
-    except Exception as e:
-        print(f"Error fetching X data: {e}")
-        raise
-    finally:
-        if conn:
-            conn.close()
-
-
 # 解析推文内容，参考前端渲染逻辑
 def extract_tweet_content(data: Dict[str, Any]) -> str:
     """从推文数据中提取正文内容"""
@@ -243,7 +207,9 @@ def analyze_x_data(x_data: List[Dict[str, Any]]) -> str:
                 tweet_contents.append(tweet_info)
         except (json.JSONDecodeError, Exception) as e:
             print(f"Error parsing tweet data for {x_id}: {e}")
+            metrics.inc('ai_items_skipped_total', reason='bad_data')
             continue
+    metrics.inc('ai_items_analyzed_total', len(tweet_contents))
     
     if not tweet_contents:
         return '[]'  # 返回空的JSON数组
@@ -255,14 +221,20 @@ def analyze_x_data(x_data: List[Dict[str, Any]]) -> str:
     return result
 
 
-def parse_llm_result(result: str) -> List[Dict[str, Any]]:
-    """解析LLM返回的JSON结果"""
+def parse_llm_result(result: str) -> Optional[List[Dict[str, Any]]]:
+    """解析LLM返回的JSON结果；无法解析为JSON时返回 None，与解析成功但没有高价值信号的 [] 区分"""
     if not result or not result.strip():
         return []
     
+    text = result.strip()
+    # 去掉 ```json ... ``` 代码块标记
+    fenced = re.match(r'^```(?:json)?\s*(.*?)\s*```$', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+
     try:
         # 尝试直接解析JSON
-        parsed = json.loads(result.strip())
+        parsed = json.loads(text)
         
         # 如果是单个对象，转换为数组
         if isinstance(parsed, dict):
@@ -300,7 +272,7 @@ def parse_llm_result(result: str) -> List[Dict[str, Any]]:
         print(f"JSON解析失败，尝试提取JSON块...")
         
         # 使用正则提取JSON块
-        json_pattern = r'\[\s*\{[^}]*\}(?:\s*,\s*\{[^}]*\})*\s*\]|\{[^}]*\}'
+        json_pattern = r'\[\s*\{[^}]*\}(?:\s*,\s*\{[^}]*\})*\s*\]|\[\s*\]|\{[^}]*\}'
         matches = re.findall(json_pattern, result, re.DOTALL)
         
         for match in matches:
@@ -313,7 +285,7 @@ def parse_llm_result(result: str) -> List[Dict[str, Any]]:
                 continue
         
         print(f"Unable to parse LLM result: {result[:200]}...")
-        return []
+        return None
     
     except Exception as e:
         print(f"Error parsing LLM result: {e}")
@@ -321,101 +293,93 @@ def parse_llm_result(result: str) -> List[Dict[str, Any]]:
 
 def save_llm_result(ai_results: List[Dict[str, Any]], analyzed_x_ids: List[str]) -> None:
     """将AI分析结果保存到数据库的more_info字段，并标记所有已分析的推文"""
-    from db_utils import get_db_connection
+    from db_utils import save_ai_results
+    
+    analyzed_at = datetime.now().isoformat()
+    # x_id -> ai_result，重要信号与无重要信号的推文一起写回
+    results = {}
+    for result in ai_results:
+        # 在more_info中添加ai_result字段（重要信号）
+        results[result['x_id']] = {
+            'summary': result['summary'],
+            'highlight_label': result['highlight_label'],
+            'analyzed_at': analyzed_at,
+            'is_important': True,
+            'model': result.get('model', base_model)
+        }
     
-    conn = None
+    # 处理已分析但无重要信号的推文
+    no_signal_x_ids = [x_id for x_id in analyzed_x_ids if x_id not in results]
+    for x_id in no_signal_x_ids:
+        # 标记为已分析但无重要信号
+        results[x_id] = {
+            'analyzed_at': analyzed_at,
+            'is_important': False,
+            'summary': None,
+            'highlight_label': [],
+            'model': base_model
+        }
+    
+    # 写回结果、移出 AI 分析队列并更新 t_x_user_stats，在同一事务中提交
+    updated_count = save_ai_results(results)
+    print(f"Successfully updated {updated_count} records:")
+    print(f"  - {len(results) - len(no_signal_x_ids)} records with important signals")
+    print(f"  - {len(no_signal_x_ids)} records marked as analyzed (no important signals)")
+
+
+AI_BATCH_SIZE = int(os.getenv('X_AI_BATCH_SIZE', '20'))
+AI_MAX_BATCHES = int(os.getenv('X_AI_MAX_BATCHES', '5'))
+AI_LEASE_SECONDS = int(os.getenv('X_AI_LEASE_SECONDS', '600'))
+AI_MAX_ATTEMPTS = int(os.getenv('X_AI_MAX_ATTEMPTS', '5'))
+AI_RETRY_BASE_SECONDS = float(os.getenv('X_AI_RETRY_BASE_SECONDS', '60'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从 AI 分析队列领取推文并调用 LLM 分析')
+    parser.add_argument('--batch-size', type=int, default=AI_BATCH_SIZE, help='每次 LLM 调用分析的推文数')
+    parser.add_argument('--max-batches', type=int, default=AI_MAX_BATCHES, help='每个分析线程最多处理的批次数，0 表示处理完队列')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('X_AI_WORKERS', '1')), help='并行分析线程数，各自领取互不重叠的批次')
+    parser.add_argument('--worker-id', default=os.getenv('X_WORKER_ID'), help='分析器标识，默认 主机名-进程号')
+    args = parser.parse_args()
+
+    worker_id = args.worker_id or f'{socket.gethostname()}-{os.getpid()}'
     try:
-        conn = get_db_connection()
-        updated_count = 0
-        
-        with conn.cursor() as cur:
-            # 先处理有AI分析结果的推文
-            for result in ai_results:
-                x_id = result['x_id']
-                
-                # 获取当前记录的more_info字段
-                cur.execute("SELECT more_info FROM t_x WHERE x_id = %s", (x_id,))
-                row = cur.fetchone()
-                
-                if not row:
-                    print(f"Warning: No record found for x_id: {x_id}")
-                    continue
-                
-                current_more_info = row[0] or {}
-                if isinstance(current_more_info, str):
-                    current_more_info = json.loads(current_more_info)
-                
-                # 在more_info中添加ai_result字段（重要信号）
-                current_more_info['ai_result'] = {
-                    'summary': result['summary'],
-                    'highlight_label': result['highlight_label'],
-                    'analyzed_at': datetime.now().isoformat(),
-                    'is_important': True,
-                    'model': result.get('model', base_model)
-                }
-                
-                # 更新数据库
-                cur.execute(
-                    "UPDATE t_x SET more_info = %s WHERE x_id = %s",
-                    (json.dumps(current_more_info), x_id)
-                )
-                updated_count += 1
-            
-            # 处理已分析但无重要信号的推文
-            result_x_ids = {result['x_id'] for result in ai_results}
-            no_signal_x_ids = [x_id for x_id in analyzed_x_ids if x_id not in result_x_ids]
-            
-            for x_id in no_signal_x_ids:
-                # 获取当前记录的more_info字段
-                cur.execute("SELECT more_info FROM t_x WHERE x_id = %s", (x_id,))
-                row = cur.fetchone()
-                
-                if not row:
-                    continue
-                
-                current_more_info = row[0] or {}
-                if isinstance(current_more_info, str):
-                    current_more_info = json.loads(current_more_info)
-                
-                # 标记为已分析但无重要信号
-                current_more_info['ai_result'] = {
-                    'analyzed_at': datetime.now().isoformat(),
-                    'is_important': False,
-                    'summary': None,
-                    'highlight_label': [],
-                    'model': base_model
-                }
-                
-                # 更新数据库
-                cur.execute(
-                    "UPDATE t_x SET more_info = %s WHERE x_id = %s",
-                    (json.dumps(current_more_info), x_id)
-                )
-                updated_count += 1
-        
-        conn.commit()
-        print(f"Successfully updated {updated_count} records:")
-        print(f"  - {len(ai_results)} records with important signals")
-        print(f"  - {len(no_signal_x_ids)} records marked as analyzed (no important signals)")
-        
-    except Exception as e:
-        print(f"Error saving AI results: {e}")
-        if conn:
-            conn.rollback()
-        raise
+        if args.workers <= 1:
+            run(worker_id, args.batch_size, args.max_batches)
+        else:
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                futures = [executor.submit(run, f'{worker_id}-{i}', args.batch_size, args.max_batches)
+                           for i in range(args.workers)]
+                for future in futures:
+                    future.result()
     finally:
-        if conn:
-            conn.close()
+        metrics.write_reports('ai_filter')
 
 
-def main():
-    print(f"🚀 开始获取推文数据...")
-    x_data = get_latest_x_data(limit=20, skip_analyzed=True)
-        
-    if not x_data:
-        print("⚠️ 未找到任何推文数据")
-        return
-        
+def run(worker_id: str, batch_size: int = AI_BATCH_SIZE, max_batches: int = AI_MAX_BATCHES) -> None:
+    """
+    Drain the AI analysis queue batch by batch, newest tweets first
+    Each claimed batch continues below the previous one (keyset cursor), so rows
+    skipped because another analyzer holds them are not scanned again.
+    """
+    from db_utils import claim_ai_batch
+
+    cursor = None
+    batches = 0
+    while not max_batches or batches < max_batches:
+        print(f"🚀 [{worker_id}] 领取待分析推文...")
+        x_data = claim_ai_batch(worker_id, batch_size, AI_LEASE_SECONDS, after=cursor)
+        if not x_data:
+            print(f"⚠️ [{worker_id}] 队列中没有待分析的推文")
+            return
+        cursor = (x_data[-1]['created_at'], x_data[-1]['x_id'])
+        batches += 1
+        analyze_batch(x_data)
+
+
+def analyze_batch(x_data: List[Dict[str, Any]]) -> None:
+    from db_utils import fail_ai_items
+
     print(f"📊 找到 {len(x_data)} 条需要分析的推文")
     
     # 记录所有要分析的推文ID
@@ -431,14 +395,27 @@ def main():
         print("📝 标记推文为已分析（无重要信号）...")
         save_llm_result([], analyzed_x_ids)
         return
+
+    if llm_result.startswith(('API调用失败', 'API配置错误')):
+        # LLM 调用失败，放回队列按指数退避重试
+        print(f"⚠️ {llm_result}，{len(analyzed_x_ids)} 条推文稍后重试")
+        fail_ai_items(analyzed_x_ids, llm_result, AI_MAX_ATTEMPTS, AI_RETRY_BASE_SECONDS)
+        return
         
     # 解析结果
     print(f"🔍 解析AI返回结果...")
     parsed_results = parse_llm_result(llm_result)
         
-    if not parsed_results:
+    if parsed_results is None:
         print(f"⚠️ 未能解析出AI结果")
         print(f"AI原始返回: {llm_result[:500]}...")
+        fail_ai_items(analyzed_x_ids, f"unparseable result: {llm_result[:500]}", AI_MAX_ATTEMPTS, AI_RETRY_BASE_SECONDS)
+        return
+
+    if not parsed_results:
+        # 返回的是合法 JSON，只是没有带 summary 的条目：同样记为已分析（无重要信号）
+        print("⚠️ AI分析未返回高价值信号，标记推文为已分析（无重要信号）...")
+        save_llm_result([], analyzed_x_ids)
         return
         
     print(f"🎉 成功解析出 {len(parsed_results)} 条高价值信号")
@@ -455,4 +432,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+from db_utils import get_all_x_users, get_backfill_states, save_backfill_checkpoints, parse_twitter_date
+from ingest import XDataWriter
+from metrics import metrics
+from rate_limiter import AsyncRateLimiter
+from x_client import AsyncXClient
+from x_parser import parse_user_timeline_records, extract_bottom_cursor
+
+
+def _item_created_at(x_item):
+    if not x_item.created_at:
+        return None
+    created_at = parse_twitter_date(x_item.created_at)
+    # 解析失败时 parse_twitter_date 返回本地当前时间，不参与比较
+    return created_at if created_at.tzinfo else None
+
+
+async def backfill_user(client, limiter, writer, user, checkpoint, target_date, target_count, page_size):
+    """
+    Page back through one user's timeline from its saved cursor
+    Stops at target_date, after target_count items, or when the timeline ends;
+    each page is checkpointed only after its items are written.
+    """
+    user_id = user.get('user_id')
+    username = user.get('screen_name')
+    cursor = checkpoint.get('cursor')
+    fetched_count = checkpoint.get('fetched_count') or 0
+    oldest_created_at = checkpoint.get('oldest_created_at')
+
+    while True:
+        variables = {'count': page_size}
+        if cursor:
+            variables['cursor'] = cursor
+        await limiter.acquire()
+        x_data_raw = await client.user_tweets(user_id, **variables)
+        if not x_data_raw:
+            # 请求失败时保留上一个检查点，下次从这里继续
+            print(f'user {username} 回填中断，已获取 {fetched_count} 条')
+            return
+
+        next_cursor = extract_bottom_cursor(x_data_raw)
+        page_items = {}
+        timeline_count = 0
+        reached_date = False
+        for x_item in parse_user_timeline_records(x_data_raw):
+            created_at = _item_created_at(x_item)
+            if target_date and created_at and created_at < target_date:
+                # 置顶推文通常很旧，但不代表时间线已经翻到目标日期
+                if not x_item.is_pinned:
+                    reached_date = True
+                continue
+            x_item.username = username
+            x_item.user_id = user_id
+            x_item.user_link = user.get('user_link')
+            page_items[x_item.x_id] = x_item
+            if x_item.is_pinned:
+                continue
+            timeline_count += 1
+            if created_at and (oldest_created_at is None or created_at < oldest_created_at):
+                oldest_created_at = created_at
+        fetched_count += len(page_items)
+
+        done = (
+            reached_date
+            or not timeline_count
+            or not next_cursor
+            or next_cursor == cursor
+            or (target_count and fetched_count >= target_count)
+        )
+        await writer.add_user_async(page_items, {
+            'user_id': user_id,
+            'cursor': next_cursor,
+            'target_date': target_date,
+            'target_count': target_count,
+            'fetched_count': fetched_count,
+            'oldest_created_at': oldest_created_at,
+            'done': bool(done),
+        })
+        metrics.inc('backfill_pages_total')
+        if done:
+            print(f'user {username} 回填完成，共 {fetched_count} 条，最早到 {oldest_created_at}')
+            return
+        cursor = next_cursor
+
+
+async def backfill_users(users, target_date, target_count, args):
+    checkpoints = get_backfill_states([user['user_id'] for user in users])
+    writer = XDataWriter(flush_items=args.flush_items, flush_interval=args.flush_interval,
+                         write_states=save_backfill_checkpoints, record_engagement=False)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_one(client, limiter, user):
+        checkpoint = {} if args.restart else checkpoints.get(user['user_id'], {})
+        if checkpoint.get('done'):
+            print(f"user {user.get('screen_name')} 已回填完成，跳过（使用 --restart 重新回填）")
+            return
+        async with semaphore:
+            await backfill_user(client, limiter, writer, user, checkpoint, target_date, target_count, args.page_size)
+
+    async with AsyncXClient(max_clients=args.concurrency) as client:
+        limiter = AsyncRateLimiter(args.max_requests * len(client.pool), args.window)
+        await asyncio.gather(*(run_one(client, limiter, user) for user in users))
+    await writer.flush_async()
+    print(f'本次回填 {writer.user_count} 页，解析出 {writer.parsed_count} 条，实际入库 {writer.inserted_count} 条')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回填用户的历史推文，支持断点续传')
+    parser.add_argument('--user', action='append', default=[], help='要回填的 user_id 或 screen_name，可重复')
+    parser.add_argument('--all', action='store_true', help='回填所有未过期用户')
+    parser.add_argument('--until', help='回填到该日期为止 (YYYY-MM-DD)')
+    parser.add_argument('--max-count', type=int, help='每个用户最多回填的条数')
+    parser.add_argument('--page-size', type=int, default=40, help='每页请求的条数')
+    parser.add_argument('--restart', action='store_true', help='忽略已保存的游标，从最新开始重新回填')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('X_CONCURRENCY', '8')), help='同时回填的用户数')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('X_RATE_LIMIT', '50')), help='每个账号每个限流窗口内的最大请求数')
+    parser.add_argument('--window', type=float, default=float(os.getenv('X_RATE_WINDOW', '60')), help='限流窗口长度（秒）')
+    parser.add_argument('--flush-items', type=int, default=int(os.getenv('X_FLUSH_ITEMS', '2000')),
+                        help='缓冲区达到多少条时写库，达到 DB_COPY_MIN_ROWS 的批次用 COPY 写入')
+    parser.add_argument('--flush-interval', type=float, default=float(os.getenv('X_FLUSH_INTERVAL', '30')), help='距上次写库多少秒后写库')
+    args = parser.parse_args()
+
+    if not args.user and not args.all:
+        parser.error('请指定 --user 或 --all')
+    if not args.until and not args.max_count:
+        parser.error('请至少指定 --until 或 --max-count 之一')
+
+    users = get_all_x_users()
+    if not args.all:
+        wanted = set(args.user)
+        users = [user for user in users if user['user_id'] in wanted or user['screen_name'] in wanted]
+    if not users:
+        print('没有找到要回填的用户')
+        return
+
+    target_date = datetime.strptime(args.until, '%Y-%m-%d').replace(tzinfo=timezone.utc) if args.until else None
+    print(f'开始回填 {len(users)} 个用户')
+    try:
+        asyncio.run(backfill_users(users, target_date, args.max_count, args))
+    finally:
+        metrics.write_reports('backfill')
+
+
+if __name__ == "__main__":
+    main()
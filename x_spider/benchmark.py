@@ -0,0 +1,472 @@
+import argparse
+import gc
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, List, Optional
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+FIXTURES = ('demo.json', 'demo2.json')
+INSERT_FIXTURE = 'output.json'
+# 基准结果中参与回归判断的指标：(指标名, 越大越好)。entries_per_sec 随机器和负载变化，只报告不比较；
+# 速度用同一进程中校准循环的耗时归一化后再比较
+CHECKED_METRICS = (('entries_per_calibration', True), ('alloc_bytes_per_entry', False))
+# 校准数据保持很小，不影响用例的峰值 RSS
+CALIBRATION_ITEMS = 2000
+CALIBRATION_PASSES = 10
+# 每次计时至少持续的秒数
+MIN_SAMPLE_SECONDS = 0.05
+
+
+def _user(rng: random.Random, user_id: int) -> Dict[str, Any]:
+    screen_name = f'user{user_id}'
+    return {'result': {
+        '__typename': 'User',
+        'id': f'VXNlcjo{user_id}',
+        'rest_id': str(user_id),
+        'core': {'created_at': 'Wed Jun 02 20:12:29 +0000 2010', 'name': screen_name.title(), 'screen_name': screen_name},
+        'legacy': {
+            'description': 'synthetic account ' * rng.randint(1, 4),
+            'followers_count': rng.randint(0, 10 ** 6),
+            'friends_count': rng.randint(0, 5000),
+            'profile_banner_url': f'https://pbs.twimg.com/profile_banners/{user_id}/1',
+            'screen_name': screen_name,
+        },
+        'is_blue_verified': rng.random() < 0.3,
+        'professional': {'rest_id': str(user_id), 'professional_type': 'Creator', 'category': []},
+    }}
+
+
+def _tweet(rng: random.Random, tweet_id: int, quote_depth: int, retweet: bool = False) -> Dict[str, Any]:
+    """A Tweet result, quoting a chain of quote_depth tweets (or retweeting one when retweet=True)"""
+    urls = [{'url': f'https://t.co/u{tweet_id}{i}', 'expanded_url': f'https://example.com/{tweet_id}/{i}',
+             'display_url': f'example.com/{tweet_id}/{i}', 'indices': [0, 23]} for i in range(rng.randint(0, 3))]
+    media = [{'url': f'https://t.co/m{tweet_id}', 'media_url_https': f'https://pbs.twimg.com/media/{tweet_id}_{i}.jpg',
+              'type': 'photo', 'sizes': {'large': {'h': 1024, 'w': 768, 'resize': 'fit'}}} for i in range(rng.randint(0, 2))]
+    entities = {'hashtags': [], 'symbols': [], 'user_mentions': [], 'urls': urls, 'media': media}
+    legacy = {
+        'bookmark_count': rng.randint(0, 500),
+        'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(1700000000 + tweet_id % 10 ** 7)),
+        'conversation_id_str': str(tweet_id),
+        'display_text_range': [0, 140],
+        'entities': entities,
+        'extended_entities': {'media': media},
+        'favorite_count': rng.randint(0, 10 ** 5),
+        'full_text': ' '.join(f'word{rng.randint(0, 9999)}' for _ in range(rng.randint(5, 40))),
+        'lang': 'en',
+        'quote_count': rng.randint(0, 100),
+        'reply_count': rng.randint(0, 100),
+        'retweet_count': rng.randint(0, 1000),
+        'user_id_str': str(tweet_id % 1000),
+        'id_str': str(tweet_id),
+    }
+    result = {
+        '__typename': 'Tweet',
+        'rest_id': str(tweet_id),
+        'core': {'user_results': _user(rng, tweet_id % 1000)},
+        'edit_control': {'edit_tweet_ids': [str(tweet_id)], 'editable_until_msecs': '1700000000000', 'edits_remaining': '5'},
+        'views': {'count': str(rng.randint(0, 10 ** 6)), 'state': 'EnabledWithCount'},
+        'source': '<a href="https://mobile.twitter.com" rel="nofollow">Twitter Web App</a>',
+        'legacy': legacy,
+    }
+    if rng.random() < 0.2:
+        result['note_tweet'] = {'is_expandable': True, 'note_tweet_results': {'result': {
+            'id': f'note-{tweet_id}', 'text': legacy['full_text'] * 4, 'entity_set': entities}}}
+    if retweet:
+        legacy['retweeted_status_result'] = {'result': _tweet(rng, tweet_id - 1, quote_depth)}
+    elif quote_depth > 0:
+        result['quoted_status_result'] = {'result': _tweet(rng, tweet_id - 1, quote_depth - 1)}
+    return result
+
+
+def _tweet_item(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {'itemType': 'TimelineTweet', '__typename': 'TimelineTweet', 'tweet_results': {'result': result},
+            'tweetDisplayType': 'Tweet'}
+
+
+def generate_timeline(entries: int, quote_depth: int = 3, module_every: int = 10, seed: int = 0) -> Dict[str, Any]:
+    """
+    Build a synthetic UserTweets response
+    Args:
+        entries: Number of timeline entries
+        quote_depth: Longest quote chain; each tweet quotes 0..quote_depth levels deep
+        module_every: Every Nth entry is a profile-conversation module of 2-3 tweets
+        seed: Random seed, so runs are comparable
+    """
+    rng = random.Random(seed)
+    timeline_entries = []
+    tweet_id = 1900000000000000000 + entries * 100
+    for index in range(entries):
+        tweet_id -= 100
+        if module_every and index % module_every == module_every - 1:
+            ids = [tweet_id - i for i in range(rng.randint(2, 3))]
+            timeline_entries.append({
+                'entryId': f'profile-conversation-{tweet_id}',
+                'sortIndex': str(tweet_id),
+                'content': {'entryType': 'TimelineTimelineModule', '__typename': 'TimelineTimelineModule',
+                            'displayType': 'VerticalConversation',
+                            'items': [{'entryId': f'profile-conversation-{tweet_id}-tweet-{i}',
+                                       'item': {'itemContent': _tweet_item(_tweet(rng, i, rng.randint(0, quote_depth)))}}
+                                      for i in ids]},
+            })
+        elif index % 17 == 5:
+            # 广告和推荐关注等解析器会跳过的条目
+            timeline_entries.append({'entryId': f'promoted-tweet-{tweet_id}-abc', 'sortIndex': str(tweet_id),
+                                     'content': {'entryType': 'TimelineTimelineItem',
+                                                 'itemContent': _tweet_item(_tweet(rng, tweet_id, 0))}})
+        else:
+            result = _tweet(rng, tweet_id, rng.randint(0, quote_depth), retweet=rng.random() < 0.15)
+            timeline_entries.append({'entryId': f'tweet-{tweet_id}', 'sortIndex': str(tweet_id),
+                                     'content': {'entryType': 'TimelineTimelineItem', '__typename': 'TimelineTimelineItem',
+                                                 'itemContent': _tweet_item(result)}})
+    timeline_entries.append({'entryId': f'cursor-bottom-{tweet_id}', 'sortIndex': str(tweet_id),
+                             'content': {'entryType': 'TimelineTimelineCursor', 'value': 'DAABCgABGsynthetic', 'cursorType': 'Bottom'}})
+    return {'data': {'user': {'result': {'__typename': 'User', 'timeline': {'timeline': {'instructions': [
+        {'type': 'TimelineClearCache'},
+        {'type': 'TimelineAddEntries', 'entries': timeline_entries},
+    ]}}}}}}
+
+
+def iter_tweet_results(data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Top-level tweet results of a UserTweets response, including those inside modules"""
+    from x_parser import _timeline_instructions
+
+    for instruction in _timeline_instructions(data):
+        for entry in instruction.get('entries') or []:
+            entry_id = entry.get('entryId') or ''
+            if not entry_id.startswith('tweet-') and not entry_id.startswith('profile-conversation'):
+                continue
+            content = entry.get('content') or {}
+            item_contents = [content.get('itemContent')] + [item['item'].get('itemContent') for item in content.get('items') or []]
+            for item_content in item_contents:
+                if item_content and item_content.get('itemType') == 'TimelineTweet':
+                    yield item_content['tweet_results']['result']
+
+
+def _load_input(source: str) -> bytes:
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def write_synthetic(path: str, entries: int, quote_depth: int) -> None:
+    with open(path, 'wb') as f:
+        f.write(json.dumps(generate_timeline(entries, quote_depth), separators=(',', ':')).encode('utf-8'))
+
+
+def _insert_items(entries: int) -> Dict[str, Dict[str, Any]]:
+    with open(INSERT_FIXTURE, 'r', encoding='utf-8') as f:
+        templates = json.load(f)
+    items = {}
+    for i in range(entries):
+        item = dict(templates[i % len(templates)])
+        item['x_id'] = f"bench-{i}-{item['x_id']}"
+        item.update({'username': 'benchmark', 'user_id': 'benchmark', 'user_link': 'https://x.com/benchmark'})
+        items[item['x_id']] = item
+    return items
+
+
+def _load_parser(reference: Optional[str] = None):
+    """This tree's x_parser, or the x_parser.py file at reference (e.g. the parser of an older commit)"""
+    if reference is None:
+        import x_parser
+        return x_parser
+    spec = importlib.util.spec_from_file_location('x_parser_reference', reference)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _blob_id(path: str) -> str:
+    # 与 git rev-parse <commit>:<path> 相同的对象 id，用于记录基线来自哪个版本的解析器
+    with open(path, 'rb') as f:
+        content = f.read()
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+def _prepare(case: str, source: str, insert_rows: int, reference: Optional[str] = None):
+    """
+    Return (function to measure, number of units it processes, untimed reset run before each
+    measurement, cleanup run once the case is done)
+    With reference, the parser cases run the parser in that file instead of this tree's.
+    """
+    if case in ('insert', 'copy', 'insert_async', 'upsert'):
+        from db_utils import collect_x_refs, db_connection, insert_x_data, upsert_x_data, x_engagement_rows
+
+        items = _insert_items(insert_rows)
+        # 引用推文和互动快照按真实推文 id 存储，可能与正式数据重合，只清理基准测试开始后写入的行
+        ref_ids = [row[0] for row in collect_x_refs(items.values())]
+        tweet_ids = [row[0] for row in x_engagement_rows(items.values(), None)]
+        with db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT CURRENT_TIMESTAMP")
+                since = cursor.fetchone()[0]
+
+        def reset():
+            with db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM t_x WHERE x_id LIKE 'bench-%%' AND username = 'benchmark'")
+                    # x_id 的去重记录在 t_x_ids 中，一并清掉
+                    cursor.execute("DELETE FROM t_x_ids WHERE x_id LIKE 'bench-%%'")
+                    # 入库时同一语句写入的 AI 队列和用户统计
+                    cursor.execute("DELETE FROM t_x_ai_queue WHERE x_id LIKE 'bench-%%'")
+                    cursor.execute("DELETE FROM t_x_user_stats WHERE user_id = 'benchmark'")
+                    if ref_ids:
+                        cursor.execute("DELETE FROM t_x_refs WHERE ref_id = ANY(%s) AND updated_at >= %s", (ref_ids, since))
+                    if tweet_ids:
+                        cursor.execute("DELETE FROM t_x_engagement WHERE tweet_id = ANY(%s) AND fetched_at >= %s",
+                                       (tweet_ids, since))
+                conn.commit()
+
+        if case == 'upsert':
+            def reset_stored():
+                reset()
+                insert_x_data(items)
+
+            # 全部行已入库且没有变化：衡量重复抓取时变更检测的开销
+            return (lambda: upsert_x_data(items)), len(items), reset_stored, reset
+        if case == 'insert_async':
+            import asyncio
+            from db_async import insert_x_data_async
+
+            # 连接池绑定在事件循环上，整个用例复用同一个循环
+            loop = asyncio.new_event_loop()
+            return (lambda: loop.run_until_complete(insert_x_data_async(items))), len(items), reset, reset
+        # insert 固定走 execute_values，copy 走 COPY + 合并，两者对比
+        method = 'values' if case == 'insert' else 'copy'
+        return (lambda: insert_x_data(items, method=method)), len(items), reset, reset
+
+    raw = _load_input(source)
+    if case == 'decode_json':
+        return (lambda: json.loads(raw)), _count_entries(json.loads(raw)), None, None
+    if case == 'decode_schema':
+        if reference:
+            # 旧版本没有按模式解码，响应一律用 json.loads 解码
+            return (lambda: json.loads(raw)), _count_entries(json.loads(raw)), None, None
+        from x_schema import decode_response, msgspec
+        if msgspec is None:
+            raise RuntimeError('msgspec is not installed')
+        return (lambda: decode_response('UserTweets', raw, 'schema')), _count_entries(json.loads(raw)), None, None
+
+    data = json.loads(raw)
+    del raw
+    parser = _load_parser(reference)
+    if case == 'parse':
+        return (lambda: parser.parse_user_timeline(data)), _count_entries(data), None, None
+    if case == 'records':
+        # 抓取路径只解析成记录，入库时才转换成字典；没有记录解析器的旧版本抓取时用的是 parse_user_timeline
+        parse_records = getattr(parser, 'parse_user_timeline_records', parser.parse_user_timeline)
+        return (lambda: parse_records(data)), _count_entries(data), None, None
+    if case == 'text':
+        results = list(iter_tweet_results(data))
+        return (lambda: [parser.parse_text_from_tweet(r) for r in results]), len(results), None, None
+    raise ValueError(f'unknown case {case}')
+
+
+def _count_entries(data: Dict[str, Any]) -> int:
+    return sum(1 for _ in iter_tweet_results(data))
+
+
+def _max_rss_mb() -> float:
+    # Linux 上 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def calibrate(rounds: int = 5) -> float:
+    """
+    Seconds of a fixed pure-Python workload (dict lookups, string building, small dicts), best of rounds
+    Case timings are divided by it, so a baseline recorded on one machine holds on another.
+    """
+    rng = random.Random(0)
+    items = [{'rest_id': str(i), 'legacy': {'full_text': f'word{rng.randint(0, 9999)}', 'favorite_count': i}}
+             for i in range(CALIBRATION_ITEMS)]
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(CALIBRATION_PASSES):
+            rows = []
+            for item in items:
+                legacy = item.get('legacy') or {}
+                rows.append({'x_id': 'tweet-' + item['rest_id'], 'full_text': legacy.get('full_text'),
+                             'favorite_count': legacy.get('favorite_count')})
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_case(case: str, source: str, insert_rows: int, repeat: int, reference: Optional[str] = None) -> Dict[str, Any]:
+    """Measure one case; meant to run in a fresh process so peak RSS belongs to it alone"""
+    import contextlib
+    import io
+
+    func, units, reset, cleanup = _prepare(case, source, insert_rows, reference)
+    # 不需要重置的用例每次计时连续运行多遍，单次只有零点几毫秒的用例也能得到稳定的耗时
+    loops_allowed = reset is None
+    reset = reset or (lambda: None)
+    cleanup = cleanup or (lambda: None)
+    rss_before = _max_rss_mb()
+    # 解析器和入库函数会打印日志，基准测试中不需要这些输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        reset()
+        started = time.perf_counter()
+        func()  # 预热
+        warmup = time.perf_counter() - started
+        loops = max(1, int(MIN_SAMPLE_SECONDS / warmup)) if loops_allowed and warmup else 1
+        samples = []
+        for _ in range(repeat):
+            reset()
+            # 每次计时前紧挨着校准，机器负载的波动同时作用在两者上
+            calibration = calibrate()
+            # 从干净的 GC 状态开始：否则是否恰好在计时中对整份输入做一次完整回收，会让耗时相差数倍
+            gc.collect()
+            started = time.perf_counter()
+            for _ in range(loops):
+                func()
+            samples.append(((time.perf_counter() - started) / loops, calibration))
+        reset()
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # upsert 的 reset 会重新写入数据，结束时另行清理
+        cleanup()
+    rss_after = _max_rss_mb()
+    best = min(elapsed for elapsed, _ in samples)
+    return {
+        'units': units,
+        'seconds': round(best, 6),
+        'entries_per_sec': round(units / best, 1) if best else 0.0,
+        'calibration_seconds': round(statistics.median(calibration for _, calibration in samples), 6),
+        # 一次校准循环的时间内处理的条数，取各次计时的中位数
+        'entries_per_calibration': round(statistics.median(
+            units * calibration / elapsed for elapsed, calibration in samples if elapsed), 2) if best else 0.0,
+        'alloc_bytes_per_entry': round(peak / units, 1) if units else 0.0,
+        'peak_rss_mb': round(rss_after, 1),
+        'rss_growth_mb': round(rss_after - rss_before, 1),
+    }
+
+
+def _cases(args, synthetic_path: str) -> List[Dict[str, Any]]:
+    cases = []
+    for fixture in FIXTURES:
+        for case in ('parse', 'records', 'text'):
+            cases.append({'name': f'{case}:{fixture}', 'case': case, 'source': fixture})
+    synthetic = f'synthetic-{args.entries}-q{args.quote_depth}'
+    for case in ('parse', 'records', 'text', 'decode_json', 'decode_schema'):
+        cases.append({'name': f'{case}:{synthetic}', 'case': case, 'source': synthetic_path})
+    if args.db:
+        for case in ('insert', 'copy', 'insert_async', 'upsert'):
+            cases.append({'name': f'{case}:{INSERT_FIXTURE}-{args.insert_rows}', 'case': case, 'source': INSERT_FIXTURE})
+    if args.only:
+        cases = [c for c in cases if any(pattern in c['name'] for pattern in args.only)]
+    return cases
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Return one message per metric that is worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in CHECKED_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f'{name}: {metric} {old} -> {new} ({change:+.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='解析与入库性能基准，结果与已保存的基线比较')
+    parser.add_argument('--entries', type=int, default=5000, help='合成时间线的条目数，可加大到数万条')
+    parser.add_argument('--quote-depth', type=int, default=4, help='合成推文的最大引用嵌套层数')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例重复次数，取最快一次')
+    parser.add_argument('--only', action='append', default=[], help='只运行名称包含该字符串的用例，可重复')
+    parser.add_argument('--db', action='store_true', help='同时测试 execute_values、COPY、asyncpg 三种写入以及无变化时的 upsert（需要数据库，写入后会删除 bench- 数据）')
+    parser.add_argument('--insert-rows', type=int, default=2000, help='insert_x_data 用例写入的行数')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='基线文件')
+    parser.add_argument('--tolerance', type=float, default=float(os.getenv('X_BENCH_TOLERANCE', '0.25')),
+                        help='允许的退化比例，超过即失败')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果覆盖基线')
+    parser.add_argument('--reference', help='解析类用例改为测量该 x_parser.py 文件中的解析器，用于从旧版本生成基线，'
+                                            '例如 git show 87f0510:x_spider/x_parser.py > /tmp/x_parser.py')
+    parser.add_argument('--output', help='将本次结果写入该 JSON 文件')
+    args = parser.parse_args()
+    if args.reference and args.db:
+        parser.error('--reference 只适用于解析类用例，不能与 --db 同时使用')
+
+    if args.db:
+        from dotenv import load_dotenv
+        load_dotenv()
+
+    results = {}
+    failed = []
+    # 每个用例使用新的进程，峰值 RSS 互不影响（ru_maxrss 会跨 exec 继承，所以父进程本身要保持很小）
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # 合成时间线只生成一次，各用例从文件读取
+        synthetic_path = os.path.join(tmp_dir, 'synthetic.json')
+        with ctx.Pool(1) as pool:
+            pool.apply(write_synthetic, (synthetic_path, args.entries, args.quote_depth))
+        for case in _cases(args, synthetic_path):
+            with ctx.Pool(1) as pool:
+                try:
+                    result = pool.apply(run_case, (case['case'], case['source'], args.insert_rows, args.repeat,
+                                                    args.reference))
+                except Exception as e:
+                    print(f"{case['name']:<40} 失败: {e}")
+                    failed.append(case['name'])
+                    continue
+            results[case['name']] = result
+            print(f"{case['name']:<40} {result['entries_per_sec']:>12,.0f} 条/秒  "
+                  f"{result['entries_per_calibration']:>10,.1f} 条/校准  "
+                  f"{result['alloc_bytes_per_entry']:>10,.0f} B/条  峰值 RSS {result['peak_rss_mb']:>7.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        # 记录基线的来源：生成命令以及参考解析器的 git 对象 id
+        baseline['_generated'] = {
+            'command': ' '.join(['python', 'benchmark.py'] + sys.argv[1:]),
+            'reference_parser': _blob_id(args.reference) if args.reference else None,
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f'基线已更新: {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'没有找到基线 {args.baseline}，使用 --update-baseline 生成')
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    regressions += [f'{name}: 运行失败' for name in failed]
+    if regressions:
+        print(f'性能退化超过 {args.tolerance:.0%}:')
+        for line in regressions:
+            print(f'  {line}')
+        sys.exit(1)
+    print(f'与基线相比没有超过 {args.tolerance:.0%} 的退化')
+
+
+if __name__ == "__main__":
+    main()
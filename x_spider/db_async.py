@@ -0,0 +1,130 @@
+import asyncio
+from typing import Any, Dict, List
+
+try:
+    import asyncpg
+except ImportError:  # 未安装 asyncpg 时只能使用同步的 db_utils
+    asyncpg = None
+
+from db_utils import (DB_CONFIG, DB_POOL_MAX, DB_POOL_MIN, DB_POOL_TIMEOUT, X_COLUMNS, X_REF_COLUMNS,
+                      X_REF_CONFLICT_SQL, X_STAGE_SQL, claim_x_rows_sql, collect_x_refs, x_item_row)
+from metrics import metrics
+
+# asyncpg 按连接缓存预处理语句，下面这些固定 SQL 每个连接只 PREPARE 一次
+INSERT_X_STAGE_SQL = f"WITH {claim_x_rows_sql('t_x_stage')} SELECT count(*) FROM inserted"
+
+UPSERT_X_REFS_SQL = (f"INSERT INTO t_x_refs ({', '.join(X_REF_COLUMNS)}) "
+                     f"VALUES ({', '.join(f'${i}' for i in range(1, len(X_REF_COLUMNS) + 1))}) {X_REF_CONFLICT_SQL}")
+
+SELECT_X_USERS_SQL = """
+SELECT user_id, user_name, screen_name, user_link, avatar, expire, created_at, updated_at
+FROM t_x_users
+{where}
+ORDER BY created_at DESC
+"""
+
+_pools: Dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+
+
+async def _init_connection(conn) -> None:
+    # 临时表跟随连接存在（连接池归还时只执行 RESET ALL，不会删除），每个连接建一次
+    await conn.execute(X_STAGE_SQL)
+
+
+async def _create_pool():
+    return await asyncpg.create_pool(
+        host=DB_CONFIG['host'],
+        port=int(DB_CONFIG['port']),
+        user=DB_CONFIG['user'],
+        password=DB_CONFIG['password'],
+        database=DB_CONFIG['dbname'],
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        timeout=DB_POOL_TIMEOUT,
+        init=_init_connection,
+    )
+
+
+async def get_async_pool():
+    """
+    asyncpg pool of the running event loop, created on first use
+    Uses the same DB_* settings and pool sizes as db_utils.
+    """
+    if asyncpg is None:
+        raise RuntimeError('asyncpg is required for the async data-access layer')
+    loop = asyncio.get_running_loop()
+    task = _pools.get(loop)
+    if task is None:
+        # 并发的第一次调用等待同一个创建任务，不会建出多个连接池
+        task = _pools[loop] = loop.create_task(_create_pool())
+    try:
+        return await task
+    except Exception:
+        _pools.pop(loop, None)
+        raise
+
+
+async def close_async_pool() -> None:
+    """Close the pool of the running event loop; call before the loop ends"""
+    task = _pools.pop(asyncio.get_running_loop(), None)
+    if task is not None:
+        pool = await task
+        await pool.close()
+
+
+async def insert_x_data_async(data: Dict[str, Any]) -> int:
+    """
+    Async counterpart of db_utils.insert_x_data
+    Rows are sent with one binary COPY into the connection's t_x_stage, merged with
+    the same x_id claim as the sync path, and the referenced tweets are written
+    with a pipelined executemany, all in one transaction.
+    Args:
+        data: Dictionary containing X data items (dicts or parser records)
+    Returns:
+        Number of rows actually inserted (existing x_ids are skipped)
+    """
+    rows = [x_item_row(x_id, item) for x_id, item in data.items()]
+    refs = collect_x_refs(data.values())
+    if not rows:
+        return 0
+
+    try:
+        pool = await get_async_pool()
+        with metrics.timer('db_op_seconds', op='insert_x_data_async'):
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.copy_records_to_table('t_x_stage', records=rows, columns=X_COLUMNS)
+                    inserted = await conn.fetchval(INSERT_X_STAGE_SQL)
+                    if refs:
+                        await conn.executemany(UPSERT_X_REFS_SQL, refs)
+        metrics.inc('db_items_inserted_total', inserted, table='t_x', method='asyncpg')
+        metrics.inc('db_items_skipped_total', len(rows) - inserted, table='t_x', reason='duplicate')
+        print(f"Successfully batch inserted {inserted}/{len(rows)} records")
+        return inserted
+    except Exception as e:
+        print(f"Error batch inserting data: {e}")
+        raise
+
+
+async def get_all_x_users_async(include_expired: bool = False) -> List[Dict[str, Any]]:
+    """
+    Async counterpart of db_utils.get_all_x_users
+    Args:
+        include_expired: If True, include expired users in the results
+    Returns:
+        List of dictionaries containing user information
+    """
+    query = SELECT_X_USERS_SQL.format(where='' if include_expired else 'WHERE expire = FALSE')
+    try:
+        pool = await get_async_pool()
+        rows = await pool.fetch(query)
+    except Exception as e:
+        print(f"Error retrieving users: {e}")
+        raise
+    users = []
+    for row in rows:
+        user = dict(row)
+        user['created_at'] = user['created_at'].isoformat() if user['created_at'] else None
+        user['updated_at'] = user['updated_at'].isoformat() if user['updated_at'] else None
+        users.append(user)
+    return users
@@ -1,9 +1,17 @@
 import psycopg2
 import psycopg2.extras
-from datetime import datetime
+import psycopg2.pool
+import atexit
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import json
 import os
-from typing import Dict, Any, List, Optional
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from metrics import metrics
+from x_parser import ENTITY_KINDS, item_entities, max_tweet_id, normalize_entity
 
 # Database configuration - should be moved to environment variables in production
 DB_CONFIG = {
@@ -14,6 +22,15 @@ DB_CONFIG = {
     'port': os.getenv('DB_PORT', '5432')
 }
 
+# 连接池配置：最少/最多连接数，空闲多久后借出前先检查连接，池满时等待空闲连接的秒数
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_CHECK_SECONDS = float(os.getenv('DB_POOL_CHECK_SECONDS', '30'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+_MONTHS = {month: i for i, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+
 def parse_twitter_date(date_str: Optional[str]) -> Optional[datetime]:
     """
     Parse Twitter date format 'Tue Sep 20 04:05:29 +0000 2011' to datetime object
@@ -28,6 +45,10 @@ def parse_twitter_date(date_str: Optional[str]) -> Optional[datetime]:
     
     try:
         # Twitter date format: 'Tue Sep 20 04:05:29 +0000 2011'
+        if len(date_str) == 30 and date_str[20:25] == '+0000' and date_str[4:7] in _MONTHS:
+            # 固定格式的 UTC 时间直接按位置解析，比 strptime 快一个数量级
+            return datetime(int(date_str[26:30]), _MONTHS[date_str[4:7]], int(date_str[8:10]),
+                            int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19]), tzinfo=timezone.utc)
         ds = datetime.strptime(date_str, '%a %b %d %H:%M:%S %z %Y')
         return ds
     except (ValueError, TypeError) as e:
@@ -35,145 +56,542 @@ def parse_twitter_date(date_str: Optional[str]) -> Optional[datetime]:
         return datetime.now()
     
 
-def get_db_connection():
-    """Create and return a database connection"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
+class _MeteredCursorMixin:
+    """Count every statement sent to the server and time it by statement type"""
+
+    def execute(self, query, vars=None):
+        text = query.decode('utf-8', 'ignore') if isinstance(query, bytes) else str(query)
+        statement = text.lstrip().split(None, 1)[0].upper() if text.strip() else 'UNKNOWN'
+        metrics.inc('db_round_trips_total', statement=statement)
+        with metrics.timer('db_statement_seconds', statement=statement):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        metrics.inc('db_round_trips_total', len(vars_list), statement='EXECUTEMANY')
+        with metrics.timer('db_statement_seconds', statement='EXECUTEMANY'):
+            return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        metrics.inc('db_round_trips_total', statement='COPY')
+        with metrics.timer('db_statement_seconds', statement='COPY'):
+            return super().copy_expert(sql, file, size)
+
+
+class MeteredCursor(_MeteredCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class MeteredDictCursor(_MeteredCursorMixin, psycopg2.extras.DictCursor):
+    pass
+
+
+class MeteredConnection(psycopg2.extensions.connection):
+    """Connection whose cursors (including DictCursor) report to metrics"""
+
+    _cursor_types = {
+        None: MeteredCursor,
+        psycopg2.extensions.cursor: MeteredCursor,
+        psycopg2.extras.DictCursor: MeteredDictCursor,
+    }
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory')
+        kwargs['cursor_factory'] = self._cursor_types.get(factory, factory)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        metrics.inc('db_round_trips_total', statement='COMMIT')
+        return super().commit()
+
+
+class _ConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """Thread-safe pool that waits for a free connection instead of failing when all are checked out"""
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None):
+        with metrics.timer('db_connect_seconds'):
+            conn = super()._connect(key)
+        conn.last_used = time.monotonic()
+        metrics.inc('db_connections_opened_total')
         return conn
-    except Exception as e:
-        print(f"Error connecting to database: {e}")
-        raise
 
-def create_x_users_table():
-    """Create the X users table if it doesn't exist"""
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS t_x_users (
-        user_id TEXT PRIMARY KEY,
-        user_name TEXT NOT NULL,
-        screen_name TEXT NOT NULL,
-        user_link TEXT NOT NULL,
-        avatar TEXT,
-        expire BOOLEAN DEFAULT FALSE,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
-    """
-    
-    conn = None
+    def _putconn(self, conn, key=None, close=False):
+        # psycopg2 只保留 minconn 个空闲连接、其余直接关闭；并发时会反复建连，这里最多保留 maxconn 个
+        if key is None:
+            key = self._rused.get(id(conn))
+            if key is None:
+                raise psycopg2.pool.PoolError("trying to put unkeyed connection")
+        if close or conn.closed or self.closed:
+            conn.close()
+        else:
+            self._pool.append(conn)
+        if not self.closed or key in self._used:
+            del self._used[key]
+            del self._rused[id(conn)]
+
+    def checkout(self, timeout: float):
+        if not self._slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError(f"No free connection after {timeout}s (DB_POOL_MAX={self.maxconn})")
+        try:
+            return self.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, close: bool = False):
+        try:
+            self.putconn(conn, close=close)
+        finally:
+            self._slots.release()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> _ConnectionPool:
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                # fork 出的子进程不能共用父进程的连接，重新建池（继承来的连接不动）
+                try:
+                    _pool = _ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, connection_factory=MeteredConnection, **DB_CONFIG)
+                except Exception as e:
+                    print(f"Error connecting to database: {e}")
+                    raise
+    return _pool
+
+
+def close_db_pool() -> None:
+    """Close every pooled connection of this process"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid() and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+
+
+atexit.register(close_db_pool)
+
+
+def _is_healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    # 刚归还的连接直接借出；空闲较久的先 SELECT 1，避免拿到已被服务端或网络断开的连接
+    if time.monotonic() - getattr(conn, 'last_used', 0) < DB_POOL_CHECK_SECONDS:
+        return True
     try:
-        conn = get_db_connection()
         with conn.cursor() as cur:
-            cur.execute(create_table_sql)
-        conn.commit()
-        print("Table t_x_users created successfully")
-    except Exception as e:
-        print(f"Error creating table: {e}")
-        if conn:
-            conn.rollback()
-        raise
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def db_connection():
+    """
+    Check out a pooled connection for the duration of a with block
+    Commit inside the block; a transaction left open (e.g. because the block
+    raised) is rolled back, and broken connections are discarded instead of
+    being returned to the pool.
+    """
+    pool = get_db_pool()
+    for _ in range(pool.maxconn + 1):
+        conn = pool.checkout(DB_POOL_TIMEOUT)
+        if _is_healthy(conn):
+            break
+        metrics.inc('db_connections_discarded_total', reason='unhealthy')
+        pool.release(conn, close=True)
+    else:
+        raise psycopg2.OperationalError("Could not get a healthy database connection")
+
+    try:
+        yield conn
     finally:
-        if conn:
-            conn.close()
+        status = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN if conn.closed else conn.info.transaction_status
+        broken = status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        if not broken and status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken:
+            metrics.inc('db_connections_discarded_total', reason='broken')
+        conn.last_used = time.monotonic()
+        pool.release(conn, close=broken)
 
-def create_x_table():
-    """Create the X data table if it doesn't exist"""
-    create_table_sql = """
-    CREATE TABLE IF NOT EXISTS t_x (
-        id SERIAL PRIMARY KEY,
-        x_id TEXT UNIQUE NOT NULL,
-        item_type TEXT NOT NULL,
-        data JSONB NOT NULL,
-        username TEXT,
-        user_id TEXT,
-        user_link TEXT,
-        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-    );
-    
-    -- Create index on x_id for faster lookups
-    CREATE INDEX IF NOT EXISTS idx_t_x_x_id ON t_x(x_id);
-    -- Create index on created_at for ordering
-    CREATE INDEX IF NOT EXISTS idx_t_x_created_at ON t_x(created_at DESC);
-    -- Create index on user_id for user-specific queries
-    CREATE INDEX IF NOT EXISTS idx_t_x_user_id ON t_x(user_id);
+def x_ref_row(ref: Any) -> tuple:
+    """Build the t_x_refs row (ref_id, username, full_text, quoted_id, retweeted_id, data, created_at) for a ReferencedTweet"""
+    return (
+        ref.ref_id,
+        ref.username,
+        ref.full_text,
+        ref.quoted_id,
+        ref.retweeted_id,
+        json.dumps(ref.to_data()),
+        parse_twitter_date(ref.created_at),
+    )
+
+def collect_x_refs(items: Any) -> List[tuple]:
+    """t_x_refs rows for all tweets referenced by the given items, one per ref_id (dict items have none)"""
+    refs = {}
+    for item in items:
+        for ref in getattr(item, 'refs', ()):
+            refs[ref.ref_id] = ref
+    return [x_ref_row(ref) for ref in refs.values()]
+
+X_REF_COLUMNS = ('ref_id', 'username', 'full_text', 'quoted_id', 'retweeted_id', 'data', 'created_at')
+
+# 跟在 INSERT INTO t_x_refs (...) VALUES ... 后面，同步和异步写入共用
+X_REF_CONFLICT_SQL = """
+    ON CONFLICT (ref_id)
+    DO UPDATE SET
+        username = COALESCE(EXCLUDED.username, t_x_refs.username),
+        full_text = EXCLUDED.full_text,
+        quoted_id = COALESCE(EXCLUDED.quoted_id, t_x_refs.quoted_id),
+        retweeted_id = COALESCE(EXCLUDED.retweeted_id, t_x_refs.retweeted_id),
+        data = EXCLUDED.data,
+        created_at = COALESCE(EXCLUDED.created_at, t_x_refs.created_at),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE t_x_refs.data IS DISTINCT FROM EXCLUDED.data
+        OR t_x_refs.full_text IS DISTINCT FROM EXCLUDED.full_text
+    RETURNING ref_id
+    """
+
+def _upsert_x_refs(cur, rows: List[tuple], page_size: int = 1000) -> int:
+    upsert_sql = f"INSERT INTO t_x_refs ({', '.join(X_REF_COLUMNS)}) VALUES %s {X_REF_CONFLICT_SQL}"
+    if not rows:
+        return 0
+    written = psycopg2.extras.execute_values(cur, upsert_sql, rows, page_size=page_size, fetch=True)
+    metrics.inc('db_items_inserted_total', len(written), table='t_x_refs')
+    return len(written)
+
+@metrics.timed('db_op_seconds', op='upsert_x_refs')
+def upsert_x_refs(rows: List[tuple], page_size: int = 1000) -> int:
+    """
+    Insert or refresh referenced tweets in t_x_refs
+    Args:
+        rows: Tuples built by x_ref_row, unique by ref_id
+        page_size: Rows per statement
+    Returns:
+        Number of rows inserted or changed
     """
-    
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute(create_table_sql)
-        conn.commit()
-        print("Table t_x created successfully")
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                written = _upsert_x_refs(cur, rows, page_size)
+            conn.commit()
+            return written
     except Exception as e:
-        print(f"Error creating table: {e}")
-        if conn:
-            conn.rollback()
+        print(f"Error upserting referenced tweets: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
-def insert_x_data(data: Dict[str, Any]) -> None:
+def x_item_row(x_id: str, item: Any) -> tuple:
     """
-    Batch insert X data into the database
+    Build the t_x row (x_id, item_type, data, username, user_id, user_link, created_at,
+    cashtags, mentions, hashtags, contracts, domains) for an item
     Args:
-        data: Dictionary containing X data items
+        x_id: Item id
+        item: X item dictionary or parser record
     """
-    insert_sql = """
-    INSERT INTO t_x (x_id, item_type, data, username, user_id, user_link, created_at)
-    VALUES %s
-    ON CONFLICT (x_id) DO NOTHING
+    # 解析器产出的是 TweetRecord/ConversationRecord，入库前才转换为字典
+    if not isinstance(item, dict):
+        item = item.to_dict()
+    # 尝试从推文数据中获取created_at时间
+    tweet_created_at = datetime.now()
+    if 'created_at' in item:
+        tweet_created_at = parse_twitter_date(item['created_at'])
+    entities = item_entities(item)
+    return (
+        x_id,
+        item.get('itemType'),
+        json.dumps(item.get('data')),
+        item.get('username'),
+        item.get('user_id'),
+        item.get('user_link'),
+        tweet_created_at,
+        *(entities[kind] for kind in ENTITY_KINDS)
+    )
+
+X_COLUMNS = ('x_id', 'item_type', 'data', 'username', 'user_id', 'user_link', 'created_at',
+             'cashtags', 'mentions', 'hashtags', 'contracts', 'domains')
+
+# 达到这个行数的批次走 COPY，小批次（单次抓取）仍用 execute_values
+DB_COPY_MIN_ROWS = int(os.getenv('DB_COPY_MIN_ROWS', '1000'))
+
+def _copy_text(value: str) -> str:
+    # COPY text 格式中反斜杠、换行、回车、制表符需要转义
+    if '\\' in value:
+        value = value.replace('\\', '\\\\')
+    if '\n' in value or '\r' in value or '\t' in value:
+        value = value.replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+    return value
+
+
+def _copy_field(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return _copy_text(value)
+    if isinstance(value, list):
+        # TEXT[] 字面量，元素统一加引号
+        return _copy_text('{' + ','.join('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"' for v in value) + '}')
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return _copy_text(str(value))
+
+
+class _CopyStream:
+    """File-like object feeding rows to COPY FROM STDIN in text format without building the whole payload"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = '\t'.join(map(_copy_field, row)) + '\n'
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+
+# 临时表按会话存在，连接回到连接池后可复用；提交时自动清空
+X_STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS t_x_stage (
+    x_id TEXT,
+    item_type TEXT,
+    data JSONB,
+    username TEXT,
+    user_id TEXT,
+    user_link TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,
+    cashtags TEXT[],
+    mentions TEXT[],
+    hashtags TEXT[],
+    contracts TEXT[],
+    domains TEXT[]
+) ON COMMIT DELETE ROWS
+"""
+
+# VALUES 没有列类型，按 t_x 的列类型显式转换
+X_VALUES_TEMPLATE = ('(%s, %s, %s::jsonb, %s, %s, %s, %s::timestamptz, '
+                     '%s::text[], %s::text[], %s::text[], %s::text[], %s::text[])')
+
+
+# 写回 data 时保留旧数据中还留在 data 里的 ai_result（r 为新行）
+X_DATA_MERGE_SQL = """CASE
+            WHEN jsonb_typeof(t_x.data) = 'object' AND t_x.data ? 'ai_result'
+            THEN r.data || jsonb_build_object('ai_result', t_x.data -> 'ai_result')
+            ELSE r.data
+        END"""
+
+
+# 只有这么多天内的新推文进入 AI 分析队列（回放/补抓的历史推文不再分析）
+AI_QUEUE_MAX_AGE_DAYS = int(os.getenv('X_AI_QUEUE_MAX_AGE_DAYS', '7'))
+
+
+def claim_x_rows_sql(source: str, crawl: bool = True) -> str:
+    """
+    Statement tail inserting the rows of source whose x_id is not in t_x_ids yet
+    t_x is partitioned by created_at and cannot have a unique x_id, so the x_id is
+    claimed in t_x_ids first and only rows whose claim succeeded reach t_x.
+    Recent inserted rows are also enqueued for AI analysis (t_x_ai_queue), and the
+    per-user rollup (t_x_user_stats) is advanced by the inserted rows.
+    Args:
+        source: Relation holding the X_COLUMNS rows
+        crawl: The rows come from a crawl; last_crawled_at is then bumped for every
+               user in source, including users without new rows
+    """
+    columns = ', '.join(X_COLUMNS)
+    selected = ', '.join('claimed.created_at' if column == 'created_at' else f's.{column}' for column in X_COLUMNS)
+    return f"""
+    claimed AS (
+        INSERT INTO t_x_ids (x_id, created_at, fingerprint)
+        SELECT x_id, COALESCE(created_at, CURRENT_TIMESTAMP), t_x_fingerprint(item_type, data) FROM {source}
+        ON CONFLICT (x_id) DO NOTHING
+        RETURNING x_id, created_at
+    ),
+    inserted AS (
+        INSERT INTO t_x ({columns})
+        SELECT {selected} FROM {source} s JOIN claimed USING (x_id)
+        RETURNING 1
+    ),
+    queued AS (
+        INSERT INTO t_x_ai_queue (x_id, created_at)
+        SELECT x_id, created_at FROM claimed
+        WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '{AI_QUEUE_MAX_AGE_DAYS} days'
+        ON CONFLICT (x_id) DO NOTHING
+    ),
+    user_stats AS (
+        INSERT INTO t_x_user_stats AS st (user_id, tweet_count, first_created_at, last_created_at, last_crawled_at)
+        SELECT s.user_id, count(claimed.x_id), min(claimed.created_at), max(claimed.created_at),
+            {'CURRENT_TIMESTAMP' if crawl else 'NULL::timestamptz'}
+        FROM {source} s {'LEFT JOIN' if crawl else 'JOIN'} claimed USING (x_id)
+        WHERE s.user_id IS NOT NULL
+        GROUP BY s.user_id
+        -- 固定加锁顺序，并发批次更新同一批用户时不会死锁
+        ORDER BY s.user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            tweet_count = st.tweet_count + EXCLUDED.tweet_count,
+            first_created_at = LEAST(st.first_created_at, EXCLUDED.first_created_at),
+            last_created_at = GREATEST(st.last_created_at, EXCLUDED.last_created_at),
+            last_crawled_at = COALESCE(EXCLUDED.last_crawled_at, st.last_crawled_at),
+            updated_at = CURRENT_TIMESTAMP
+    )
     """
 
-        # UPDATE SET 
-        # data = EXCLUDED.data,
-        # username = EXCLUDED.username,
-        # user_id = EXCLUDED.user_id,
-        # user_link = EXCLUDED.user_link,
-        # created_at = EXCLUDED.created_at
 
-    
-    conn = None
-    try:
-        conn = get_db_connection()
-        # 准备批量插入的数据
-        values = []
-        for x_id, item in data.items():
-            # 尝试从推文数据中获取created_at时间
-            tweet_created_at = datetime.now()
-            if 'created_at' in item:
-                tweet_created_at = parse_twitter_date(item['created_at'])
-            
-            values.append((
-                x_id,
-                item.get('itemType'),
-                json.dumps(item.get('data')),
-                item.get('username'),
-                item.get('user_id'),
-                item.get('user_link'),
-                tweet_created_at
-            ))
-        
-        
+def refresh_x_rows_sql(source: str) -> str:
+    """
+    Statement tail rewriting the existing rows of source whose fingerprint changed
+    The fingerprints are compared in t_x_ids, so unchanged rows are neither read
+    nor written in t_x; changed rows get the new item_type, data and entities.
+    """
+    entities = ',\n        '.join(f'{kind} = r.{kind}' for kind in ENTITY_KINDS)
+    return f"""
+    changed AS (
+        UPDATE t_x_ids SET fingerprint = f.fingerprint
+        FROM (SELECT x_id, t_x_fingerprint(item_type, data) AS fingerprint FROM {source}) f
+        WHERE t_x_ids.x_id = f.x_id AND t_x_ids.fingerprint IS DISTINCT FROM f.fingerprint
+        RETURNING t_x_ids.x_id, t_x_ids.created_at
+    ),
+    updated AS (
+        UPDATE t_x SET
+        item_type = r.item_type,
+        data = {X_DATA_MERGE_SQL},
+        {entities}
+        FROM {source} r JOIN changed c USING (x_id)
+        WHERE t_x.x_id = r.x_id AND t_x.created_at = c.created_at
+        RETURNING 1
+    )
+    """
+
+
+def _x_rows_sql(source: str, refresh: bool, crawl: bool = True) -> str:
+    # 结果为 (新增行数, 更新行数)
+    if refresh:
+        return f"""{refresh_x_rows_sql(source)},
+    {claim_x_rows_sql(source, crawl)}
+    SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM updated)
+    """
+    return f"""{claim_x_rows_sql(source, crawl)}
+    SELECT count(*), 0 FROM inserted
+    """
+
+
+def _insert_x_rows_values(cur, rows: List[tuple], refresh: bool = False, crawl: bool = True) -> Tuple[int, int]:
+    insert_sql = f"""
+    WITH rows ({', '.join(X_COLUMNS)}) AS (VALUES %s),
+    {_x_rows_sql('rows', refresh, crawl)}
+    """
+    written = psycopg2.extras.execute_values(
+        cur,
+        insert_sql,
+        rows,
+        template=X_VALUES_TEMPLATE,
+        page_size=100,  # 每批次插入100条数据
+        fetch=True
+    )
+    return sum(inserted for inserted, _ in written), sum(updated for _, updated in written)
+
+
+def _insert_x_rows_copy(cur, rows, refresh: bool = False, crawl: bool = True) -> Tuple[int, int]:
+    cur.execute(X_STAGE_SQL)
+    cur.copy_expert(f"COPY t_x_stage ({', '.join(X_COLUMNS)}) FROM STDIN", _CopyStream(rows))
+    # 与 execute_values 路径相同的冲突语义：已存在的 x_id 跳过（或只更新有变化的行）
+    cur.execute(f"WITH {_x_rows_sql('t_x_stage', refresh, crawl)}")
+    return cur.fetchone()
+
+
+def _write_x_data(data: Dict[str, Any], method: Optional[str], refresh: bool, crawl: bool = True) -> Dict[str, int]:
+    if method is None:
+        method = 'copy' if len(data) >= DB_COPY_MIN_ROWS else 'values'
+
+    with db_connection() as conn:
         with conn.cursor() as cur:
-            # 使用execute_values进行批量插入
-            psycopg2.extras.execute_values(
-                cur,
-                insert_sql,
-                values,
-                template=None,  # 使用默认模板
-                page_size=100   # 每批次插入100条数据
-            )
+            if method == 'copy':
+                # 行在 COPY 读取时才逐条生成
+                rows = (x_item_row(x_id, item) for x_id, item in data.items())
+                inserted, updated = _insert_x_rows_copy(cur, rows, refresh, crawl)
+            else:
+                rows = [x_item_row(x_id, item) for x_id, item in data.items()]
+                inserted, updated = _insert_x_rows_values(cur, rows, refresh, crawl)
+            # 被引用/转发的推文与推文本身在同一事务中写入
+            _upsert_x_refs(cur, collect_x_refs(data.values()))
         conn.commit()
-        print(f"Successfully batch inserted {len(data)} records")
+    stats = {'inserted': inserted, 'updated': updated, 'unchanged': len(data) - inserted - updated}
+    metrics.inc('db_items_inserted_total', inserted, table='t_x', method=method)
+    if refresh:
+        metrics.inc('db_items_updated_total', updated, table='t_x')
+        metrics.inc('db_items_skipped_total', stats['unchanged'], table='t_x', reason='unchanged')
+    else:
+        metrics.inc('db_items_skipped_total', stats['unchanged'], table='t_x', reason='duplicate')
+    return stats
+
+
+@metrics.timed('db_op_seconds', op='insert_x_data')
+def insert_x_data(data: Dict[str, Any], method: Optional[str] = None, crawl: bool = True) -> int:
+    """
+    Batch insert X data into the database
+    Args:
+        data: Dictionary containing X data items (dicts or parser records)
+        method: 'values' (multi-row INSERT) or 'copy' (COPY into a staging table,
+                then one INSERT ... SELECT); by default batches of DB_COPY_MIN_ROWS
+                or more use COPY
+        crawl: The items were just crawled; False (e.g. archive replay) leaves
+               last_crawled_at in t_x_user_stats untouched
+    Returns:
+        Number of rows actually inserted (existing x_ids are skipped)
+    """
+    try:
+        stats = _write_x_data(data, method, refresh=False, crawl=crawl)
+        print(f"Successfully batch inserted {stats['inserted']}/{len(data)} records")
+        return stats['inserted']
     except Exception as e:
         print(f"Error batch inserting data: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
+
+@metrics.timed('db_op_seconds', op='upsert_x_data')
+def upsert_x_data(data: Dict[str, Any], method: Optional[str] = None) -> Dict[str, int]:
+    """
+    Batch insert X data, refreshing existing rows whose content or engagement changed
+    Each row's fingerprint (see migrations/0011) is compared with the stored one,
+    so re-crawled tweets whose counts did not move cause no writes to t_x.
+    Args:
+        data: Dictionary containing X data items (dicts or parser records)
+        method: 'values' or 'copy', as in insert_x_data
+    Returns:
+        Dictionary with inserted, updated and unchanged counts
+    """
+    try:
+        stats = _write_x_data(data, method, refresh=True)
+        print(f"Successfully upserted {len(data)} records: inserted {stats['inserted']}, "
+              f"updated {stats['updated']}, unchanged {stats['unchanged']}")
+        return stats
+    except Exception as e:
+        print(f"Error batch upserting data: {e}")
+        raise
 
 def upsert_x_user(user_datas: List[Dict[str, Any]]) -> None:
     """
@@ -193,31 +611,31 @@ def upsert_x_user(user_datas: List[Dict[str, Any]]) -> None:
         updated_at = CURRENT_TIMESTAMP;
     """
     
-    conn = None
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cur:
-            values = [
-                (
-                    user_data['user_id'],
-                    user_data['user_name'],
-                    user_data['screen_name'],
-                    user_data['user_link'],
-                    user_data.get('avatar')  # avatar is optional
-                )
-                for user_data in user_datas
-            ]
-            cur.executemany(upsert_sql, values)
-        conn.commit()
-        print(f"Successfully upserted users")
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                values = [
+                    (
+                        user_data['user_id'],
+                        user_data['user_name'],
+                        user_data['screen_name'],
+                        user_data['user_link'],
+                        user_data.get('avatar')  # avatar is optional
+                    )
+                    for user_data in user_datas
+                ]
+                cur.executemany(upsert_sql, values)
+            conn.commit()
+            print(f"Successfully upserted users")
     except Exception as e:
         print(f"Error upserting user data: {e}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
+
+def _user_row_to_dict(row) -> Dict[str, Any]:
+    user = dict(row)
+    user['created_at'] = user['created_at'].isoformat() if user['created_at'] else None
+    user['updated_at'] = user['updated_at'].isoformat() if user['updated_at'] else None
+    return user
 
 def get_all_x_users(include_expired: bool = False) -> list:
     """
@@ -245,30 +663,995 @@ def get_all_x_users(include_expired: bool = False) -> list:
     
     select_sql += " ORDER BY created_at DESC"
     
-    conn = None
-    try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute(select_sql)
-            results = cur.fetchall()
-            # Convert results to list of dictionaries and handle datetime serialization
-            users = []
-            for row in results:
-                user = dict(row)
-                user['created_at'] = user['created_at'].isoformat() if user['created_at'] else None
-                user['updated_at'] = user['updated_at'].isoformat() if user['updated_at'] else None
-                users.append(user)
-            return users
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(select_sql)
+                results = cur.fetchall()
+                # Convert results to list of dictionaries and handle datetime serialization
+                return [_user_row_to_dict(row) for row in results]
     except Exception as e:
         print(f"Error retrieving users: {e}")
         raise
-    finally:
-        if conn:
-            conn.close()
 
-# Initialize tables when module is imported
-try:
-    create_x_table()
-    create_x_users_table()
-except Exception as e:
-    print(f"Warning: Could not initialize tables: {e}")
+def get_crawl_states() -> Dict[str, Optional[int]]:
+    """
+    Retrieve the newest crawled tweet id of every user
+    Returns:
+        Dictionary mapping user_id to last_tweet_id
+    """
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT user_id, last_tweet_id FROM t_x_crawl_state")
+                return {user_id: last_tweet_id for user_id, last_tweet_id in cur.fetchall()}
+    except Exception as e:
+        print(f"Error retrieving crawl states: {e}")
+        raise
+
+def update_crawl_states(states: List[Dict[str, Any]]) -> None:
+    """
+    Record crawl progress for users; last_tweet_id only ever moves forward
+    Args:
+        states: List of dictionaries with user_id, last_tweet_id and new_count
+    """
+    if not states:
+        return
+
+    upsert_sql = """
+    INSERT INTO t_x_crawl_state (user_id, last_tweet_id, last_new_count, last_crawled_at, updated_at)
+    VALUES %s
+    ON CONFLICT (user_id)
+    DO UPDATE SET
+        last_tweet_id = GREATEST(t_x_crawl_state.last_tweet_id, EXCLUDED.last_tweet_id),
+        last_new_count = EXCLUDED.last_new_count,
+        last_crawled_at = EXCLUDED.last_crawled_at,
+        updated_at = CURRENT_TIMESTAMP
+    """
+
+    try:
+        with db_connection() as conn:
+            values = [
+                (state['user_id'], state.get('last_tweet_id'), state.get('new_count', 0))
+                for state in states
+            ]
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(
+                    cur,
+                    upsert_sql,
+                    values,
+                    template="(%s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+                    page_size=100
+                )
+            conn.commit()
+    except Exception as e:
+        print(f"Error updating crawl states: {e}")
+        raise
+
+def get_due_x_users() -> list:
+    """
+    Retrieve non-expired users whose next poll time has arrived (or was never set)
+    Returns:
+        List of dictionaries containing user information, most overdue first
+    """
+    select_sql = """
+    SELECT
+        u.user_id,
+        u.user_name,
+        u.screen_name,
+        u.user_link,
+        u.avatar,
+        u.expire,
+        u.created_at,
+        u.updated_at
+    FROM t_x_users u
+    LEFT JOIN t_x_crawl_state s ON s.user_id = u.user_id
+    WHERE u.expire = FALSE
+      AND (s.next_poll_at IS NULL OR s.next_poll_at <= CURRENT_TIMESTAMP)
+    ORDER BY s.next_poll_at ASC NULLS FIRST
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(select_sql)
+                return [_user_row_to_dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error retrieving due users: {e}")
+        raise
+
+def get_user_post_counts(user_ids: List[str], hours: float) -> Dict[str, int]:
+    """
+    Count each user's t_x items created within the last `hours` hours
+    Args:
+        user_ids: Users to count
+        hours: Look-back window in hours
+    Returns:
+        Dictionary mapping user_id to item count (0 for users without items)
+    """
+    select_sql = """
+    SELECT u.user_id, COUNT(x.id)
+    FROM unnest(%s::text[]) AS u(user_id)
+    LEFT JOIN t_x x
+      ON x.user_id = u.user_id
+     AND x.created_at >= CURRENT_TIMESTAMP - make_interval(secs => %s)
+    GROUP BY u.user_id
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(select_sql, (list(user_ids), hours * 3600))
+                return {user_id: count for user_id, count in cur.fetchall()}
+    except Exception as e:
+        print(f"Error counting user posts: {e}")
+        raise
+
+def update_poll_schedule(schedules: List[Dict[str, Any]]) -> None:
+    """
+    Store the estimated posting rate and next poll time of users
+    Args:
+        schedules: List of dictionaries with user_id, post_rate and next_poll_at
+    """
+    if not schedules:
+        return
+
+    upsert_sql = """
+    INSERT INTO t_x_crawl_state (user_id, post_rate, next_poll_at, updated_at)
+    VALUES %s
+    ON CONFLICT (user_id)
+    DO UPDATE SET
+        post_rate = EXCLUDED.post_rate,
+        next_poll_at = EXCLUDED.next_poll_at,
+        updated_at = CURRENT_TIMESTAMP
+    """
+
+    try:
+        with db_connection() as conn:
+            values = [(item['user_id'], item['post_rate'], item['next_poll_at']) for item in schedules]
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(
+                    cur,
+                    upsert_sql,
+                    values,
+                    template="(%s, %s, %s, CURRENT_TIMESTAMP)",
+                    page_size=100
+                )
+            conn.commit()
+    except Exception as e:
+        print(f"Error updating poll schedule: {e}")
+        raise
+
+def get_db_time() -> datetime:
+    """
+    Current time of the database server
+    Lease and attempt timestamps are written with the database's CURRENT_TIMESTAMP,
+    so cutoffs compared with them must come from the same clock.
+    """
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT CURRENT_TIMESTAMP")
+                return cur.fetchone()[0]
+    except Exception as e:
+        print(f"Error fetching database time: {e}")
+        raise
+
+def claim_x_users(worker_id: str, limit: int, lease_seconds: int, due_only: bool = False,
+                  attempted_before: Optional[datetime] = None) -> list:
+    """
+    Lease a batch of users to one crawler worker
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so concurrent workers always get
+    disjoint users; a lease that is not released (crashed worker) expires after
+    lease_seconds and the users become claimable again.
+    Args:
+        worker_id: Identifier of the claiming worker
+        limit: Maximum number of users to claim
+        lease_seconds: Lease length in seconds
+        due_only: Only claim users whose next_poll_at has arrived
+        attempted_before: Skip users claimed at or after this time (already tried in this sweep)
+    Returns:
+        List of user dictionaries, each with its last_tweet_id high-water mark
+    """
+    ensure_state_sql = """
+    INSERT INTO t_x_crawl_state (user_id)
+    SELECT user_id FROM t_x_users WHERE expire = FALSE
+    ON CONFLICT (user_id) DO NOTHING
+    """
+    claim_sql = """
+    WITH claimable AS (
+        SELECT s.user_id
+        FROM t_x_crawl_state s
+        JOIN t_x_users u ON u.user_id = s.user_id
+        WHERE u.expire = FALSE
+          AND (s.lease_until IS NULL OR s.lease_until < CURRENT_TIMESTAMP)
+          AND (%(due_only)s = FALSE OR s.next_poll_at IS NULL OR s.next_poll_at <= CURRENT_TIMESTAMP)
+          AND (%(attempted_before)s::timestamptz IS NULL OR s.last_attempt_at IS NULL OR s.last_attempt_at < %(attempted_before)s)
+        ORDER BY s.next_poll_at ASC NULLS FIRST, s.last_attempt_at ASC NULLS FIRST
+        LIMIT %(limit)s
+        FOR UPDATE OF s SKIP LOCKED
+    )
+    UPDATE t_x_crawl_state s
+    SET lease_owner = %(worker_id)s,
+        lease_until = CURRENT_TIMESTAMP + make_interval(secs => %(lease_seconds)s),
+        last_attempt_at = CURRENT_TIMESTAMP
+    FROM claimable c, t_x_users u
+    WHERE s.user_id = c.user_id AND u.user_id = s.user_id
+    RETURNING
+        u.user_id,
+        u.user_name,
+        u.screen_name,
+        u.user_link,
+        u.avatar,
+        u.expire,
+        u.created_at,
+        u.updated_at,
+        s.last_tweet_id
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(ensure_state_sql)
+                cur.execute(claim_sql, {
+                    'worker_id': worker_id,
+                    'limit': limit,
+                    'lease_seconds': lease_seconds,
+                    'due_only': due_only,
+                    'attempted_before': attempted_before,
+                })
+                users = [_user_row_to_dict(row) for row in cur.fetchall()]
+            conn.commit()
+            return users
+    except Exception as e:
+        print(f"Error claiming users: {e}")
+        raise
+
+def release_x_users(worker_id: str, user_ids: List[str]) -> None:
+    """
+    Release leases held by a worker
+    Args:
+        worker_id: Identifier of the worker that claimed the users
+        user_ids: Users to release
+    """
+    if not user_ids:
+        return
+
+    release_sql = """
+    UPDATE t_x_crawl_state
+    SET lease_owner = NULL, lease_until = NULL
+    WHERE user_id = ANY(%s) AND lease_owner = %s
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(release_sql, (list(user_ids), worker_id))
+            conn.commit()
+    except Exception as e:
+        print(f"Error releasing users: {e}")
+        raise
+
+def get_backfill_states(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Retrieve saved backfill checkpoints
+    Args:
+        user_ids: Users to look up
+    Returns:
+        Dictionary mapping user_id to its checkpoint row
+    """
+    select_sql = """
+    SELECT user_id, cursor, target_date, target_count, fetched_count, oldest_created_at, done
+    FROM t_x_backfill
+    WHERE user_id = ANY(%s)
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(select_sql, (list(user_ids),))
+                return {row['user_id']: dict(row) for row in cur.fetchall()}
+    except Exception as e:
+        print(f"Error retrieving backfill states: {e}")
+        raise
+
+def save_backfill_checkpoints(states: List[Dict[str, Any]]) -> None:
+    """
+    Persist backfill cursors; called only after the pages they follow are written
+    Args:
+        states: List of dictionaries with user_id, cursor, target_date, target_count,
+                fetched_count, oldest_created_at and done
+    """
+    if not states:
+        return
+
+    upsert_sql = """
+    INSERT INTO t_x_backfill (user_id, cursor, target_date, target_count, fetched_count, oldest_created_at, done, updated_at)
+    VALUES %s
+    ON CONFLICT (user_id)
+    DO UPDATE SET
+        cursor = EXCLUDED.cursor,
+        target_date = EXCLUDED.target_date,
+        target_count = EXCLUDED.target_count,
+        fetched_count = EXCLUDED.fetched_count,
+        oldest_created_at = LEAST(t_x_backfill.oldest_created_at, EXCLUDED.oldest_created_at),
+        done = EXCLUDED.done,
+        updated_at = CURRENT_TIMESTAMP
+    """
+
+    # 同一批次中同一用户可能有多页，只保留最后一页的检查点
+    latest = {}
+    for state in states:
+        latest[state['user_id']] = state
+
+    try:
+        with db_connection() as conn:
+            values = [
+                (
+                    state['user_id'],
+                    state.get('cursor'),
+                    state.get('target_date'),
+                    state.get('target_count'),
+                    state.get('fetched_count', 0),
+                    state.get('oldest_created_at'),
+                    state.get('done', False)
+                )
+                for state in latest.values()
+            ]
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(
+                    cur,
+                    upsert_sql,
+                    values,
+                    template="(%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)",
+                    page_size=100
+                )
+            conn.commit()
+    except Exception as e:
+        print(f"Error saving backfill checkpoints: {e}")
+        raise
+
+@metrics.timed('db_op_seconds', op='reparse_x_rows')
+def reparse_x_rows(rows: List[tuple], page_size: int = 1000) -> Dict[str, int]:
+    """
+    Write re-parsed rows back to t_x in set-based batches
+    Existing rows get the new item_type/data/created_at (only when they changed),
+    missing rows are inserted. Rows must have unique x_ids. Rows whose x_id is
+    only left in t_x_ids (their partition was detached) are counted as unchanged.
+    Args:
+        rows: Tuples built by x_item_row
+        page_size: Rows per statement
+    Returns:
+        Dictionary with inserted, updated and unchanged counts
+    """
+    if not rows:
+        return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    upsert_sql = f"""
+    WITH rows ({', '.join(X_COLUMNS)}) AS (VALUES %s),
+    updated AS (
+        UPDATE t_x SET
+            item_type = r.item_type,
+            data = {X_DATA_MERGE_SQL},
+            username = COALESCE(t_x.username, r.username),
+            user_id = COALESCE(t_x.user_id, r.user_id),
+            user_link = COALESCE(t_x.user_link, r.user_link),
+            -- created_at 变化时行会移动到对应月份的分区
+            created_at = COALESCE(r.created_at, t_x.created_at),
+            cashtags = r.cashtags,
+            mentions = r.mentions,
+            hashtags = r.hashtags,
+            contracts = r.contracts,
+            domains = r.domains
+        FROM rows r JOIN t_x_ids i USING (x_id)
+        WHERE t_x.x_id = r.x_id AND t_x.created_at = i.created_at
+            AND (t_x.data - 'ai_result' IS DISTINCT FROM r.data
+                OR t_x.item_type IS DISTINCT FROM r.item_type
+                OR t_x.cashtags IS NULL)
+        RETURNING t_x.x_id, t_x.created_at, t_x_fingerprint(t_x.item_type, t_x.data) AS fingerprint
+    ),
+    moved AS (
+        UPDATE t_x_ids SET created_at = u.created_at, fingerprint = u.fingerprint
+        FROM updated u
+        WHERE t_x_ids.x_id = u.x_id
+    ),
+    {claim_x_rows_sql('rows', crawl=False)}
+    SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM updated)
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                written = psycopg2.extras.execute_values(cur, upsert_sql, rows, template=X_VALUES_TEMPLATE,
+                                                         page_size=page_size, fetch=True)
+            conn.commit()
+            inserted = sum(count for count, _ in written)
+            updated = sum(count for _, count in written)
+            stats = {'inserted': inserted, 'updated': updated, 'unchanged': len(rows) - inserted - updated}
+            for key, value in stats.items():
+                metrics.inc('db_items_reparsed_total', value, table='t_x', result=key)
+            return stats
+    except Exception as e:
+        print(f"Error writing re-parsed rows: {e}")
+        raise
+
+def get_reparse_progress(job: str) -> Dict[str, int]:
+    """
+    Segments already written by a re-parse job
+    Returns:
+        Dictionary mapping segment name to its size when it was processed
+    """
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT segment, segment_size FROM t_x_reparse WHERE job = %s", (job,))
+                return {segment: size for segment, size in cur.fetchall()}
+    except Exception as e:
+        print(f"Error fetching re-parse progress: {e}")
+        raise
+
+def mark_reparse_segment(job: str, segment: str, segment_size: int, stats: Dict[str, int]) -> None:
+    """Record that all rows of a segment have been written for a re-parse job"""
+    upsert_sql = """
+    INSERT INTO t_x_reparse (job, segment, segment_size, records, items, inserted, updated, finished_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+    ON CONFLICT (job, segment)
+    DO UPDATE SET
+        segment_size = EXCLUDED.segment_size,
+        records = EXCLUDED.records,
+        items = EXCLUDED.items,
+        inserted = EXCLUDED.inserted,
+        updated = EXCLUDED.updated,
+        finished_at = CURRENT_TIMESTAMP
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(upsert_sql, (
+                    job, segment, segment_size,
+                    stats.get('records', 0), stats.get('items', 0), stats.get('inserted', 0), stats.get('updated', 0)
+                ))
+            conn.commit()
+    except Exception as e:
+        print(f"Error saving re-parse progress: {e}")
+        raise
+
+def find_x_by_entities(cashtags: Optional[List[str]] = None, mentions: Optional[List[str]] = None,
+                       hashtags: Optional[List[str]] = None, contracts: Optional[List[str]] = None,
+                       domains: Optional[List[str]] = None, hours: Optional[float] = 24,
+                       limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Find X items mentioning any of the given entities, newest first
+    Each list is matched with the GIN-indexed array overlap operator, and lists
+    are combined with OR, e.g. cashtags=['XYZ'], contracts=['0x...'].
+    Args:
+        cashtags/mentions/hashtags/contracts/domains: Values to look for, normalized like extract_entities
+        hours: Only items created within this many hours (None for all)
+        limit: Maximum number of rows
+    Returns:
+        List of t_x rows as dictionaries
+    """
+    wanted = {
+        'cashtags': cashtags, 'mentions': mentions, 'hashtags': hashtags,
+        'contracts': contracts, 'domains': domains,
+    }
+    conditions, params = [], []
+    for kind in ENTITY_KINDS:
+        values = [normalize_entity(kind, value) for value in wanted[kind] or [] if value]
+        if values:
+            conditions.append(f"{kind} && %s::text[]")
+            params.append(values)
+    if not conditions:
+        return []
+
+    query = f"""
+    SELECT x_id, item_type, data, username, user_id, user_link, created_at,
+           cashtags, mentions, hashtags, contracts, domains
+    FROM t_x
+    WHERE ({' OR '.join(conditions)})
+    """
+    if hours is not None:
+        query += " AND created_at >= CURRENT_TIMESTAMP - make_interval(secs => %s)"
+        params.append(hours * 3600)
+    query += " ORDER BY created_at DESC LIMIT %s"
+    params.append(limit)
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(query, params)
+                return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error finding X data by entities: {e}")
+        raise
+
+def get_x_rows_without_entities(after_id: int, limit: int) -> List[tuple]:
+    """
+    Rows whose entity columns were never filled, in id order
+    Returns:
+        List of (id, item_type, data) tuples with id > after_id
+    """
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT id, item_type, data FROM t_x WHERE id > %s AND cashtags IS NULL ORDER BY id LIMIT %s",
+                    (after_id, limit)
+                )
+                return cur.fetchall()
+    except Exception as e:
+        print(f"Error fetching rows without entities: {e}")
+        raise
+
+def update_x_entities(rows: List[tuple], page_size: int = 1000) -> None:
+    """
+    Set the entity columns of existing rows in set-based batches
+    Args:
+        rows: Tuples of (id, cashtags, mentions, hashtags, contracts, domains)
+    """
+    if not rows:
+        return
+
+    update_sql = """
+    UPDATE t_x SET
+        cashtags = v.cashtags,
+        mentions = v.mentions,
+        hashtags = v.hashtags,
+        contracts = v.contracts,
+        domains = v.domains
+    FROM (VALUES %s) AS v (id, cashtags, mentions, hashtags, contracts, domains)
+    WHERE t_x.id = v.id
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(
+                    cur,
+                    update_sql,
+                    rows,
+                    template="(%s, %s::text[], %s::text[], %s::text[], %s::text[], %s::text[])",
+                    page_size=page_size
+                )
+            conn.commit()
+    except Exception as e:
+        print(f"Error updating entities: {e}")
+        raise
+
+def ensure_x_partitions(months_ahead: int = 3) -> List[str]:
+    """
+    Create the monthly t_x partitions from the current month up to months_ahead ahead
+    Rows of those months that already landed in t_x_default are moved into them.
+    Returns:
+        Names of the partitions that were created
+    """
+    created = []
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT generate_series(0, %s) * INTERVAL '1 month' "
+                    "+ date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC')",
+                    (months_ahead,)
+                )
+                for (month_start,) in cur.fetchall():
+                    # 每个分区单独提交，避免长时间持有父表的锁
+                    cur.execute("SELECT t_x_ensure_partition(%s::date)", (month_start,))
+                    name = cur.fetchone()[0]
+                    conn.commit()
+                    if name:
+                        created.append(name)
+            return created
+    except Exception as e:
+        print(f"Error creating partitions: {e}")
+        raise
+
+def list_x_partitions() -> List[Dict[str, Any]]:
+    """
+    Partitions currently attached to t_x, oldest first
+    Returns:
+        List of dictionaries with name, bound, rows (planner estimate) and bytes
+    """
+    query = """
+    SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound,
+           GREATEST(c.reltuples, 0)::bigint AS rows, pg_total_relation_size(c.oid) AS bytes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 't_x'::regclass
+    ORDER BY c.relname
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(query)
+                return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error listing partitions: {e}")
+        raise
+
+def detach_x_partition(name: str, export_file: Any = None, drop: bool = False) -> None:
+    """
+    Detach a monthly partition from t_x, optionally exporting and dropping it
+    Its x_ids stay in t_x_ids, so the archived tweets are not inserted again.
+    Args:
+        name: Partition name (t_x_YYYYMM)
+        export_file: Binary file object receiving all columns in COPY text format
+        drop: Drop the table after detaching (and exporting)
+    """
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT 1 FROM pg_inherits WHERE inhparent = 't_x'::regclass AND inhrelid = to_regclass(%s)",
+                    (name,)
+                )
+                if cur.fetchone() is None:
+                    raise ValueError(f"{name} is not a partition of t_x")
+                table = psycopg2.extensions.quote_ident(name, cur)
+                cur.execute(f"ALTER TABLE t_x DETACH PARTITION {table}")
+                if export_file is not None:
+                    # 列顺序与 t_x 相同，可直接 COPY t_x FROM STDIN 恢复
+                    cur.copy_expert(f"COPY {table} TO STDOUT", export_file)
+                if drop:
+                    cur.execute(f"DROP TABLE {table}")
+            conn.commit()
+    except Exception as e:
+        print(f"Error detaching partition {name}: {e}")
+        raise
+
+def _engagement_sources(item: Any):
+    # (x_id, 计数来源) 对：解析器记录直接取字段，字典取 data 中的计数
+    if isinstance(item, dict):
+        data = item.get('data')
+        if isinstance(data, list):
+            return [(tweet.get('x_id'), tweet.get('data') or {}) for tweet in data]
+        return [(item.get('x_id'), data or {})]
+    tweets = getattr(item, 'tweets', None)
+    if tweets is not None:
+        return [(tweet.x_id, {'favorite_count': tweet.favorite_count, 'bookmark_count': tweet.bookmark_count,
+                              'view_count': tweet.view_count}) for tweet in tweets]
+    return [(item.x_id, {'favorite_count': item.favorite_count, 'bookmark_count': item.bookmark_count,
+                         'view_count': item.view_count})]
+
+def x_engagement_rows(items: Any, fetched_at: datetime) -> List[tuple]:
+    """
+    t_x_engagement rows (tweet_id, fetched_at, favorite_count, bookmark_count, view_count)
+    for the tweets of the given items, one per tweet; tweets without any counter are skipped
+    Args:
+        items: X items (dicts or parser records)
+        fetched_at: When the items were crawled
+    """
+    rows = {}
+    for item in items:
+        for x_id, counts in _engagement_sources(item):
+            tweet_id = max_tweet_id(x_id)
+            favorite, bookmark, views = counts.get('favorite_count'), counts.get('bookmark_count'), counts.get('view_count')
+            if tweet_id is None or (favorite is None and bookmark is None and views is None):
+                continue
+            rows[tweet_id] = (tweet_id, fetched_at, favorite, bookmark, views)
+    return list(rows.values())
+
+@metrics.timed('db_op_seconds', op='insert_x_engagement')
+def insert_x_engagement(rows: List[tuple], page_size: int = 1000) -> int:
+    """
+    Append engagement snapshots built by x_engagement_rows
+    Returns:
+        Number of snapshots written (a repeated (tweet_id, fetched_at) is skipped)
+    """
+    if not rows:
+        return 0
+
+    insert_sql = """
+    INSERT INTO t_x_engagement (tweet_id, fetched_at, favorite_count, bookmark_count, view_count)
+    VALUES %s
+    ON CONFLICT (tweet_id, fetched_at) DO NOTHING
+    RETURNING 1
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                written = psycopg2.extras.execute_values(cur, insert_sql, rows, page_size=page_size, fetch=True)
+            conn.commit()
+            metrics.inc('db_items_inserted_total', len(written), table='t_x_engagement')
+            return len(written)
+    except Exception as e:
+        print(f"Error inserting engagement snapshots: {e}")
+        raise
+
+def ensure_x_engagement_partitions(days_ahead: int = 7) -> List[str]:
+    """
+    Create the daily t_x_engagement partitions from today up to days_ahead ahead
+    Returns:
+        Names of the partitions that were created
+    """
+    created = []
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                for offset in range(days_ahead + 1):
+                    cur.execute(
+                        "SELECT t_x_engagement_ensure_partition((CURRENT_TIMESTAMP AT TIME ZONE 'UTC')::date + %s)",
+                        (offset,)
+                    )
+                    name = cur.fetchone()[0]
+                    conn.commit()
+                    if name:
+                        created.append(name)
+            return created
+    except Exception as e:
+        print(f"Error creating engagement partitions: {e}")
+        raise
+
+# 每个 (tweet_id, 小时) 保留该小时内最后一次抓取的计数
+_ENGAGEMENT_ROLLUP_SQL = """
+{prefix}INSERT INTO t_x_engagement_hourly (tweet_id, bucket, favorite_count, bookmark_count, view_count, samples)
+SELECT DISTINCT ON (tweet_id, date_trunc('hour', fetched_at))
+    tweet_id, date_trunc('hour', fetched_at), favorite_count, bookmark_count, view_count,
+    count(*) OVER (PARTITION BY tweet_id, date_trunc('hour', fetched_at))
+FROM {source}
+ORDER BY tweet_id, date_trunc('hour', fetched_at), fetched_at DESC
+ON CONFLICT (tweet_id, bucket) DO UPDATE SET
+    favorite_count = EXCLUDED.favorite_count,
+    bookmark_count = EXCLUDED.bookmark_count,
+    view_count = EXCLUDED.view_count,
+    samples = t_x_engagement_hourly.samples + EXCLUDED.samples
+"""
+
+def downsample_x_engagement(keep_days: int = 7) -> Dict[str, int]:
+    """
+    Roll snapshots older than keep_days up into t_x_engagement_hourly
+    Whole daily partitions are rolled up and dropped, so no dead rows are left
+    behind; old rows that landed in the default partition are moved as well.
+    Returns:
+        Dictionary with the number of dropped partitions and rolled-up hourly rows
+    """
+    stats = {'partitions': 0, 'hourly_rows': 0}
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 't_x_engagement'::regclass
+                    AND c.relname ~ '^t_x_engagement_[0-9]{8}$'
+                    AND to_date(right(c.relname, 8), 'YYYYMMDD') < (CURRENT_TIMESTAMP AT TIME ZONE 'UTC')::date - %s
+                ORDER BY c.relname
+                """, (keep_days,))
+                partitions = [name for (name,) in cur.fetchall()]
+                # 每个分区单独一个事务：汇总后直接删除整个分区
+                for name in partitions:
+                    table = psycopg2.extensions.quote_ident(name, cur)
+                    cur.execute(_ENGAGEMENT_ROLLUP_SQL.format(prefix='', source=table))
+                    stats['hourly_rows'] += cur.rowcount
+                    cur.execute(f"ALTER TABLE t_x_engagement DETACH PARTITION {table}")
+                    cur.execute(f"DROP TABLE {table}")
+                    conn.commit()
+                    stats['partitions'] += 1
+                old_default = ("WITH old AS (DELETE FROM t_x_engagement_default WHERE fetched_at < "
+                               "((CURRENT_TIMESTAMP AT TIME ZONE 'UTC')::date - %s)::timestamp AT TIME ZONE 'UTC' RETURNING *) ")
+                cur.execute(_ENGAGEMENT_ROLLUP_SQL.format(prefix=old_default, source='old'), (keep_days,))
+                stats['hourly_rows'] += cur.rowcount
+            conn.commit()
+            return stats
+    except Exception as e:
+        print(f"Error downsampling engagement snapshots: {e}")
+        raise
+
+def get_x_engagement_velocity(hours: float = 6, limit: int = 50, min_samples: int = 2,
+                              order_by: str = 'favorite') -> List[Dict[str, Any]]:
+    """
+    Tweets ranked by engagement growth per hour over the last `hours`
+    Only the partitions (and hourly rollups) inside the window are read.
+    Args:
+        hours: Window length
+        limit: Maximum number of tweets
+        min_samples: Tweets with fewer snapshots in the window are ignored
+        order_by: 'favorite', 'bookmark' or 'view'
+    Returns:
+        List of dictionaries with tweet_id, samples, first_seen, last_seen and, for each
+        counter, its gain over the window (<kind>_delta) and per hour (<kind>_per_hour)
+    """
+    if order_by not in ('favorite', 'bookmark', 'view'):
+        raise ValueError(f"order_by must be favorite, bookmark or view, got {order_by}")
+
+    query = f"""
+    WITH snapshots AS (
+        SELECT tweet_id, fetched_at, favorite_count, bookmark_count, view_count
+        FROM t_x_engagement
+        WHERE fetched_at >= CURRENT_TIMESTAMP - make_interval(secs => %(seconds)s)
+        UNION ALL
+        SELECT tweet_id, bucket, favorite_count, bookmark_count, view_count
+        FROM t_x_engagement_hourly
+        WHERE bucket >= CURRENT_TIMESTAMP - make_interval(secs => %(seconds)s)
+    ),
+    windowed AS (
+        SELECT tweet_id, count(*) AS samples, min(fetched_at) AS first_seen, max(fetched_at) AS last_seen,
+            (array_agg(favorite_count ORDER BY fetched_at DESC))[1] - (array_agg(favorite_count ORDER BY fetched_at))[1] AS favorite_delta,
+            (array_agg(bookmark_count ORDER BY fetched_at DESC))[1] - (array_agg(bookmark_count ORDER BY fetched_at))[1] AS bookmark_delta,
+            (array_agg(view_count ORDER BY fetched_at DESC))[1] - (array_agg(view_count ORDER BY fetched_at))[1] AS view_delta
+        FROM snapshots
+        GROUP BY tweet_id
+        HAVING count(*) >= %(min_samples)s AND max(fetched_at) > min(fetched_at)
+    )
+    SELECT *,
+        (favorite_delta * 3600.0 / extract(epoch FROM last_seen - first_seen))::float8 AS favorite_per_hour,
+        (bookmark_delta * 3600.0 / extract(epoch FROM last_seen - first_seen))::float8 AS bookmark_per_hour,
+        (view_delta * 3600.0 / extract(epoch FROM last_seen - first_seen))::float8 AS view_per_hour
+    FROM windowed
+    ORDER BY {order_by}_per_hour DESC NULLS LAST
+    LIMIT %(limit)s
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(query, {'seconds': hours * 3600, 'min_samples': min_samples, 'limit': limit})
+                return [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        print(f"Error fetching engagement velocity: {e}")
+        raise
+
+def claim_ai_batch(worker_id: str, limit: int, lease_seconds: int,
+                   after: Optional[tuple] = None) -> List[Dict[str, Any]]:
+    """
+    Lease a batch of queued tweets for AI analysis, newest first
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so concurrent analyzers get
+    disjoint batches; an expired lease (crashed analyzer) makes the rows
+    claimable again. Passing the last row's (created_at, x_id) as after continues
+    below it (keyset pagination) instead of rescanning rows that were skipped.
+    Args:
+        worker_id: Identifier of the claiming analyzer
+        limit: Maximum number of tweets to claim
+        lease_seconds: Lease length in seconds
+        after: (created_at, x_id) keyset cursor from the previous batch
+    Returns:
+        List of t_x rows as dictionaries (created_at as ISO string) plus attempts
+    """
+    claim_sql = """
+    WITH claimable AS (
+        SELECT x_id
+        FROM t_x_ai_queue
+        WHERE status = 'pending'
+          AND next_attempt_at <= CURRENT_TIMESTAMP
+          AND (lease_until IS NULL OR lease_until < CURRENT_TIMESTAMP)
+          AND (%(after_created_at)s::timestamptz IS NULL
+               OR (created_at, x_id) < (%(after_created_at)s::timestamptz, %(after_x_id)s))
+        ORDER BY created_at DESC, x_id DESC
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    claimed AS (
+        UPDATE t_x_ai_queue q
+        SET lease_owner = %(worker_id)s,
+            lease_until = CURRENT_TIMESTAMP + make_interval(secs => %(lease_seconds)s)
+        FROM claimable c
+        WHERE q.x_id = c.x_id
+        RETURNING q.x_id, q.created_at, q.attempts
+    )
+    SELECT t.id, t.x_id, t.item_type, t.data, t.username, t.user_id, t.user_link, t.created_at, t.more_info,
+           c.attempts
+    FROM claimed c
+    JOIN t_x_ids i ON i.x_id = c.x_id
+    JOIN t_x t ON t.x_id = i.x_id AND t.created_at = i.created_at
+    ORDER BY t.created_at DESC, t.x_id DESC
+    """
+    after_created_at, after_x_id = after or (None, None)
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+                cur.execute(claim_sql, {
+                    'worker_id': worker_id,
+                    'limit': limit,
+                    'lease_seconds': lease_seconds,
+                    'after_created_at': after_created_at,
+                    'after_x_id': after_x_id,
+                })
+                rows = []
+                for row in cur.fetchall():
+                    row = dict(row)
+                    row['created_at'] = row['created_at'].isoformat() if row['created_at'] else None
+                    rows.append(row)
+            conn.commit()
+            metrics.inc('ai_queue_claimed_total', len(rows))
+            return rows
+    except Exception as e:
+        print(f"Error claiming AI batch: {e}")
+        raise
+
+def fail_ai_items(x_ids: List[str], error: str, max_attempts: int = 5,
+                  base_delay: float = 60, max_delay: float = 6 * 3600) -> None:
+    """
+    Return tweets whose analysis failed to the queue with exponential backoff
+    The n-th failure delays the next attempt by base_delay * 2^(n-1) seconds (at
+    most max_delay); after max_attempts failures the rows are marked 'failed'.
+    Args:
+        x_ids: Tweets of the failed batch
+        error: Error message kept in last_error
+    """
+    if not x_ids:
+        return
+
+    fail_sql = """
+    UPDATE t_x_ai_queue
+    SET attempts = attempts + 1,
+        status = CASE WHEN attempts + 1 >= %(max_attempts)s THEN 'failed' ELSE 'pending' END,
+        next_attempt_at = CURRENT_TIMESTAMP
+            + make_interval(secs => LEAST(%(base_delay)s * power(2, attempts), %(max_delay)s)),
+        lease_owner = NULL,
+        lease_until = NULL,
+        last_error = %(error)s
+    WHERE x_id = ANY(%(x_ids)s)
+    """
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(fail_sql, {
+                    'x_ids': list(x_ids),
+                    'error': error[:1000],
+                    'max_attempts': max_attempts,
+                    'base_delay': base_delay,
+                    'max_delay': max_delay,
+                })
+            conn.commit()
+            metrics.inc('ai_queue_failed_total', len(x_ids))
+    except Exception as e:
+        print(f"Error recording AI failures: {e}")
+        raise
+
+# 一条语句写回整批结果；t_x_ids 给出所在分区，避免逐个分区查找 x_id。
+# 自连接的 o 是更新前的行，据此得到每个用户重要信号数的变化量并写入 t_x_user_stats
+SAVE_AI_RESULTS_SQL = """
+WITH v (x_id, ai_result) AS (VALUES %s),
+saved AS (
+    UPDATE t_x SET more_info = COALESCE(o.more_info, '{}'::jsonb) || jsonb_build_object('ai_result', v.ai_result)
+    FROM v
+    JOIN t_x_ids i USING (x_id)
+    JOIN t_x o ON o.x_id = i.x_id AND o.created_at = i.created_at
+    WHERE t_x.x_id = v.x_id AND t_x.created_at = i.created_at
+    RETURNING t_x.user_id,
+        COALESCE(v.ai_result->'is_important' = 'true'::jsonb, FALSE)::int
+        - COALESCE(o.more_info->'ai_result'->'is_important' = 'true'::jsonb, FALSE)::int AS delta
+),
+user_stats AS (
+    UPDATE t_x_user_stats SET important_count = t_x_user_stats.important_count + d.delta,
+        updated_at = CURRENT_TIMESTAMP
+    FROM (SELECT user_id, sum(delta) AS delta FROM saved GROUP BY user_id) d
+    WHERE t_x_user_stats.user_id = d.user_id AND d.delta <> 0
+)
+SELECT count(*) FROM saved
+"""
+
+def save_ai_results(ai_results: Dict[str, Dict[str, Any]], page_size: int = 1000) -> int:
+    """
+    Store AI results into more_info.ai_result and take the tweets off the AI queue
+    Each page is one statement: rows are located through t_x_ids (partition pruning)
+    and important_count in t_x_user_stats moves by the change of is_important, all in
+    the same transaction as the dequeue.
+    Args:
+        ai_results: Mapping of x_id to its ai_result object, important or not
+    Returns:
+        Number of rows updated
+    """
+    if not ai_results:
+        return 0
+    rows = [(x_id, json.dumps(result, ensure_ascii=False)) for x_id, result in ai_results.items()]
+
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                saved = psycopg2.extras.execute_values(cur, SAVE_AI_RESULTS_SQL, rows, template='(%s, %s::jsonb)',
+                                                       page_size=page_size, fetch=True)
+                cur.execute("DELETE FROM t_x_ai_queue WHERE x_id = ANY(%s)", (list(ai_results),))
+            conn.commit()
+        updated = sum(row[0] for row in saved)
+        metrics.inc('db_ai_results_saved_total', updated)
+        return updated
+    except Exception as e:
+        print(f"Error saving AI results: {e}")
+        raise
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+from db_utils import insert_x_data, insert_x_engagement, update_crawl_states, upsert_x_data, x_engagement_rows
+
+
+class XDataWriter:
+    """
+    Bounded buffer between the crawler and t_x
+    Items are flushed every flush_items items or flush_interval seconds, and a
+    user's crawl state is only recorded once all of that user's items are written,
+    so an interrupted run resumes from the last flushed user.
+    Args:
+        flush_items: Flush once this many items are buffered
+        flush_interval: Flush once this many seconds passed since the last flush
+        write_states: Persists the progress records after their items are written
+        refresh: Upsert instead of insert, so already stored items whose content or
+                 engagement changed are updated (see db_utils.upsert_x_data)
+        record_engagement: Append every buffered tweet's counters to t_x_engagement,
+                           stamped with the time its page was crawled, once the
+                           items are written; off for backfill, whose old tweets
+                           would otherwise show up as engagement gained just now
+    """
+
+    def __init__(self, flush_items: int = 200, flush_interval: float = 30.0,
+                 write_states: Callable[[List[Dict[str, Any]]], None] = update_crawl_states,
+                 refresh: bool = False, record_engagement: bool = True):
+        self.flush_items = max(1, flush_items)
+        self.refresh = refresh
+        self.record_engagement = record_engagement
+        self.write_states = write_states
+        self.flush_interval = flush_interval
+        self.buffer: Dict[str, Dict[str, Any]] = {}
+        self.pending_states: List[Dict[str, Any]] = []
+        self.pending_engagement: List[tuple] = []
+        self.last_flush = time.monotonic()
+        self.parsed_count = 0
+        self.inserted_count = 0
+        self.updated_count = 0
+        self.user_count = 0
+        self.failed_users = 0
+        self.crawled_user_ids: List[str] = []
+        self._lock = None
+
+    def _should_flush(self) -> bool:
+        return len(self.buffer) >= self.flush_items or time.monotonic() - self.last_flush >= self.flush_interval
+
+    def _take(self) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]], List[tuple]]:
+        batch, states, engagement = self.buffer, self.pending_states, self.pending_engagement
+        self.buffer, self.pending_states, self.pending_engagement = {}, [], []
+        self.last_flush = time.monotonic()
+        return batch, states, engagement
+
+    def _write(self, batch: Dict[str, Dict[str, Any]], states: List[Dict[str, Any]], engagement: List[tuple]) -> None:
+        try:
+            if batch and self.refresh:
+                stats = upsert_x_data(batch)
+                self.inserted_count += stats['inserted']
+                self.updated_count += stats['updated']
+            elif batch:
+                self.inserted_count += insert_x_data(batch)
+            self.write_states(states)
+            self.crawled_user_ids.extend(state['user_id'] for state in states)
+        except Exception as e:
+            # 不推进这些用户的高水位，下次运行会重新抓取；这批推文未入库，互动快照也一并丢弃
+            print(f"Error flushing {len(batch)} items for {len(states)} users: {e}")
+            self.failed_users += len(states)
+            return
+        try:
+            insert_x_engagement(engagement)
+        except Exception as e:
+            # 互动快照只用于统计，失败不影响抓取进度
+            print(f"Error writing {len(engagement)} engagement snapshots: {e}")
+
+    def _add(self, items: Dict[str, Dict[str, Any]], state: Dict[str, Any]) -> None:
+        self.buffer.update(items)
+        if self.record_engagement:
+            self.pending_engagement.extend(x_engagement_rows(items.values(), datetime.now(timezone.utc)))
+        self.pending_states.append(state)
+        self.parsed_count += len(items)
+        self.user_count += 1
+
+    def add_user(self, items: Dict[str, Dict[str, Any]], state: Dict[str, Any]) -> None:
+        """Buffer one user's new items together with the crawl state they advance to"""
+        self._add(items, state)
+        if self._should_flush():
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer or self.pending_states:
+            self._write(*self._take())
+
+    async def add_user_async(self, items: Dict[str, Dict[str, Any]], state: Dict[str, Any]) -> None:
+        """Same as add_user, but writes in a worker thread so the event loop keeps crawling"""
+        self._add(items, state)
+        if self._should_flush():
+            await self.flush_async()
+
+    async def flush_async(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if not (self.buffer or self.pending_states):
+            return
+        batch, states, engagement = self._take()
+        async with self._lock:
+            await asyncio.to_thread(self._write, batch, states, engagement)
+
+    def summary(self) -> str:
+        if self.refresh:
+            return (f'本次共抓取 {self.user_count} 个用户，解析出 {self.parsed_count} 条条目，'
+                    f'新入库 {self.inserted_count} 条，更新 {self.updated_count} 条，写入失败用户 {self.failed_users} 个')
+        return (f'本次共抓取 {self.user_count} 个用户，解析出 {self.parsed_count} 条新条目，'
+                f'实际入库 {self.inserted_count} 条，写入失败用户 {self.failed_users} 个')
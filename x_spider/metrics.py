@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+
+# 延迟直方图的桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 单次运行最多保留的 span 数，避免长时间运行内存无限增长
+MAX_SPANS = 100000
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """
+    Process-wide counters, latency histograms and optional spans shared by
+    the crawler, parser, database layer and AI filter
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self.spans: List[Dict[str, Any]] = []
+        self.spans_enabled = os.getenv('X_METRICS_SPANS', '').lower() in ('1', 'true', 'yes')
+        self.started_at = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def record_span(self, name: str, started: float, duration: float, **labels) -> None:
+        if not self.spans_enabled:
+            return
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append({'name': name, 'start': started, 'duration': duration, 'labels': labels})
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the wall time of the block into histogram `name` (and a span when enabled)"""
+        started_wall = time.time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            self.observe(name, duration, **labels)
+            self.record_span(name, started_wall, duration, **labels)
+
+    def timed(self, name: str, **labels):
+        """Decorator version of timer()"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                for key, value in series.items():
+                    lines.append(f'{name}{_format_labels(key)} {value}')
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, ("le", str(bound)))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, ("le", "+Inf"))} {histogram.count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {histogram.sum}')
+                    lines.append(f'{name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> Dict[str, Any]:
+        def labels_of(key):
+            return dict(key)
+
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'duration_seconds': round(time.time() - self.started_at, 3),
+                'counters': {
+                    name: [{'labels': labels_of(key), 'value': value} for key, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                'histograms': {
+                    name: [{
+                        'labels': labels_of(key),
+                        'count': h.count,
+                        'sum': round(h.sum, 6),
+                        'avg': round(h.sum / h.count, 6) if h.count else 0,
+                        'max': round(h.max, 6),
+                    } for key, h in series.items()]
+                    for name, series in self.histograms.items()
+                },
+                'spans': list(self.spans) if self.spans_enabled else None,
+            }
+
+    def write_reports(self, job: str, directory: Optional[str] = None) -> None:
+        """Write <job>.prom (Prometheus text format) and <job>_summary.json into directory"""
+        directory = directory or os.getenv('X_METRICS_DIR', 'metrics')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f'{job}.prom'), 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+            with open(os.path.join(directory, f'{job}_summary.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+            print(f"Metrics written to {directory}/{job}.prom")
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+
+
+metrics = Metrics()
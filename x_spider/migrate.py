@@ -0,0 +1,135 @@
+import argparse
+import glob
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+from db_utils import db_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_PATTERN = re.compile(r'^(\d+)_([\w-]+)\.sql$')
+# 同一时间只允许一个迁移进程（pg_advisory_lock 的键）
+MIGRATION_LOCK_KEY = 7_242_019
+
+
+def list_migrations(directory: str = MIGRATIONS_DIR) -> List[Tuple[int, str, str]]:
+    """
+    Migration files in version order
+    Returns:
+        List of (version, name, path); files are named <version>_<name>.sql
+    """
+    migrations = []
+    for path in glob.glob(os.path.join(directory, '*.sql')):
+        match = MIGRATION_PATTERN.match(os.path.basename(path))
+        if not match:
+            print(f'忽略不符合命名规则的迁移文件: {path}')
+            continue
+        migrations.append((int(match.group(1)), match.group(2), path))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f'{directory} 中有重复的迁移版本号')
+    return migrations
+
+
+def _checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode('utf-8')).hexdigest()
+
+
+def _applied(cur) -> Dict[int, str]:
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cur.execute("SELECT version, checksum FROM schema_version")
+    return dict(cur.fetchall())
+
+
+def migrate(target: Optional[int] = None, dry_run: bool = False, directory: str = MIGRATIONS_DIR) -> int:
+    """
+    Apply pending migrations in version order, each in its own transaction
+    Every migration is written to be idempotent, so a database whose tables were
+    created before schema_version existed is simply brought up to date.
+    Args:
+        target: Stop after this version (default: apply all)
+        dry_run: Only list what would be applied
+        directory: Directory holding the migration files
+    Returns:
+        Number of migrations applied
+    """
+    migrations = list_migrations(directory)
+    applied_count = 0
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            try:
+                applied = _applied(cur)
+                conn.commit()
+                for version, name, path in migrations:
+                    if target is not None and version > target:
+                        break
+                    with open(path, 'r', encoding='utf-8') as f:
+                        sql = f.read()
+                    checksum = _checksum(sql)
+                    if version in applied:
+                        if applied[version] != checksum:
+                            print(f'警告: 迁移 {version:04d}_{name} 在应用后被修改过（已应用的不会重新执行）')
+                        continue
+                    if dry_run:
+                        print(f'待应用: {version:04d}_{name}')
+                        applied_count += 1
+                        continue
+                    try:
+                        cur.execute(sql)
+                        cur.execute(
+                            "INSERT INTO schema_version (version, name, checksum) VALUES (%s, %s, %s)",
+                            (version, name, checksum)
+                        )
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        print(f'迁移 {version:04d}_{name} 失败: {e}')
+                        raise
+                    applied_count += 1
+                    print(f'已应用迁移 {version:04d}_{name}')
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
+    if not applied_count:
+        print('数据库结构已是最新')
+    return applied_count
+
+
+def print_status(directory: str = MIGRATIONS_DIR) -> None:
+    """Print every migration with its applied state"""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            applied = _applied(cur)
+        conn.commit()
+    for version, name, _ in list_migrations(directory):
+        print(f"{version:04d}_{name}: {'已应用' if version in applied else '未应用'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按版本顺序执行 migrations/ 下的数据库迁移')
+    parser.add_argument('--status', action='store_true', help='只列出各迁移是否已应用')
+    parser.add_argument('--to', type=int, dest='target', help='只迁移到该版本（含）')
+    parser.add_argument('--dry-run', action='store_true', help='只列出待应用的迁移，不执行')
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+        return
+    migrate(args.target, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+-- X timeline items, one row per tweet or profile-conversation module
+CREATE TABLE IF NOT EXISTS t_x (
+    id SERIAL PRIMARY KEY,
+    x_id TEXT UNIQUE NOT NULL,
+    item_type TEXT NOT NULL,
+    data JSONB NOT NULL,
+    username TEXT,
+    user_id TEXT,
+    user_link TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create index on x_id for faster lookups
+CREATE INDEX IF NOT EXISTS idx_t_x_x_id ON t_x(x_id);
+-- Create index on created_at for ordering
+CREATE INDEX IF NOT EXISTS idx_t_x_created_at ON t_x(created_at DESC);
+-- Create index on user_id for user-specific queries
+CREATE INDEX IF NOT EXISTS idx_t_x_user_id ON t_x(user_id);
@@ -0,0 +1,25 @@
+-- Add auto-increment ID to t_x tables created before it was part of the schema
+-- (x_id used to be the primary key); no-op when the column already exists
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 't_x' AND column_name = 'id'
+    ) THEN
+        -- Step 1: Add the new auto-increment ID column
+        ALTER TABLE t_x ADD COLUMN id SERIAL;
+        -- Step 2: Drop the existing primary key on x_id
+        ALTER TABLE t_x DROP CONSTRAINT IF EXISTS t_x_pkey;
+        -- Step 3: Set the new ID column as primary key
+        ALTER TABLE t_x ADD CONSTRAINT t_x_pkey PRIMARY KEY (id);
+        -- Step 4: Add unique constraint on x_id
+        ALTER TABLE t_x ADD CONSTRAINT t_x_x_id_unique UNIQUE (x_id);
+    END IF;
+END
+$$;
+
+-- Step 5: Create indexes for better performance
+CREATE INDEX IF NOT EXISTS idx_t_x_x_id ON t_x(x_id);
+CREATE INDEX IF NOT EXISTS idx_t_x_created_at ON t_x(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_t_x_user_id ON t_x(user_id);
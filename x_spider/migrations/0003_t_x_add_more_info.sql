@@ -0,0 +1,27 @@
+-- Add more_info JSONB field to t_x
+-- This field stores additional metadata including AI analysis results
+
+-- Step 1: Add the new more_info JSONB column
+ALTER TABLE t_x ADD COLUMN IF NOT EXISTS more_info JSONB DEFAULT '{}';
+
+-- Step 2: Create index on more_info for better performance
+CREATE INDEX IF NOT EXISTS idx_t_x_more_info ON t_x USING GIN (more_info);
+
+-- Step 3: Create specific index for AI analysis queries
+CREATE INDEX IF NOT EXISTS idx_t_x_ai_analyzed ON t_x USING GIN ((more_info->'ai_result'));
+
+-- Step 4: Migrate existing ai_result data from data field to more_info field
+-- This handles cases where ai_result was previously stored in the data field
+UPDATE t_x
+SET more_info = jsonb_set(
+    COALESCE(more_info, '{}'),
+    '{ai_result}',
+    (data->'ai_result')
+)
+WHERE jsonb_typeof(data) = 'object' AND data ? 'ai_result'
+    AND NOT (COALESCE(more_info, '{}') ? 'ai_result');
+
+-- Step 5: Remove ai_result from data field after migration (optional, uncomment if needed)
+-- UPDATE t_x
+-- SET data = data - 'ai_result'
+-- WHERE data ? 'ai_result' AND jsonb_typeof(data) = 'object';
@@ -0,0 +1,11 @@
+-- Followed X accounts
+CREATE TABLE IF NOT EXISTS t_x_users (
+    user_id TEXT PRIMARY KEY,
+    user_name TEXT NOT NULL,
+    screen_name TEXT NOT NULL,
+    user_link TEXT NOT NULL,
+    avatar TEXT,
+    expire BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
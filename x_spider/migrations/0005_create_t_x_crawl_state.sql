@@ -0,0 +1,22 @@
+-- Per-user crawl state: high-water mark, adaptive poll schedule and worker lease
+CREATE TABLE IF NOT EXISTS t_x_crawl_state (
+    user_id TEXT PRIMARY KEY,
+    last_tweet_id BIGINT,
+    last_new_count INTEGER DEFAULT 0,
+    last_crawled_at TIMESTAMP WITH TIME ZONE,
+    post_rate DOUBLE PRECISION,
+    next_poll_at TIMESTAMP WITH TIME ZONE,
+    lease_owner TEXT,
+    lease_until TIMESTAMP WITH TIME ZONE,
+    last_attempt_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Columns added after the table was first created
+ALTER TABLE t_x_crawl_state ADD COLUMN IF NOT EXISTS post_rate DOUBLE PRECISION;
+ALTER TABLE t_x_crawl_state ADD COLUMN IF NOT EXISTS next_poll_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE t_x_crawl_state ADD COLUMN IF NOT EXISTS lease_owner TEXT;
+ALTER TABLE t_x_crawl_state ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP WITH TIME ZONE;
+ALTER TABLE t_x_crawl_state ADD COLUMN IF NOT EXISTS last_attempt_at TIMESTAMP WITH TIME ZONE;
+-- Create index on next_poll_at for due-user lookups
+CREATE INDEX IF NOT EXISTS idx_t_x_crawl_state_next_poll_at ON t_x_crawl_state(next_poll_at);
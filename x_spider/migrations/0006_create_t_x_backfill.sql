@@ -0,0 +1,11 @@
+-- Backfill checkpoints, one per user
+CREATE TABLE IF NOT EXISTS t_x_backfill (
+    user_id TEXT PRIMARY KEY,
+    cursor TEXT,
+    target_date TIMESTAMP WITH TIME ZONE,
+    target_count INTEGER,
+    fetched_count INTEGER DEFAULT 0,
+    oldest_created_at TIMESTAMP WITH TIME ZONE,
+    done BOOLEAN DEFAULT FALSE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,11 @@
+-- Entities extracted at ingest (see x_parser.extract_entities)
+ALTER TABLE t_x ADD COLUMN IF NOT EXISTS cashtags TEXT[];
+ALTER TABLE t_x ADD COLUMN IF NOT EXISTS mentions TEXT[];
+ALTER TABLE t_x ADD COLUMN IF NOT EXISTS hashtags TEXT[];
+ALTER TABLE t_x ADD COLUMN IF NOT EXISTS contracts TEXT[];
+ALTER TABLE t_x ADD COLUMN IF NOT EXISTS domains TEXT[];
+CREATE INDEX IF NOT EXISTS idx_t_x_cashtags ON t_x USING GIN (cashtags);
+CREATE INDEX IF NOT EXISTS idx_t_x_mentions ON t_x USING GIN (mentions);
+CREATE INDEX IF NOT EXISTS idx_t_x_hashtags ON t_x USING GIN (hashtags);
+CREATE INDEX IF NOT EXISTS idx_t_x_contracts ON t_x USING GIN (contracts);
+CREATE INDEX IF NOT EXISTS idx_t_x_domains ON t_x USING GIN (domains);
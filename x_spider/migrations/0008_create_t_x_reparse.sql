@@ -0,0 +1,12 @@
+-- Archive segments already written by a re-parse job (see reparse.py)
+CREATE TABLE IF NOT EXISTS t_x_reparse (
+    job TEXT NOT NULL,
+    segment TEXT NOT NULL,
+    segment_size BIGINT,
+    records INTEGER DEFAULT 0,
+    items INTEGER DEFAULT 0,
+    inserted INTEGER DEFAULT 0,
+    updated INTEGER DEFAULT 0,
+    finished_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (job, segment)
+);
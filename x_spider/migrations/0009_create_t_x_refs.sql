@@ -0,0 +1,14 @@
+-- Quoted/retweeted tweets, stored once per rest_id and linked from t_x.data by quoted_id/retweeted_id
+CREATE TABLE IF NOT EXISTS t_x_refs (
+    ref_id TEXT PRIMARY KEY,
+    username TEXT,
+    full_text TEXT,
+    quoted_id TEXT,
+    retweeted_id TEXT,
+    data JSONB,
+    created_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_t_x_refs_username ON t_x_refs(username);
+CREATE INDEX IF NOT EXISTS idx_t_x_refs_quoted_id ON t_x_refs(quoted_id);
+CREATE INDEX IF NOT EXISTS idx_t_x_refs_retweeted_id ON t_x_refs(retweeted_id);
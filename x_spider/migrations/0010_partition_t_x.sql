@@ -0,0 +1,130 @@
+-- Convert t_x into monthly range partitions on created_at
+--
+-- A unique constraint on a partitioned table must include the partition key, so
+-- x_id can no longer be UNIQUE on t_x itself. Cross-partition dedup moves to
+-- t_x_ids (x_id PRIMARY KEY, created_at): writers claim the x_id there first and
+-- only insert into t_x when the claim succeeded (see db_utils.insert_x_data).
+-- t_x_ids also points at the row's partition so updates by x_id can be pruned.
+--
+-- Rows outside every monthly partition land in t_x_default;
+-- t_x_ensure_partition() moves them out when their month's partition is created.
+-- Future partitions are created by `python partitions.py ensure`.
+--
+-- The rebuilt t_x, t_x_ids and every partition get the grants the old t_x had
+-- (e.g. SELECT for the PostgREST anon/webuser roles), see t_x_copy_grants().
+
+-- 把 source 上授予其他角色的权限原样授予 target（表的属主本来就有全部权限）
+CREATE OR REPLACE FUNCTION t_x_copy_grants(source REGCLASS, target REGCLASS) RETURNS VOID AS $$
+DECLARE
+    acl RECORD;
+BEGIN
+    FOR acl IN
+        SELECT a.privilege_type, a.grantee, a.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid = source AND a.grantee <> c.relowner
+    LOOP
+        EXECUTE format('GRANT %s ON %s TO %s%s', acl.privilege_type, target,
+                       CASE WHEN acl.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(acl.grantee)) END,
+                       CASE WHEN acl.is_grantable THEN ' WITH GRANT OPTION' ELSE '' END);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION t_x_ensure_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    part TEXT := 't_x_' || to_char(month_start, 'YYYYMM');
+    lower_bound TIMESTAMPTZ := date_trunc('month', month_start::timestamp) AT TIME ZONE 'UTC';
+    upper_bound TIMESTAMPTZ := (date_trunc('month', month_start::timestamp) + INTERVAL '1 month') AT TIME ZONE 'UTC';
+BEGIN
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE t_x INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part);
+    -- 通过父表查询只检查父表的权限，分区也给同样的权限，直接访问分区时行为一致
+    PERFORM t_x_copy_grants('t_x', part::regclass);
+    -- 默认分区里已有的该月数据先移过来，否则 ATTACH 会因为默认分区约束失败
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM t_x_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, part);
+    EXECUTE format('ALTER TABLE t_x ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', part, lower_bound, upper_bound);
+    RETURN part;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    first_month DATE;
+    month DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 't_x'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE t_x RENAME TO t_x_legacy;
+    -- id 继续使用原来的序列
+    ALTER SEQUENCE IF EXISTS t_x_id_seq OWNED BY NONE;
+
+    CREATE TABLE t_x (
+        id BIGINT NOT NULL DEFAULT nextval('t_x_id_seq'),
+        x_id TEXT NOT NULL,
+        item_type TEXT NOT NULL,
+        data JSONB NOT NULL,
+        username TEXT,
+        user_id TEXT,
+        user_link TEXT,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        more_info JSONB DEFAULT '{}',
+        cashtags TEXT[],
+        mentions TEXT[],
+        hashtags TEXT[],
+        contracts TEXT[],
+        domains TEXT[]
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE t_x_id_seq OWNED BY t_x.id;
+    -- 新建的表没有原表上的授权，PostgREST 等角色会失去访问权限
+    PERFORM t_x_copy_grants('t_x_legacy', 't_x');
+
+    CREATE TABLE t_x_default PARTITION OF t_x DEFAULT;
+    PERFORM t_x_copy_grants('t_x', 't_x_default');
+
+    CREATE TABLE IF NOT EXISTS t_x_ids (
+        x_id TEXT PRIMARY KEY,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+    -- 写入 t_x 要先在 t_x_ids 里认领 x_id，能写 t_x 的角色在这里也要有同样的权限
+    PERFORM t_x_copy_grants('t_x_legacy', 't_x_ids');
+
+    -- 现有数据所在的月份到未来三个月都建好分区
+    SELECT date_trunc('month', COALESCE(min(created_at), CURRENT_TIMESTAMP) AT TIME ZONE 'UTC')::date
+    INTO first_month FROM t_x_legacy;
+    month := first_month;
+    WHILE month <= (date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') + INTERVAL '3 months')::date LOOP
+        PERFORM t_x_ensure_partition(month);
+        month := (month + INTERVAL '1 month')::date;
+    END LOOP;
+
+    INSERT INTO t_x (id, x_id, item_type, data, username, user_id, user_link, created_at, more_info,
+                     cashtags, mentions, hashtags, contracts, domains)
+    SELECT id, x_id, item_type, data, username, user_id, user_link, COALESCE(created_at, CURRENT_TIMESTAMP), more_info,
+           cashtags, mentions, hashtags, contracts, domains
+    FROM t_x_legacy;
+    INSERT INTO t_x_ids (x_id, created_at)
+    SELECT x_id, created_at FROM t_x
+    ON CONFLICT (x_id) DO NOTHING;
+
+    DROP TABLE t_x_legacy;
+    -- 约束和索引在数据复制完之后建在父表上，每个分区各自一份
+    ALTER TABLE t_x ADD CONSTRAINT t_x_pkey PRIMARY KEY (id, created_at);
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_t_x_x_id ON t_x(x_id);
+CREATE INDEX IF NOT EXISTS idx_t_x_created_at ON t_x(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_t_x_user_id ON t_x(user_id);
+CREATE INDEX IF NOT EXISTS idx_t_x_more_info ON t_x USING GIN (more_info);
+CREATE INDEX IF NOT EXISTS idx_t_x_ai_analyzed ON t_x USING GIN ((more_info->'ai_result'));
+CREATE INDEX IF NOT EXISTS idx_t_x_cashtags ON t_x USING GIN (cashtags);
+CREATE INDEX IF NOT EXISTS idx_t_x_mentions ON t_x USING GIN (mentions);
+CREATE INDEX IF NOT EXISTS idx_t_x_hashtags ON t_x USING GIN (hashtags);
+CREATE INDEX IF NOT EXISTS idx_t_x_contracts ON t_x USING GIN (contracts);
+CREATE INDEX IF NOT EXISTS idx_t_x_domains ON t_x USING GIN (domains);
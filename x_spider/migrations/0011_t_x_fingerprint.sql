@@ -0,0 +1,19 @@
+-- Per-row content/engagement fingerprint for change-aware upserts
+--
+-- The fingerprint lives in the narrow t_x_ids table, so deciding whether a
+-- re-crawled tweet changed never reads the wide JSONB rows in t_x; only rows
+-- whose fingerprint differs are rewritten (see db_utils.upsert_x_data).
+-- ai_result is excluded because it is written by ai_filter, not the crawler.
+
+CREATE OR REPLACE FUNCTION t_x_fingerprint(item_type TEXT, data JSONB) RETURNS BIGINT AS $$
+    SELECT hashtextextended(
+        COALESCE(item_type, '') || ':' ||
+        CASE WHEN jsonb_typeof(data) = 'object' THEN (data - 'ai_result')::text ELSE data::text END,
+        0)
+$$ LANGUAGE SQL IMMUTABLE PARALLEL SAFE;
+
+ALTER TABLE t_x_ids ADD COLUMN IF NOT EXISTS fingerprint BIGINT;
+
+UPDATE t_x_ids SET fingerprint = t_x_fingerprint(t_x.item_type, t_x.data)
+FROM t_x
+WHERE t_x.x_id = t_x_ids.x_id AND t_x.created_at = t_x_ids.created_at AND t_x_ids.fingerprint IS NULL;
@@ -0,0 +1,52 @@
+-- Engagement time series of crawled tweets
+--
+-- t_x_engagement keeps one narrow row per tweet per crawl (numeric tweet id and
+-- integer counters only), range-partitioned by day on fetched_at so that recent
+-- windows are read from one or two small partitions. Days older than the raw
+-- retention are rolled up into t_x_engagement_hourly (last value per hour) and
+-- their partition is dropped (`python partitions.py downsample`).
+
+CREATE TABLE IF NOT EXISTS t_x_engagement (
+    tweet_id BIGINT NOT NULL,
+    fetched_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    favorite_count INTEGER,
+    bookmark_count INTEGER,
+    view_count BIGINT,
+    PRIMARY KEY (tweet_id, fetched_at)
+) PARTITION BY RANGE (fetched_at);
+
+CREATE TABLE IF NOT EXISTS t_x_engagement_default PARTITION OF t_x_engagement DEFAULT;
+
+CREATE TABLE IF NOT EXISTS t_x_engagement_hourly (
+    tweet_id BIGINT NOT NULL,
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    favorite_count INTEGER,
+    bookmark_count INTEGER,
+    view_count BIGINT,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (tweet_id, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_t_x_engagement_hourly_bucket ON t_x_engagement_hourly(bucket);
+
+CREATE OR REPLACE FUNCTION t_x_engagement_ensure_partition(day DATE) RETURNS TEXT AS $$
+DECLARE
+    part TEXT := 't_x_engagement_' || to_char(day, 'YYYYMMDD');
+    lower_bound TIMESTAMPTZ := day::timestamp AT TIME ZONE 'UTC';
+    upper_bound TIMESTAMPTZ := (day + 1)::timestamp AT TIME ZONE 'UTC';
+BEGIN
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE t_x_engagement INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part);
+    -- 默认分区里已有的当天数据先移过来，否则 ATTACH 会因为默认分区约束失败
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM t_x_engagement_default WHERE fetched_at >= %L AND fetched_at < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved', lower_bound, upper_bound, part);
+    EXECUTE format('ALTER TABLE t_x_engagement ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   part, lower_bound, upper_bound);
+    RETURN part;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT t_x_engagement_ensure_partition((CURRENT_TIMESTAMP AT TIME ZONE 'UTC')::date + offset_days)
+FROM generate_series(0, 7) AS offset_days;
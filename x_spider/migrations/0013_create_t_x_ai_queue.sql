@@ -0,0 +1,30 @@
+-- AI analysis work queue
+--
+-- One row per tweet still waiting for ai_filter. Rows are enqueued together with
+-- the t_x insert (db_utils.claim_x_rows_sql) and deleted once the result is
+-- saved, so the queue only ever holds the backlog. Analyzers claim rows newest
+-- first with FOR UPDATE SKIP LOCKED under a lease; a failed LLM call pushes
+-- next_attempt_at back exponentially, and rows that keep failing end up as
+-- status = 'failed' for inspection.
+CREATE TABLE IF NOT EXISTS t_x_ai_queue (
+    x_id TEXT PRIMARY KEY,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    lease_owner TEXT,
+    lease_until TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    enqueued_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Keyset order of the claim query, pending rows only
+CREATE INDEX IF NOT EXISTS idx_t_x_ai_queue_pending ON t_x_ai_queue(created_at DESC, x_id DESC)
+WHERE status = 'pending';
+
+-- Unanalyzed tweets of the last week; older history is not worth an LLM call anymore
+INSERT INTO t_x_ai_queue (x_id, created_at)
+SELECT x_id, created_at FROM t_x
+WHERE created_at >= CURRENT_TIMESTAMP - INTERVAL '7 days'
+    AND NOT (COALESCE(more_info, '{}'::jsonb) ? 'ai_result')
+ON CONFLICT (x_id) DO NOTHING;
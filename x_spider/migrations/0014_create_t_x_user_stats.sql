@@ -0,0 +1,42 @@
+-- Per-user rollup of t_x
+--
+-- Maintained incrementally in the same transaction as the writes: new rows
+-- add to tweet_count and first/last_created_at and every crawled batch bumps
+-- last_crawled_at (db_utils.claim_x_rows_sql),
+-- saved AI results adjust important_count by the change of is_important
+-- (ai_filter.save_llm_result via db_utils.save_ai_results). Reading
+-- per-user stats is therefore one row per user however large t_x grows.
+-- Rows of partitions detached by `partitions.py detach --drop` stay counted.
+CREATE TABLE IF NOT EXISTS t_x_user_stats (
+    user_id TEXT PRIMARY KEY,
+    tweet_count BIGINT NOT NULL DEFAULT 0,
+    important_count BIGINT NOT NULL DEFAULT 0,
+    first_created_at TIMESTAMP WITH TIME ZONE,
+    last_created_at TIMESTAMP WITH TIME ZONE,
+    last_crawled_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_x_user_stats (user_id, tweet_count, important_count, first_created_at, last_created_at, last_crawled_at)
+SELECT t.user_id, t.tweet_count, t.important_count, t.first_created_at, t.last_created_at, c.last_crawled_at
+FROM (
+    SELECT user_id,
+        count(*) AS tweet_count,
+        count(*) FILTER (WHERE more_info->'ai_result'->'is_important' = 'true'::jsonb) AS important_count,
+        min(created_at) AS first_created_at,
+        max(created_at) AS last_created_at
+    FROM t_x
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+) t
+LEFT JOIN t_x_crawl_state c USING (user_id)
+ON CONFLICT (user_id) DO NOTHING;
+
+-- Readable through PostgREST like t_x; the anon role only exists where PostgREST is set up
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+        GRANT SELECT ON t_x_user_stats TO anon;
+    END IF;
+END
+$$;
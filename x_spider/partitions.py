@@ -0,0 +1,106 @@
+import argparse
+import gzip
+import os
+import re
+
+from dotenv import load_dotenv
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时退回 gzip
+    zstandard = None
+
+load_dotenv()
+from db_utils import (detach_x_partition, downsample_x_engagement, ensure_x_engagement_partitions, ensure_x_partitions,
+                      list_x_partitions)
+
+PARTITION_PATTERN = re.compile(r'^t_x_(\d{4})(\d{2})$')
+
+
+def _open_export(path: str):
+    if zstandard:
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'wb'))
+    return gzip.open(path, 'wb')
+
+
+def ensure(months_ahead: int, engagement_days_ahead: int) -> None:
+    """Pre-create the monthly t_x partitions and the daily t_x_engagement partitions"""
+    created = ensure_x_partitions(months_ahead)
+    if created:
+        print(f"已创建分区: {', '.join(created)}")
+    else:
+        print(f'未来 {months_ahead} 个月的分区都已存在')
+    created = ensure_x_engagement_partitions(engagement_days_ahead)
+    if created:
+        print(f"已创建互动快照分区: {', '.join(created)}")
+    else:
+        print(f'未来 {engagement_days_ahead} 天的互动快照分区都已存在')
+
+
+def downsample(keep_days: int) -> None:
+    stats = downsample_x_engagement(keep_days)
+    print(f"互动快照降采样完成: 合并并删除 {stats['partitions']} 个按天分区，写入 {stats['hourly_rows']} 条小时数据")
+
+
+def show() -> None:
+    for partition in list_x_partitions():
+        print(f"{partition['name']}: 约 {partition['rows']} 行, {partition['bytes'] / 1024 / 1024:.1f} MB, {partition['bound']}")
+
+
+def detach_before(month: str, export_dir: str = None, drop: bool = False) -> None:
+    """
+    Detach every monthly partition older than month (YYYY-MM)
+    With export_dir each partition is first written to <export_dir>/<name>.tsv.zst
+    (COPY text format, gzip when zstandard is missing); with drop it is then removed.
+    """
+    cutoff = month.replace('-', '')
+    partitions = [p['name'] for p in list_x_partitions()
+                  if PARTITION_PATTERN.match(p['name']) and p['name'][len('t_x_'):] < cutoff]
+    if not partitions:
+        print(f'没有早于 {month} 的分区')
+        return
+    if export_dir:
+        os.makedirs(export_dir, exist_ok=True)
+    for name in partitions:
+        if export_dir:
+            path = os.path.join(export_dir, f"{name}.tsv{'.zst' if zstandard else '.gz'}")
+            with _open_export(path) as f:
+                detach_x_partition(name, export_file=f, drop=drop)
+            print(f'已分离 {name} 并导出到 {path}' + ('，原表已删除' if drop else ''))
+        else:
+            detach_x_partition(name, drop=drop)
+            print(f'已分离 {name}' + ('，原表已删除' if drop else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='t_x 按月分区与互动快照按天分区的维护')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ensure_parser = subparsers.add_parser('ensure', help='预先创建当前及未来几个月的分区')
+    ensure_parser.add_argument('--ahead', type=int, default=3, help='提前创建的月数')
+    ensure_parser.add_argument('--engagement-ahead', type=int, default=7, help='互动快照分区提前创建的天数')
+    subparsers.add_parser('list', help='列出 t_x 当前的分区')
+    detach_parser = subparsers.add_parser('detach', help='分离早于指定月份的分区（x_id 仍保留在 t_x_ids 中，不会重复入库）')
+    detach_parser.add_argument('--before', required=True, help='月份 YYYY-MM，早于该月的分区会被分离')
+    detach_parser.add_argument('--export', dest='export_dir', help='分离后压缩导出到该目录')
+    detach_parser.add_argument('--drop', action='store_true', help='导出后删除分区表（需要 --export）')
+    downsample_parser = subparsers.add_parser('downsample', help='将较早的互动快照合并为每小时一条，并删除原始按天分区')
+    downsample_parser.add_argument('--keep-days', type=int, default=int(os.getenv('X_ENGAGEMENT_KEEP_DAYS', '7')),
+                                   help='保留原始快照的天数')
+    args = parser.parse_args()
+
+    if args.command == 'ensure':
+        ensure(args.ahead, args.engagement_ahead)
+    elif args.command == 'downsample':
+        downsample(args.keep_days)
+    elif args.command == 'list':
+        show()
+    elif args.command == 'detach':
+        if not re.match(r'^\d{4}-\d{2}$', args.before):
+            parser.error('--before 需要 YYYY-MM 格式')
+        if args.drop and not args.export_dir:
+            parser.error('--drop 需要同时指定 --export，避免直接丢弃数据')
+        detach_before(args.before, args.export_dir, args.drop)
+
+
+if __name__ == "__main__":
+    main()
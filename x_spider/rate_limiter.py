@@ -0,0 +1,38 @@
+import asyncio
+import time
+from collections import deque
+
+
+class AsyncRateLimiter:
+    """
+    Global sliding-window limiter shared by all crawl tasks
+    Args:
+        max_requests: Maximum number of requests allowed inside one window
+        window: Window length in seconds
+    """
+
+    def __init__(self, max_requests: int, window: float):
+        self.max_requests = max(1, max_requests)
+        self.window = window
+        self._timestamps = deque()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a request slot is free inside the current window"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.window:
+                    self._timestamps.popleft()
+                if len(self._timestamps) < self.max_requests:
+                    self._timestamps.append(now)
+                    return
+                # 等待最早的请求滑出窗口
+                await asyncio.sleep(self.window - (now - self._timestamps[0]))
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
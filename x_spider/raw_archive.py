@@ -0,0 +1,184 @@
+import argparse
+import glob
+import gzip
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时退回 gzip
+    zstandard = None
+
+from x_schema import decode_archive_record
+
+SEGMENT_SUFFIX = '.jsonl.zst' if zstandard else '.jsonl.gz'
+
+
+def _compress(payload: bytes) -> bytes:
+    if zstandard:
+        return zstandard.ZstdCompressor(level=10).compress(payload)
+    return gzip.compress(payload)
+
+
+class RawArchiveWriter:
+    """
+    Append-only archive of raw GraphQL responses, one compressed JSONL segment per UTC day
+    Records are buffered and appended as independent zstd frames (or gzip members),
+    so a segment stays readable even if the process dies between flushes.
+    Args:
+        root: Directory holding the segments
+        flush_records: Number of records per appended frame
+    """
+
+    def __init__(self, root: str, flush_records: int = 50):
+        self.root = root
+        self.flush_records = max(1, flush_records)
+        self.records: List[bytes] = []
+        self.segment_day = None
+        os.makedirs(root, exist_ok=True)
+
+    def segment_path(self, day: str) -> str:
+        return os.path.join(self.root, f'{day}{SEGMENT_SUFFIX}')
+
+    def write(self, user: Dict[str, Any], operation: str, data: Dict[str, Any]) -> None:
+        now = datetime.now(timezone.utc)
+        day = now.strftime('%Y-%m-%d')
+        if self.segment_day and day != self.segment_day:
+            self.flush()
+        self.segment_day = day
+        record = {
+            'fetched_at': now.isoformat(),
+            'operation': operation,
+            'user_id': user.get('user_id'),
+            'username': user.get('screen_name'),
+            'user_link': user.get('user_link'),
+            'data': data,
+        }
+        self.records.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        if len(self.records) >= self.flush_records:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.records:
+            return
+        frame = _compress(b'\n'.join(self.records) + b'\n')
+        with open(self.segment_path(self.segment_day), 'ab') as f:
+            f.write(frame)
+        self.records = []
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def iter_segment(path: str, decode: str = 'json') -> Iterator[Dict[str, Any]]:
+    """Yield archived records of one segment, across all appended frames (decode as in x_schema)"""
+    if path.endswith('.zst'):
+        if not zstandard:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        raw = open(path, 'rb')
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True))
+    else:
+        f = gzip.open(path, 'rb')
+    with f:
+        for line in f:
+            if line.strip():
+                yield decode_archive_record(line, decode)
+
+
+def list_segments(root: str, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[str]:
+    """Segments under root, optionally limited to an inclusive YYYY-MM-DD range"""
+    segments = []
+    for path in sorted(glob.glob(os.path.join(root, '*.jsonl.*'))):
+        day = os.path.basename(path).split('.')[0]
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        segments.append(path)
+    return segments
+
+
+def replay_segment(path: str, batch_size: int = 5000) -> Dict[str, Any]:
+    """Parse every UserTweets record of a segment and load the items into t_x"""
+    from x_parser import parse_user_timeline_records
+    from db_utils import insert_x_data
+
+    started = time.monotonic()
+    stats = {'segment': os.path.basename(path), 'records': 0, 'parsed': 0, 'inserted': 0}
+    # 回放不是抓取，写入时不更新 t_x_user_stats 的 last_crawled_at
+    batch = {}
+    for record in iter_segment(path):
+        if record.get('operation') != 'UserTweets':
+            continue
+        stats['records'] += 1
+        for x_item in parse_user_timeline_records(record['data']):
+            x_item.username = record.get('username')
+            x_item.user_id = record.get('user_id')
+            x_item.user_link = record.get('user_link')
+            batch[x_item.x_id] = x_item
+        if len(batch) >= batch_size:
+            stats['parsed'] += len(batch)
+            stats['inserted'] += insert_x_data(batch, crawl=False)
+            batch = {}
+    if batch:
+        stats['parsed'] += len(batch)
+        stats['inserted'] += insert_x_data(batch, crawl=False)
+    stats['seconds'] = round(time.monotonic() - started, 2)
+    return stats
+
+
+def replay(root: str, workers: int, date_from: Optional[str] = None, date_to: Optional[str] = None,
+           batch_size: int = 5000) -> None:
+    """Replay archived segments through the parser and insert_x_data, one process per segment"""
+    segments = list_segments(root, date_from, date_to)
+    if not segments:
+        print(f'{root} 下没有找到归档分段')
+        return
+    print(f'开始回放 {len(segments)} 个归档分段，进程数 {workers}')
+    totals = {'records': 0, 'parsed': 0, 'inserted': 0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(replay_segment, path, batch_size): path for path in segments}
+        for future in as_completed(futures):
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f'回放 {futures[future]} 失败: {e}')
+                continue
+            print(f"{stats['segment']}: {stats['records']} 个响应, 解析 {stats['parsed']} 条, 入库 {stats['inserted']} 条, 用时 {stats['seconds']}s")
+            for key in totals:
+                totals[key] += stats[key]
+    print(f"回放完成: {totals['records']} 个响应, 解析 {totals['parsed']} 条, 入库 {totals['inserted']} 条")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='原始响应归档的离线回放')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    replay_parser = subparsers.add_parser('replay', help='将归档重新解析并写入 t_x')
+    replay_parser.add_argument('--dir', default=os.getenv('X_RAW_ARCHIVE_DIR', 'raw_archive'), help='归档目录')
+    replay_parser.add_argument('--from', dest='date_from', help='起始日期 YYYY-MM-DD（含）')
+    replay_parser.add_argument('--to', dest='date_to', help='结束日期 YYYY-MM-DD（含）')
+    replay_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行进程数')
+    replay_parser.add_argument('--batch-size', type=int, default=5000, help='每批写库条数，达到 DB_COPY_MIN_ROWS 的批次用 COPY 写入')
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        replay(args.dir, args.workers, args.date_from, args.date_to, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
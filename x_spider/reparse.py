@@ -0,0 +1,163 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+from db_utils import (collect_x_refs, get_reparse_progress, get_x_rows_without_entities, mark_reparse_segment,
+                      reparse_x_rows, update_x_entities, upsert_x_refs, x_item_row)
+from metrics import metrics
+from raw_archive import iter_segment, list_segments
+from x_parser import ENTITY_KINDS, item_entities, parse_user_timeline_records
+from x_schema import DECODE_MODES
+
+
+def parse_segment(path: str, decode: str = 'schema') -> Tuple[Dict[str, Any], List[tuple], List[tuple]]:
+    """
+    Re-parse every UserTweets record of an archive segment into t_x rows
+    Records are in fetch order, so when a tweet was fetched several times the
+    latest payload (e.g. the newest view count) wins.
+    Returns:
+        Segment stats, the t_x rows (one per x_id) and the t_x_refs rows of the
+        quoted/retweeted tweets (one per ref_id)
+    """
+    started = time.monotonic()
+    stats = {'segment': os.path.basename(path), 'size': os.path.getsize(path), 'records': 0}
+    items = {}
+    for record in iter_segment(path, decode):
+        if record.get('operation') != 'UserTweets':
+            continue
+        stats['records'] += 1
+        for x_item in parse_user_timeline_records(record['data']):
+            x_item.username = record.get('username')
+            x_item.user_id = record.get('user_id')
+            x_item.user_link = record.get('user_link')
+            items[x_item.x_id] = x_item
+    rows = [x_item_row(x_id, x_item) for x_id, x_item in items.items()]
+    refs = collect_x_refs(items.values())
+    stats['items'] = len(rows)
+    stats['refs'] = len(refs)
+    stats['parse_seconds'] = round(time.monotonic() - started, 2)
+    return stats, rows, refs
+
+
+def write_segment(job: str, stats: Dict[str, Any], rows: List[tuple], refs: List[tuple],
+                  batch_size: int) -> Dict[str, Any]:
+    totals = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for start in range(0, len(rows), batch_size):
+        result = reparse_x_rows(rows[start:start + batch_size], page_size=batch_size)
+        for key in totals:
+            totals[key] += result[key]
+    for start in range(0, len(refs), batch_size):
+        upsert_x_refs(refs[start:start + batch_size], page_size=batch_size)
+    stats.update(totals)
+    # 所有批次写完后才记录进度，中断后该分段会整体重做（写入是幂等的）
+    mark_reparse_segment(job, stats['segment'], stats['size'], stats)
+    return stats
+
+
+def reparse(root: str, job: str, workers: int, date_from: str = None, date_to: str = None,
+            batch_size: int = 5000, restart: bool = False, decode: str = 'schema') -> None:
+    """
+    Re-derive t_x rows from the raw archive with the current parser
+    Segments are parsed in a process pool and written by this process in
+    chronological order, so a newer fetch of the same tweet always lands last.
+    Finished segments are recorded per job and skipped on the next run unless
+    they have grown since (the current day's segment keeps being appended).
+    """
+    segments = list_segments(root, date_from, date_to)
+    done = {} if restart else get_reparse_progress(job)
+    pending = [path for path in segments if done.get(os.path.basename(path)) != os.path.getsize(path)]
+    if not pending:
+        print(f'{root} 下没有需要重新解析的分段（共 {len(segments)} 个，任务 {job}）')
+        return
+    print(f'任务 {job}: 重新解析 {len(pending)}/{len(segments)} 个分段，进程数 {workers}')
+
+    totals = {'records': 0, 'items': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0}
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 只提前提交有限个分段，避免解析结果在内存中堆积
+        queue = deque()
+        paths = iter(pending)
+        for path in paths:
+            queue.append(executor.submit(parse_segment, path, decode))
+            if len(queue) > workers:
+                break
+        while queue:
+            future = queue.popleft()
+            next_path = next(paths, None)
+            if next_path:
+                queue.append(executor.submit(parse_segment, next_path, decode))
+            stats, rows, refs = future.result()
+            with metrics.timer('reparse_write_seconds'):
+                stats = write_segment(job, stats, rows, refs, batch_size)
+            metrics.inc('reparse_segments_total')
+            print(f"{stats['segment']}: {stats['records']} 个响应, {stats['items']} 条, 引用 {stats['refs']} 条, 新增 {stats['inserted']}, "
+                  f"更新 {stats['updated']}, 未变 {stats['unchanged']}, 解析用时 {stats['parse_seconds']}s")
+            for key in totals:
+                totals[key] += stats[key]
+    print(f"重新解析完成: {totals['records']} 个响应, {totals['items']} 条, 新增 {totals['inserted']}, "
+          f"更新 {totals['updated']}, 未变 {totals['unchanged']}, 用时 {time.monotonic() - started:.1f}s")
+
+
+def _row_entities(rows: List[tuple]) -> List[tuple]:
+    result = []
+    for row_id, item_type, data in rows:
+        entities = item_entities({'itemType': item_type, 'data': data})
+        result.append((row_id, *(entities[kind] for kind in ENTITY_KINDS)))
+    return result
+
+
+def backfill_entities(workers: int, batch_size: int = 5000) -> None:
+    """
+    Fill the entity columns of rows stored before they existed, from their data
+    Rows are read in id order and written back per batch; a row is done once its
+    columns are non-NULL, so an interrupted run simply continues.
+    """
+    after_id = 0
+    total = 0
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            rows = get_x_rows_without_entities(after_id, batch_size * workers)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            chunks = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+            for entity_rows in executor.map(_row_entities, chunks):
+                update_x_entities(entity_rows, page_size=batch_size)
+                total += len(entity_rows)
+            print(f'已补全 {total} 条的实体列')
+    print(f'实体列补全完成: {total} 条, 用时 {time.monotonic() - started:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用当前解析器重新解析原始响应归档，并批量更新 t_x')
+    parser.add_argument('--source', choices=('archive', 'rows'), default='archive',
+                        help='archive: 从原始响应归档重新解析；rows: 只根据已入库的 data 补全实体列')
+    parser.add_argument('--dir', default=os.getenv('X_RAW_ARCHIVE_DIR', 'raw_archive'), help='归档目录')
+    parser.add_argument('--job', default='reparse', help='任务名，进度按任务记录；解析器再次变更时换一个任务名')
+    parser.add_argument('--from', dest='date_from', help='起始日期 YYYY-MM-DD（含）')
+    parser.add_argument('--to', dest='date_to', help='结束日期 YYYY-MM-DD（含）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='解析进程数')
+    parser.add_argument('--batch-size', type=int, default=5000, help='每条 SQL 写入的行数')
+    parser.add_argument('--decode', choices=DECODE_MODES, default=os.getenv('X_REPARSE_DECODE', 'schema'),
+                        help='归档解码方式，schema 只解码解析器用到的字段（需要 msgspec，否则自动退回 json）')
+    parser.add_argument('--restart', action='store_true', help='忽略已记录的进度，重新处理所有分段')
+    args = parser.parse_args()
+
+    try:
+        if args.source == 'rows':
+            backfill_entities(args.workers, args.batch_size)
+            return
+        reparse(args.dir, args.job, args.workers, args.date_from, args.date_to, args.batch_size, args.restart, args.decode)
+    finally:
+        metrics.write_reports('reparse')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from db_utils import get_user_post_counts, update_poll_schedule
+
+# 估算发帖频率的回溯窗口（小时）
+RATE_WINDOW_HOURS = float(os.getenv('X_POLL_RATE_WINDOW_HOURS', '168'))
+# 轮询间隔上下限
+MIN_POLL_INTERVAL = timedelta(minutes=float(os.getenv('X_POLL_MIN_MINUTES', '15')))
+MAX_POLL_INTERVAL = timedelta(hours=float(os.getenv('X_POLL_MAX_HOURS', '24')))
+# 期望每次轮询平均能拿到的新推文数
+TARGET_NEW_PER_POLL = float(os.getenv('X_POLL_TARGET_NEW', '1'))
+
+
+def poll_interval(post_rate: float) -> timedelta:
+    """
+    Time until the next poll for a user posting `post_rate` items per hour
+    Busy accounts are polled about once per TARGET_NEW_PER_POLL posts, quiet
+    accounts back off up to MAX_POLL_INTERVAL.
+    """
+    if post_rate <= 0:
+        return MAX_POLL_INTERVAL
+    interval = timedelta(hours=TARGET_NEW_PER_POLL / post_rate)
+    return max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, interval))
+
+
+def build_schedule(post_counts: Dict[str, int], now: datetime = None) -> List[Dict[str, Any]]:
+    """Turn per-user post counts over RATE_WINDOW_HOURS into post rates and next poll times"""
+    now = now or datetime.now(timezone.utc)
+    schedules = []
+    for user_id, count in post_counts.items():
+        post_rate = count / RATE_WINDOW_HOURS
+        schedules.append({
+            'user_id': user_id,
+            'post_rate': post_rate,
+            'next_poll_at': now + poll_interval(post_rate),
+        })
+    return schedules
+
+
+def schedule_users(user_ids: List[str]) -> None:
+    """Re-estimate posting rates of freshly crawled users and set their next poll time"""
+    if not user_ids:
+        return
+    schedules = build_schedule(get_user_post_counts(user_ids, RATE_WINDOW_HOURS))
+    update_poll_schedule(schedules)
+    busy = sum(1 for item in schedules if item['next_poll_at'] - datetime.now(timezone.utc) <= MIN_POLL_INTERVAL)
+    print(f'已为 {len(schedules)} 个用户安排下次轮询，其中 {busy} 个高频用户按最短间隔轮询')
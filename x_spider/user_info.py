@@ -1,27 +1,14 @@
-from curl_cffi import requests
 import json
 from dotenv import load_dotenv
 
 load_dotenv()
 from db_utils import upsert_x_user
+from x_client import XClient
 
 
-with open('./headers.json', 'r', encoding='utf-8') as file:
-    cookie = json.load(file)
-
 def x_user_info(screen_name):
-    url = f"https://x.com/i/api/graphql/96tVxbPqMZDoYB5pmzezKA/UserByScreenName?variables=%7B%22screen_name%22%3A%22{screen_name}%22%2C%22withGrokTranslatedBio%22%3Afalse%7D&features=%7B%22hidden_profile_subscriptions_enabled%22%3Atrue%2C%22payments_enabled%22%3Afalse%2C%22profile_label_improvements_pcf_label_in_post_enabled%22%3Atrue%2C%22rweb_tipjar_consumption_enabled%22%3Atrue%2C%22verified_phone_label_enabled%22%3Afalse%2C%22subscriptions_verification_info_is_identity_verified_enabled%22%3Atrue%2C%22subscriptions_verification_info_verified_since_enabled%22%3Atrue%2C%22highlights_tweets_tab_ui_enabled%22%3Atrue%2C%22responsive_web_twitter_article_notes_tab_enabled%22%3Atrue%2C%22subscriptions_feature_can_gift_premium%22%3Atrue%2C%22creator_subscriptions_tweet_preview_api_enabled%22%3Atrue%2C%22responsive_web_graphql_skip_user_profile_image_extensions_enabled%22%3Afalse%2C%22responsive_web_graphql_timeline_navigation_enabled%22%3Atrue%7D&fieldToggles=%7B%22withAuxiliaryUserLabels%22%3Atrue%7D"
-
-
-    payload = ""
-    headers = cookie.get('headers')
-    headers["User-Agent"] = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36 Edg/140.0.0.0"
-    response = requests.request("GET", url, headers=headers, data=payload, impersonate="chrome124", timeout=30)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(response.status_code)
-        
+    with XClient() as client:
+        return client.user_by_screen_name(screen_name)
 
 
 def parse_user_info(data):
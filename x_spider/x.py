@@ -1,45 +1,101 @@
-from collections import UserString
-from curl_cffi import requests
+import argparse
+import asyncio
 import json
-from x_parser import parse_user_timeline
+from x_parser import parse_user_timeline_records, max_tweet_id
 import time
 import os
-from datetime import datetime
-import pytz
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
-from db_utils import get_all_x_users
-
-
-with open('./headers.json', 'r', encoding='utf-8') as file:
-    cookie = json.load(file)
-
-
-def xx(user_id):
-    try:
-        url = f"https://x.com/i/api/graphql/E3opETHurmVJflFsUBVuUQ/UserTweets?variables=%7B%22userId%22%3A%22{user_id}%22%2C%22count%22%3A20%2C%22includePromotedContent%22%3Atrue%2C%22withQuickPromoteEligibilityTweetFields%22%3Atrue%2C%22withVoice%22%3Atrue%2C%22withV2Timeline%22%3Atrue%7D&features=%7B%22rweb_tipjar_consumption_enabled%22%3Atrue%2C%22responsive_web_graphql_exclude_directive_enabled%22%3Atrue%2C%22verified_phone_label_enabled%22%3Afalse%2C%22creator_subscriptions_tweet_preview_api_enabled%22%3Atrue%2C%22responsive_web_graphql_timeline_navigation_enabled%22%3Atrue%2C%22responsive_web_graphql_skip_user_profile_image_extensions_enabled%22%3Afalse%2C%22communities_web_enable_tweet_community_results_fetch%22%3Atrue%2C%22c9s_tweet_anatomy_moderator_badge_enabled%22%3Atrue%2C%22articles_preview_enabled%22%3Atrue%2C%22responsive_web_edit_tweet_api_enabled%22%3Atrue%2C%22graphql_is_translatable_rweb_tweet_is_translatable_enabled%22%3Atrue%2C%22view_counts_everywhere_api_enabled%22%3Atrue%2C%22longform_notetweets_consumption_enabled%22%3Atrue%2C%22responsive_web_twitter_article_tweet_consumption_enabled%22%3Atrue%2C%22tweet_awards_web_tipping_enabled%22%3Afalse%2C%22creator_subscriptions_quote_tweet_preview_enabled%22%3Afalse%2C%22freedom_of_speech_not_reach_fetch_enabled%22%3Atrue%2C%22standardized_nudges_misinfo%22%3Atrue%2C%22tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled%22%3Atrue%2C%22rweb_video_timestamps_enabled%22%3Atrue%2C%22longform_notetweets_rich_text_read_enabled%22%3Atrue%2C%22longform_notetweets_inline_media_enabled%22%3Atrue%2C%22responsive_web_enhance_cards_enabled%22%3Afalse%7D&fieldToggles=%7B%22withArticlePlainText%22%3Afalse%7D"
-
-        payload = ""
-        headers = cookie.get('headers')
-        headers["referer"] = "x.com"
-        headers["user-agent"] = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36 Edg/140.0.0.0"
-        
-
-        response = requests.request("GET", url, headers=headers, data=payload, impersonate="chrome124", timeout=30)
-        if response.status_code == 200:
-            return response.json()
-    except Exception as e:
-        print(f"Error fetching user tweets: {e}")
-        return None
-
+from db_utils import get_all_x_users, get_due_x_users, get_crawl_states, claim_x_users, release_x_users, get_db_time
+from ingest import XDataWriter
+from metrics import metrics
+from rate_limiter import AsyncRateLimiter
+from raw_archive import RawArchiveWriter
+from scheduler import schedule_users
+from x_client import XClient, AsyncXClient
+from x_schema import DECODE_MODES
+
+
+def collect_user_items(user, x_data_raw, since_id=None, refresh=False):
+    """
+    Parse one user's timeline, skipping entries at or below since_id
+    With refresh the entries at or below since_id are kept as well, so their
+    engagement can be updated; only entries above it count as new.
+    Returns:
+        Tuple of X records keyed by x_id and the user's crawl state
+        (newest tweet id and number of new entries)
+    """
+    username = user.get('screen_name')
+    x_items = parse_user_timeline_records(x_data_raw, since_id=None if refresh else since_id)
+    new_count = len(x_items)
+    if refresh and since_id is not None:
+        new_count = sum(1 for x_item in x_items if (max_tweet_id(x_item.x_id) or 0) > since_id)
+    if new_count:
+        print(f'user {username} 爬取到 {new_count} 条新twitter！')
+    else:
+        print(f'user {username} 没有新twitter')
+    user_datas = {}
+    last_tweet_id = since_id
+    for x_item in x_items:
+        x_item.username = username
+        x_item.user_id = user.get('user_id')
+        x_item.user_link = user.get('user_link')
+        user_datas[x_item.x_id] = x_item
+        item_tweet_id = max_tweet_id(x_item.x_id)
+        if item_tweet_id is not None and (last_tweet_id is None or item_tweet_id > last_tweet_id):
+            last_tweet_id = item_tweet_id
+    return user_datas, {'user_id': user.get('user_id'), 'last_tweet_id': last_tweet_id, 'new_count': new_count}
+
+
+def crawl_users(users, since_ids, writer, archive=None, decode=None):
+    with XClient(decode=decode) as client:
+        for user in users:
+            if user.get('expire'):
+                continue
+            user_id = user.get('user_id')
+            x_data_raw = client.user_tweets(user_id)
+            # with open(f'{user_id}.json',  'w', encoding='utf-8') as f:
+            #     json.dump(x_data_raw, f, ensure_ascii=False, indent=4)
+            if x_data_raw and archive:
+                archive.write(user, 'UserTweets', x_data_raw)
+            if x_data_raw:
+                writer.add_user(*collect_user_items(user, x_data_raw, since_ids.get(user_id), writer.refresh))
+            time.sleep(2)
+    writer.flush()
+
+
+async def crawl_users_async(users, since_ids, writer, concurrency, max_requests, window, archive=None, decode=None):
+    """
+    Crawl all users concurrently
+    Args:
+        users: Users returned by get_all_x_users
+        since_ids: High-water marks keyed by user_id
+        writer: XDataWriter receiving parsed items
+        concurrency: Maximum number of in-flight requests
+        max_requests: Request budget per account per rate-limit window
+        window: Rate-limit window in seconds
+        archive: Optional RawArchiveWriter keeping the raw responses
+        decode: Response decoding mode, 'json' or 'schema'
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def crawl_one(client, user):
+        user_id = user.get('user_id')
+        async with semaphore:
+            await limiter.acquire()
+            x_data_raw = await client.user_tweets(user_id)
+        if x_data_raw and archive:
+            archive.write(user, 'UserTweets', x_data_raw)
+        if x_data_raw:
+            await writer.add_user_async(*collect_user_items(user, x_data_raw, since_ids.get(user_id), writer.refresh))
 
-def upload_to_db(data):
-    from db_utils import insert_x_data
-    try:
-        insert_x_data(data)
-    except Exception as e:
-        print(f"Error uploading to database: {e}")
+    async with AsyncXClient(max_clients=concurrency, decode=decode) as client:
+        # 全局限流额度随可用账号数线性增长
+        limiter = AsyncRateLimiter(max_requests * len(client.pool), window)
+        await asyncio.gather(*(crawl_one(client, user) for user in users if not user.get('expire')))
+    await writer.flush_async()
 
 # xx("129711053", "https://x.com/StopMalvertisin")
 # exit()
@@ -47,36 +103,100 @@ def upload_to_db(data):
 # with open('users.json', 'r', encoding='utf-8') as uf:
 #     users = json.load(uf)
 
-users = get_all_x_users()
-
 
-timezone = pytz.timezone('Asia/Shanghai')
-current_time = datetime.now(timezone)
-formatted_cur_day = current_time.strftime('%Y-%m-%d')
-output_name = os.path.join('risk', 'twitter', f'{formatted_cur_day}.json')
-output_datas = {}
+def run_crawl(users, since_ids, writer, args, archive=None):
+    if args.use_async:
+        asyncio.run(crawl_users_async(users, since_ids, writer, args.concurrency, args.max_requests, args.window,
+                                      archive, args.decode))
+    else:
+        crawl_users(users, since_ids, writer, archive, args.decode)
+
+
+def crawl_leased(args, writer, archive=None):
+    """
+    Sharded mode: repeatedly lease a batch of users, crawl it, then release it
+    Any number of workers can run this against the same database; each user is
+    leased to one worker at a time, and a crashed worker's users are picked up
+    again once its lease expires.
+    """
+    worker_id = args.worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    # 与 last_attempt_at 使用同一个时钟（数据库），worker 本地时钟偏差不会让同一轮重复领取
+    sweep_started = get_db_time()
+    print(f'worker {worker_id} 开始领取用户')
+    while True:
+        users = claim_x_users(
+            worker_id,
+            args.lease_batch,
+            args.lease_seconds,
+            due_only=args.schedule,
+            # 同一轮中每个用户只尝试一次，抓取失败的用户留到下一轮
+            attempted_before=sweep_started,
+        )
+        if not users:
+            break
+        user_ids = [user['user_id'] for user in users]
+        since_ids = {user['user_id']: user['last_tweet_id'] for user in users}
+        done_before = len(writer.crawled_user_ids)
+        try:
+            run_crawl(users, since_ids, writer, args, archive)
+            writer.flush()
+            schedule_users(writer.crawled_user_ids[done_before:])
+        finally:
+            release_x_users(worker_id, user_ids)
+        print(f'worker {worker_id} 完成 {len(users)} 个用户')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='抓取关注用户的最新推文')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='使用 asyncio 并发抓取')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('X_CONCURRENCY', '8')), help='最大并发请求数')
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv('X_RATE_LIMIT', '50')), help='每个账号每个限流窗口内的最大请求数')
+    parser.add_argument('--window', type=float, default=float(os.getenv('X_RATE_WINDOW', '60')), help='限流窗口长度（秒）')
+    parser.add_argument('--flush-items', type=int, default=int(os.getenv('X_FLUSH_ITEMS', '200')), help='缓冲区达到多少条时写库')
+    parser.add_argument('--flush-interval', type=float, default=float(os.getenv('X_FLUSH_INTERVAL', '30')), help='距上次写库多少秒后写库')
+    parser.add_argument('--archive-dir', default=os.getenv('X_RAW_ARCHIVE_DIR'), help='保存原始响应的归档目录，不设置则不归档')
+    parser.add_argument('--decode', choices=DECODE_MODES, default=os.getenv('X_DECODE', 'json'),
+                        help='响应解码方式：json 完整解码，schema 只解码解析器用到的字段（需要 msgspec）')
+    parser.add_argument('--schedule', action='store_true', help='只抓取按发帖频率排期已到期的用户')
+    parser.add_argument('--lease', action='store_true', help='分片模式：多个 worker 通过数据库租约领取互不重叠的用户')
+    parser.add_argument('--worker-id', default=os.getenv('X_WORKER_ID'), help='worker 标识，默认 主机名-进程号')
+    parser.add_argument('--lease-batch', type=int, default=int(os.getenv('X_LEASE_BATCH', '20')), help='每次领取的用户数')
+    parser.add_argument('--lease-seconds', type=int, default=int(os.getenv('X_LEASE_SECONDS', '600')), help='租约时长（秒），超时未释放的用户可被其他 worker 接手')
+    parser.add_argument('--refresh', action='store_true', default=os.getenv('X_REFRESH') == '1',
+                        help='同时更新已入库推文的互动数据，只改写内容或互动数有变化的行（也可设置 X_REFRESH=1）')
+    parser.add_argument('--trace-spans', action='store_true', help='在运行摘要中记录每个阶段的 span 耗时（也可设置 X_METRICS_SPANS=1）')
+    args = parser.parse_args()
+    if args.trace_spans:
+        metrics.spans_enabled = True
+
+    # 解析结果按批次流式写库，内存占用与用户数无关
+    writer = XDataWriter(flush_items=args.flush_items, flush_interval=args.flush_interval, refresh=args.refresh)
+    archive = RawArchiveWriter(args.archive_dir) if args.archive_dir else None
+    if archive and args.decode == 'schema':
+        # 按 schema 解码会丢弃未声明的字段，归档需要完整响应
+        print('已开启原始响应归档，解码方式改为 json')
+        args.decode = 'json'
 
-for user in users:
-    username = user.get('screen_name')
-    user_id = user.get('user_id')
-    user_link = user.get('user_link')
-
-    if not user.get('expire'):
-        x_data_raw = xx(user_id)
-        # with open(f'{user_id}.json',  'w', encoding='utf-8') as f:
-        #     json.dump(x_data_raw, f, ensure_ascii=False, indent=4)
-        if x_data_raw:
-            x_items = parse_user_timeline(x_data_raw)
-            print(f'user {username} 爬取到 {len(x_items)} 条twitter！')
-            for x_item in x_items:
-                x_item['username'] = username
-                x_item['user_id'] = user_id
-                x_item['user_link'] = user_link
-                output_datas[x_item['x_id']] = x_item
-            # print(x_items)
-        time.sleep(2)
-
-upload_to_db(output_datas)
-
-# with open('output_2.json', 'w', encoding='utf-8') as f:
-#     json.dump(output_datas, f, ensure_ascii=False, indent=4)
\ No newline at end of file
+    try:
+        if args.lease:
+            crawl_leased(args, writer, archive)
+        else:
+            if args.schedule:
+                users = get_due_x_users()
+                print(f'本轮到期用户 {len(users)} 个')
+            else:
+                users = get_all_x_users()
+            since_ids = get_crawl_states()
+            run_crawl(users, since_ids, writer, args, archive)
+            # 根据最新的发帖历史重新安排这些用户的下次轮询时间
+            schedule_users(writer.crawled_user_ids)
+    finally:
+        if archive:
+            archive.close()
+        metrics.write_reports('crawl')
+
+    print(writer.summary())
+
+
+if __name__ == "__main__":
+    main()
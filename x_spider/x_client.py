@@ -0,0 +1,396 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from curl_cffi import requests
+
+from metrics import metrics
+from x_schema import decode_response
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36 Edg/140.0.0.0"
+IMPERSONATE = "chrome124"
+
+
+def _encode(value: Dict[str, Any]) -> str:
+    return quote(json.dumps(value, separators=(',', ':')), safe='')
+
+
+class GraphQLEndpoint:
+    """
+    A GraphQL GET endpoint whose features/fieldToggles are encoded once
+    Args:
+        query_id: GraphQL query hash
+        operation: Operation name, e.g. UserTweets
+        variables: Default variables; per-call values are merged on top
+        features: Feature flags sent with every request
+        field_toggles: Field toggles sent with every request
+    """
+
+    def __init__(self, query_id: str, operation: str, variables: Dict[str, Any],
+                 features: Dict[str, Any], field_toggles: Dict[str, Any]):
+        self.operation = operation
+        self.base_url = f"https://x.com/i/api/graphql/{query_id}/{operation}"
+        self.variables = variables
+        self._static_query = f"&features={_encode(features)}&fieldToggles={_encode(field_toggles)}"
+
+    def build_url(self, **variables) -> str:
+        return f"{self.base_url}?variables={_encode({**self.variables, **variables})}{self._static_query}"
+
+
+USER_TWEETS = GraphQLEndpoint(
+    "E3opETHurmVJflFsUBVuUQ",
+    "UserTweets",
+    variables={
+        "userId": None,
+        "count": 20,
+        "includePromotedContent": True,
+        "withQuickPromoteEligibilityTweetFields": True,
+        "withVoice": True,
+        "withV2Timeline": True,
+    },
+    features={
+        "rweb_tipjar_consumption_enabled": True,
+        "responsive_web_graphql_exclude_directive_enabled": True,
+        "verified_phone_label_enabled": False,
+        "creator_subscriptions_tweet_preview_api_enabled": True,
+        "responsive_web_graphql_timeline_navigation_enabled": True,
+        "responsive_web_graphql_skip_user_profile_image_extensions_enabled": False,
+        "communities_web_enable_tweet_community_results_fetch": True,
+        "c9s_tweet_anatomy_moderator_badge_enabled": True,
+        "articles_preview_enabled": True,
+        "responsive_web_edit_tweet_api_enabled": True,
+        "graphql_is_translatable_rweb_tweet_is_translatable_enabled": True,
+        "view_counts_everywhere_api_enabled": True,
+        "longform_notetweets_consumption_enabled": True,
+        "responsive_web_twitter_article_tweet_consumption_enabled": True,
+        "tweet_awards_web_tipping_enabled": False,
+        "creator_subscriptions_quote_tweet_preview_enabled": False,
+        "freedom_of_speech_not_reach_fetch_enabled": True,
+        "standardized_nudges_misinfo": True,
+        "tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled": True,
+        "rweb_video_timestamps_enabled": True,
+        "longform_notetweets_rich_text_read_enabled": True,
+        "longform_notetweets_inline_media_enabled": True,
+        "responsive_web_enhance_cards_enabled": False,
+    },
+    field_toggles={"withArticlePlainText": False},
+)
+
+USER_BY_SCREEN_NAME = GraphQLEndpoint(
+    "96tVxbPqMZDoYB5pmzezKA",
+    "UserByScreenName",
+    variables={"screen_name": None, "withGrokTranslatedBio": False},
+    features={
+        "hidden_profile_subscriptions_enabled": True,
+        "payments_enabled": False,
+        "profile_label_improvements_pcf_label_in_post_enabled": True,
+        "rweb_tipjar_consumption_enabled": True,
+        "verified_phone_label_enabled": False,
+        "subscriptions_verification_info_is_identity_verified_enabled": True,
+        "subscriptions_verification_info_verified_since_enabled": True,
+        "highlights_tweets_tab_ui_enabled": True,
+        "responsive_web_twitter_article_notes_tab_enabled": True,
+        "subscriptions_feature_can_gift_premium": True,
+        "creator_subscriptions_tweet_preview_api_enabled": True,
+        "responsive_web_graphql_skip_user_profile_image_extensions_enabled": False,
+        "responsive_web_graphql_timeline_navigation_enabled": True,
+    },
+    field_toggles={"withAuxiliaryUserLabels": True},
+)
+
+
+def _record_response(endpoint: GraphQLEndpoint, response) -> None:
+    metrics.inc('x_http_requests_total', operation=endpoint.operation, status=response.status_code)
+    metrics.inc('x_http_response_bytes_total', len(response.content), operation=endpoint.operation)
+
+
+def _decode(endpoint: GraphQLEndpoint, response, mode: str) -> Optional[Dict[str, Any]]:
+    # 截断或非 JSON 的 200 响应、schema 校验失败只影响这一次请求，不中断整个抓取
+    try:
+        with metrics.timer('x_json_decode_seconds', operation=endpoint.operation, mode=mode):
+            return decode_response(endpoint.operation, response.content, mode)
+    except Exception as e:
+        metrics.inc('x_http_requests_total', operation=endpoint.operation, status='decode_error')
+        print(f"Error decoding {endpoint.operation} response: {e}")
+        return None
+
+
+def _build_headers(raw_headers: Dict[str, str]) -> Dict[str, str]:
+    headers = dict(raw_headers)
+    headers["referer"] = "x.com"
+    headers["user-agent"] = USER_AGENT
+    return headers
+
+
+class Credential:
+    """
+    One logged-in X account and its rate-limit state per GraphQL operation
+    Args:
+        name: Label used in logs
+        headers: Cookie/header set exported from the browser
+    """
+
+    # 连续多少次 403 后认为账号失效
+    MAX_FORBIDDEN = 3
+
+    def __init__(self, name: str, headers: Dict[str, str]):
+        self.name = name
+        self.headers = _build_headers(headers)
+        self.dead = False
+        self.forbidden_count = 0
+        self.in_flight = 0
+        # operation -> [remaining, reset_at(epoch seconds)]
+        self.limits: Dict[str, List[Optional[float]]] = {}
+
+    def headroom(self, operation: str, now: float) -> Optional[float]:
+        """Requests left in the current window, None if parked or dead"""
+        if self.dead:
+            return None
+        remaining, reset_at = self.limits.get(operation, (None, 0.0))
+        if reset_at and reset_at <= now:
+            return float('inf')
+        if remaining is None:
+            return float('inf')
+        if remaining <= 0:
+            return None
+        return remaining
+
+    def reserve(self, operation: str) -> None:
+        self.in_flight += 1
+        limit = self.limits.get(operation)
+        if limit and limit[0] is not None:
+            limit[0] -= 1
+
+    def release(self) -> None:
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def update(self, operation: str, status_code: int, response_headers) -> None:
+        """Record x-rate-limit-* headers and take dead credentials out of rotation"""
+        self.release()
+        remaining = response_headers.get('x-rate-limit-remaining')
+        reset_at = response_headers.get('x-rate-limit-reset')
+        limit = self.limits.setdefault(operation, [None, 0.0])
+        if remaining is not None:
+            limit[0] = int(remaining)
+        if reset_at is not None:
+            limit[1] = float(reset_at)
+
+        if status_code == 429:
+            limit[0] = 0
+            if not limit[1] or limit[1] <= time.time():
+                limit[1] = time.time() + 15 * 60
+            print(f"Credential {self.name} rate limited on {operation} until {time.strftime('%H:%M:%S', time.localtime(limit[1]))}")
+        elif status_code == 401:
+            self.dead = True
+            print(f"Credential {self.name} is no longer authorized, removed from rotation")
+        elif status_code == 403:
+            self.forbidden_count += 1
+            if self.forbidden_count >= self.MAX_FORBIDDEN:
+                self.dead = True
+                print(f"Credential {self.name} got {self.forbidden_count} consecutive 403s, removed from rotation")
+        elif status_code == 200:
+            self.forbidden_count = 0
+
+
+class CredentialPool:
+    """
+    Routes each request to the live account with the most rate-limit headroom
+    Exhausted accounts are parked until their x-rate-limit-reset time.
+    """
+
+    def __init__(self, credentials: List[Credential]):
+        if not credentials:
+            raise ValueError("CredentialPool needs at least one credential")
+        self.credentials = credentials
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    @property
+    def alive(self) -> bool:
+        return any(not credential.dead for credential in self.credentials)
+
+    def acquire(self, operation: str) -> Optional[Credential]:
+        """Pick the credential with the most headroom, or None when all are parked/dead"""
+        now = time.time()
+        best, best_key = None, None
+        for credential in self.credentials:
+            headroom = credential.headroom(operation, now)
+            if headroom is None:
+                continue
+            # 余量相同（例如都未知）时优先选择在途请求更少的账号
+            key = (headroom, -credential.in_flight)
+            if best_key is None or key > best_key:
+                best, best_key = credential, key
+        if best:
+            best.reserve(operation)
+        return best
+
+    def wait_time(self, operation: str) -> float:
+        """Seconds until the earliest parked credential resets"""
+        now = time.time()
+        resets = [
+            credential.limits[operation][1] - now
+            for credential in self.credentials
+            if not credential.dead and operation in credential.limits
+        ]
+        return max(1.0, min(resets)) if resets else 1.0
+
+
+def load_credentials(path: str = './headers.json') -> CredentialPool:
+    """
+    Load one or more cookie/header sets exported from the browser
+    Accepted formats:
+        {"headers": {...}}                                   single account
+        {"accounts": [{"name": "a", "headers": {...}}, ...]} several accounts
+        [{"headers": {...}}, ...]                            several accounts
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        cookie = json.load(file)
+    if isinstance(cookie, dict) and 'accounts' in cookie:
+        accounts = cookie['accounts']
+    elif isinstance(cookie, list):
+        accounts = cookie
+    else:
+        accounts = [cookie]
+    return CredentialPool([
+        Credential(account.get('name') or f'account-{index}', account.get('headers'))
+        for index, account in enumerate(accounts)
+    ])
+
+
+class XClient:
+    """
+    Blocking X GraphQL client backed by a credential pool
+    Each account keeps its own persistent keep-alive session (so cookies never
+    leak between accounts); curl_cffi negotiates HTTP/2 when impersonating Chrome.
+    decode='schema' decodes only the fields the parser reads (see x_schema),
+    defaulting to X_DECODE or full JSON decoding.
+    """
+
+    def __init__(self, pool: Optional[CredentialPool] = None, timeout: int = 30, decode: Optional[str] = None):
+        self.pool = pool if pool is not None else load_credentials()
+        self.timeout = timeout
+        self.decode = decode or os.getenv('X_DECODE', 'json')
+        self.sessions: Dict[str, requests.Session] = {}
+
+    def _session(self, credential: Credential) -> requests.Session:
+        session = self.sessions.get(credential.name)
+        if session is None:
+            session = requests.Session(headers=credential.headers, impersonate=IMPERSONATE, timeout=self.timeout)
+            self.sessions[credential.name] = session
+        return session
+
+    def get(self, endpoint: GraphQLEndpoint, **variables) -> Optional[Dict[str, Any]]:
+        url = endpoint.build_url(**variables)
+        for _ in range(len(self.pool) + 1):
+            credential = self.pool.acquire(endpoint.operation)
+            if credential is None:
+                if not self.pool.alive:
+                    print(f"Error fetching {endpoint.operation}: no usable credentials left")
+                    return None
+                time.sleep(self.pool.wait_time(endpoint.operation))
+                continue
+            try:
+                with metrics.timer('x_http_request_seconds', operation=endpoint.operation):
+                    response = self._session(credential).get(url)
+            except Exception as e:
+                credential.release()
+                metrics.inc('x_http_requests_total', operation=endpoint.operation, status='error')
+                print(f"Error fetching {endpoint.operation}: {e}")
+                return None
+            credential.update(endpoint.operation, response.status_code, response.headers)
+            _record_response(endpoint, response)
+            if response.status_code == 200:
+                return _decode(endpoint, response, self.decode)
+            print(f"Error fetching {endpoint.operation} with {credential.name}: status {response.status_code}")
+            if response.status_code not in (401, 403, 429):
+                return None
+        return None
+
+    def user_tweets(self, user_id: str, **variables) -> Optional[Dict[str, Any]]:
+        return self.get(USER_TWEETS, userId=str(user_id), **variables)
+
+    def user_by_screen_name(self, screen_name: str) -> Optional[Dict[str, Any]]:
+        return self.get(USER_BY_SCREEN_NAME, screen_name=screen_name)
+
+    def close(self) -> None:
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class AsyncXClient:
+    """Asyncio counterpart of XClient with one AsyncSession per account"""
+
+    def __init__(self, pool: Optional[CredentialPool] = None, timeout: int = 30, max_clients: int = 10,
+                 decode: Optional[str] = None):
+        self.pool = pool if pool is not None else load_credentials()
+        self.timeout = timeout
+        self.decode = decode or os.getenv('X_DECODE', 'json')
+        self.max_clients = max_clients
+        self.sessions = {}
+
+    def _session(self, credential: Credential):
+        from curl_cffi.requests import AsyncSession
+
+        session = self.sessions.get(credential.name)
+        if session is None:
+            session = AsyncSession(headers=credential.headers, impersonate=IMPERSONATE, timeout=self.timeout, max_clients=self.max_clients)
+            self.sessions[credential.name] = session
+        return session
+
+    async def get(self, endpoint: GraphQLEndpoint, **variables) -> Optional[Dict[str, Any]]:
+        url = endpoint.build_url(**variables)
+        for _ in range(len(self.pool) + 1):
+            credential = self.pool.acquire(endpoint.operation)
+            if credential is None:
+                if not self.pool.alive:
+                    print(f"Error fetching {endpoint.operation}: no usable credentials left")
+                    return None
+                await asyncio.sleep(self.pool.wait_time(endpoint.operation))
+                continue
+            try:
+                with metrics.timer('x_http_request_seconds', operation=endpoint.operation):
+                    response = await self._session(credential).get(url)
+            except Exception as e:
+                credential.release()
+                metrics.inc('x_http_requests_total', operation=endpoint.operation, status='error')
+                print(f"Error fetching {endpoint.operation}: {e}")
+                return None
+            credential.update(endpoint.operation, response.status_code, response.headers)
+            _record_response(endpoint, response)
+            if response.status_code == 200:
+                return _decode(endpoint, response, self.decode)
+            print(f"Error fetching {endpoint.operation} with {credential.name}: status {response.status_code}")
+            if response.status_code not in (401, 403, 429):
+                return None
+        return None
+
+    async def user_tweets(self, user_id: str, **variables) -> Optional[Dict[str, Any]]:
+        return await self.get(USER_TWEETS, userId=str(user_id), **variables)
+
+    async def user_by_screen_name(self, screen_name: str) -> Optional[Dict[str, Any]]:
+        return await self.get(USER_BY_SCREEN_NAME, screen_name=screen_name)
+
+    async def close(self) -> None:
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
@@ -1,183 +1,735 @@
 import json
-from logging import NullHandler
+from dataclasses import dataclass, field
 import re
 import traceback
+from typing import Any, Dict, Iterable, List, Optional
+
+from metrics import metrics
+
+TWEET_ID_PATTERN = re.compile(r'tweet-(\d+)')
+_EXTRACT_TWEET_ID = re.compile(r'(tweet-(\d+))')
 
 def extract_tweet_id(text):
-    match = re.search(r'(tweet-(\d+))', text)
+    match = _EXTRACT_TWEET_ID.search(text)
     if match:
         return match.group(1)
     return text
 
-def parse_user_timeline(data):
-    x_items = []
-    try:
-        timelines_result = data.get("data").get("user").get("result")
-        if timelines_result.get("timeline_v2"):
-            timelines = timelines_result.get("timeline_v2").get("timeline")
-        else:
-            timelines = timelines_result.get("timeline").get("timeline")
-        # timelines = data.get("data").get("user").get("result").get("timeline_v2").get("timeline")
-        instructions = timelines.get("instructions")
-    except Exception as e:
-        print("获取timeline错误", e)
-        return x_items
-    for instruction in instructions:
-        try:
-            _type = instruction.get("type")
-            if _type == "TimelineAddEntries":
-                entries = instruction.get("entries")
-                for entry in entries:
-                    entryId = entry.get("entryId")
-                    # if str(entryId).startswith("who-to-follow"):
-                    #     continue
-                    if not str(entryId).startswith("tweet-") and not str(entryId).startswith("profile-conversation"):
-                        continue
-                    print(entryId)
-                    content = entry.get("content")
-                    if content.get("entryType") == "TimelineTimelineItem":
-                        itemContent = content.get("itemContent")
-                        x_item = parse_timeline_tweet_item(entryId, itemContent)
-                        x_item['created_at'] = x_item.get("data", {}).get("created_at")
-                        # print(x_item)
-                        x_items.append(x_item)
-                    elif content.get("entryType") == "TimelineTimelineModule":
-                        x_id_list = []
-                        x_item = {'x_id': entryId, 'itemType': "TimelineTimelineModule", 'data': []}
-                        for item in content.get("items"):
-                            _entryId = item.get("entryId")
-                            _itemContent = item.get("item").get("itemContent")
-                            parsed_data = parse_timeline_tweet_item(_entryId, _itemContent)
-                            x_id_list.append(parsed_data['x_id'])
-                            x_item['data'].append(parsed_data)
-                            if not x_item.get("created_at"):
-                                x_item['created_at'] = parsed_data.get("data", {}).get("created_at")
-                        x_item['x_id'] = 'profile-conversation-' + '-'.join(x_id_list)
-                        # print(x_item)
-                        x_items.append(x_item)
-        except Exception as e:
-            print("解析单条twitter 错误 ", e)
-            traceback.print_exc()
-    return x_items
+ENTITY_KINDS = ('cashtags', 'mentions', 'hashtags', 'contracts', 'domains')
+# $TICKER、@mention、#hashtag 都以符号开头，正则从符号起匹配（前一个字符的检查放在符号之后），
+# re 可以直接跳到下一个符号，不必在每个位置尝试
+SIGIL_PATTERN = re.compile(
+    r'\$(?<![\w$@#&/].)(?P<cashtags>[A-Za-z][A-Za-z0-9_]{0,14})\b'
+    r'|@(?<![\w$@#&/].)(?P<mentions>\w{1,15})\b'
+    r'|#(?<![\w$@#&/].)(?P<hashtags>\w+)'
+)
+# 0x 地址和 base58 地址
+ADDRESS_PATTERN = re.compile(
+    r'(?<![\w$@#&/])(?:'
+    r'(?P<evm>0x[0-9a-fA-F]{40})\b'
+    r'|(?P<base58>[1-9A-HJ-NP-Za-km-z]{32,44})(?![\w/])'
+    r')'
+)
+# 地址至少是 32 个连续的 ASCII 字母数字；先把文本映射成 a/空格再做子串查找，
+# 没有这样的片段（绝大多数推文）就不必运行 ADDRESS_PATTERN
+_ADDRESS_CHARS = bytes(0x61 if chr(i).isascii() and chr(i).isalnum() else 0x20 for i in range(256))
+_ADDRESS_RUN = b'a' * 32
+URL_HOST_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*://(?:[^/?#@]*@)?([^/?#:\[\]]+)')
+IGNORED_DOMAINS = frozenset(('t.co',))
 
 
-def parse_text_from_tweet(tweet_results):
-    legacy_full_text = None
-    note_tweet_full_text = None
-    quoted_full_text = None
-    retweeted_full_text = None
+def normalize_entity(kind, value):
+    """Normalize a cashtag/mention/hashtag/contract/domain the way extract_entities stores it"""
+    value = value.strip()
+    if kind == 'cashtags':
+        return value.lstrip('$').upper()
+    if kind in ('mentions', 'hashtags'):
+        return value.lstrip('@#').lower()
+    if kind == 'contracts':
+        # EVM 地址不区分大小写，base58 地址区分
+        return value.lower() if value[:2].lower() == '0x' else value
+    if kind == 'domains':
+        domain = value.lower()
+        return domain[4:] if domain.startswith('www.') else domain
+    raise ValueError(f'unknown entity kind {kind}')
 
-    legacy = tweet_results.get('legacy')
-    if not legacy:
-        legacy = tweet_results.get('tweet').get('legacy')
-    
-    legacy_full_text = legacy.get('full_text')
-
-    if tweet_results.get('note_tweet'):
-        note_tweet_full_text = tweet_results.get('note_tweet').get('note_tweet_results', {}).get('result', {}).get('text')
-        # print('has note_tweet:', note_tweet_full_text)
-
-    if tweet_results.get('quoted_status_result'):
-        quoted_status_result = tweet_results.get('quoted_status_result', {}).get('result')
-        # print(quoted_status_result)
-
-        if quoted_status_result:
-            quoted_full_text = parse_text_from_tweet(quoted_status_result)
-            if quoted_full_text: 
-                quoted_user_name = quoted_status_result.get('core', {}).get('user_results', {}).get('result', {}).get('legacy', {}).get('screen_name', '')
-                if not quoted_user_name:
-                    quoted_user_name = quoted_status_result.get('core', {}).get('user_results', {}).get('result', {}).get('core', {}).get('screen_name', '')
-                quoted_full_text = 'quoted From @' + quoted_user_name + ': ' + quoted_full_text
-
-    if legacy.get('retweeted_status_result'):
-        retweeted_status_result = legacy.get('retweeted_status_result').get('result')
-        if retweeted_status_result:
-            retweeted_full_text = parse_text_from_tweet(retweeted_status_result)
-            if retweeted_full_text:
-                retweeted_user_name = retweeted_status_result.get('core', {}).get('user_results', {}).get('result', {}).get('legacy', {}).get('screen_name', '')
-                if not retweeted_user_name:
-                    retweeted_user_name = retweeted_status_result.get('core', {}).get('user_results', {}).get('result', {}).get('core', {}).get('screen_name', '')
-                retweeted_full_text = 'RT @' + retweeted_user_name + ': ' + retweeted_full_text
-
-    full_text = legacy_full_text
-    if note_tweet_full_text:
-        full_text = note_tweet_full_text
-    if retweeted_full_text:
-        full_text = retweeted_full_text
-    if quoted_full_text:
-        full_text = f'{full_text}\n{quoted_full_text}'
-    return full_text
 
+def _is_base58_address(value):
+    return (any(c.isdigit() for c in value) and any(c.isupper() for c in value)
+            and any(c.islower() for c in value))
 
-def parse_timeline_tweet_item(entryId, itemContent):
-    itemType = itemContent.get('itemType')
-    x_item = {}
-    x_item['x_id'] = extract_tweet_id(entryId)
-    x_item['itemType'] = itemType
-    if itemType == "TimelineTweet":
-        tweet_results = itemContent.get("tweet_results").get("result")
-        legacy = tweet_results.get('legacy')
-        if not legacy:
-            legacy = tweet_results.get('tweet').get('legacy')
-        x_data = {}
-        x_data['created_at'] = legacy.get('created_at')
-        x_data['bookmark_count'] = legacy.get('bookmark_count')
-        x_data['favorite_count'] = legacy.get('favorite_count')
-        full_text = parse_text_from_tweet(tweet_results)
-        x_data['full_text'] = full_text
-
-        # 添加外链和多媒体内容解析
-        x_urls = {}
-        x_medias = {}
-
-        entities = legacy.get('entities')
+
+def _scan_text(text, found):
+    """Add the cashtags, mentions, hashtags and contract addresses of text to found (kind -> set, created on demand)"""
+    if not text:
+        return
+    if '$' in text or '@' in text or '#' in text:
+        for match in SIGIL_PATTERN.finditer(text):
+            kind = match.lastgroup
+            value = match.group(kind)
+            found.setdefault(kind, set()).add(value.upper() if kind == 'cashtags' else value.lower())
+    if _ADDRESS_RUN in text.encode('utf-8', 'ignore').translate(_ADDRESS_CHARS):
+        for match in ADDRESS_PATTERN.finditer(text):
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'evm':
+                found.setdefault('contracts', set()).add(value.lower())
+            # 要求同时含数字和大小写字母，避免把长单词当成地址
+            elif _is_base58_address(value):
+                found.setdefault('contracts', set()).add(value)
+
+
+def _url_domains(urls, domains):
+    for url in urls:
+        match = URL_HOST_PATTERN.match(url) if url else None
+        if match:
+            domain = normalize_entity('domains', match.group(1))
+            if domain not in IGNORED_DOMAINS:
+                domains.add(domain)
+
+
+def extract_entities(text: Optional[str], urls: Iterable[Optional[str]] = ()) -> Dict[str, List[str]]:
+    """
+    Extract cashtags, mentions, hashtags, contract addresses and link domains
+    Args:
+        text: Tweet text (including quoted/retweeted text)
+        urls: Expanded link targets
+    Returns:
+        Dictionary mapping each of ENTITY_KINDS to a sorted list of unique normalized values
+    """
+    found = {}
+    _scan_text(text, found)
+    _url_domains(urls, found.setdefault('domains', set()))
+    return {kind: sorted(found.get(kind, ())) for kind in ENTITY_KINDS}
+
+
+def merge_entities(entity_sets: Iterable[Dict[str, List[str]]]) -> Dict[str, List[str]]:
+    merged = {kind: set() for kind in ENTITY_KINDS}
+    for entities in entity_sets:
+        for kind in ENTITY_KINDS:
+            merged[kind].update(entities.get(kind) or ())
+    return {kind: sorted(values) for kind, values in merged.items()}
+
+
+def item_entities(item: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Entities of a stored X item dictionary (single tweet or conversation module)"""
+    if item.get('entities'):
+        return item['entities']
+    data = item.get('data')
+    tweets = data if isinstance(data, list) else [item]
+    entity_sets = []
+    for tweet in tweets:
+        tweet_data = tweet.get('data') if isinstance(tweet, dict) else None
+        if not isinstance(tweet_data, dict):
+            continue
+        urls = [url for targets in (tweet_data.get('urls') or {}).values() for url in targets]
+        entity_sets.append(extract_entities(tweet_data.get('full_text'), urls))
+    return merge_entities(entity_sets)
+
+
+def max_tweet_id(text):
+    """Return the newest numeric tweet id referenced by an entryId/x_id, or None"""
+    ids = TWEET_ID_PATTERN.findall(str(text))
+    if not ids:
+        return None
+    return max(int(i) for i in ids)
+
+def entry_max_tweet_id(entry):
+    """Return the newest tweet id in a timeline entry (single tweet or conversation module)"""
+    content = entry.get("content") or {}
+    if content.get("entryType") == "TimelineTimelineModule":
+        ids = [max_tweet_id(item.get("entryId")) for item in content.get("items") or []]
+        ids = [i for i in ids if i is not None]
+        return max(ids) if ids else None
+    return max_tweet_id(entry.get("entryId"))
+
+def _timeline_instructions(data):
+    timelines_result = data.get("data").get("user").get("result")
+    if timelines_result.get("timeline_v2"):
+        return timelines_result.get("timeline_v2").get("timeline").get("instructions")
+    return timelines_result.get("timeline").get("timeline").get("instructions")
+
+
+@dataclass(slots=True)
+class TweetRecord:
+    """A parsed TimelineTweet; urls/medias map t.co tags to ordered unique targets"""
+    x_id: str
+    itemType: str = "TimelineTweet"
+    created_at: Optional[str] = None
+    bookmark_count: Optional[int] = None
+    favorite_count: Optional[int] = None
+    view_count: Optional[int] = None
+    full_text: Optional[str] = None
+    urls: Dict[str, Dict[str, None]] = field(default_factory=dict)
+    medias: Dict[str, Dict[str, None]] = field(default_factory=dict)
+    quoted_id: Optional[str] = None
+    retweeted_id: Optional[str] = None
+    # 置顶推文不在时间顺序里，回填时不能用它判断是否已到目标日期
+    is_pinned: bool = False
+    username: Optional[str] = None
+    user_id: Optional[str] = None
+    user_link: Optional[str] = None
+    # 解析结果（含引用链），实体和 t_x_refs 记录在入库时才从中构建
+    resolved: Optional['ResolvedTweet'] = field(default=None, repr=False)
+    entity_cache: Optional[Dict[str, List[str]]] = field(default=None, repr=False)
+
+    @property
+    def refs(self) -> List['ReferencedTweet']:
+        """All tweets on the quote/retweet chain, for t_x_refs, built on first use"""
+        if self.resolved is None:
+            return []
+        return _unique_refs(_collect_refs(self.resolved))
+
+    @property
+    def entities(self) -> Dict[str, List[str]]:
+        """Entities of the text (with retweeted/quoted text) and link domains, extracted on first use"""
+        if self.entity_cache is None:
+            if self.resolved is not None:
+                text_entities = _text_entities(self.resolved)
+            else:
+                text_entities = {}
+                _scan_text(self.full_text, text_entities)
+            domains = set()
+            _url_domains((url for targets in self.urls.values() for url in targets), domains)
+            entities = {kind: sorted(text_entities.get(kind, ())) for kind in ENTITY_KINDS}
+            entities['domains'] = sorted(domains)
+            self.entity_cache = entities
+        return self.entity_cache
+
+    def to_data(self) -> Dict[str, Any]:
+        data = {
+            'created_at': self.created_at,
+            'bookmark_count': self.bookmark_count,
+            'favorite_count': self.favorite_count,
+            'view_count': self.view_count,
+            'full_text': self.full_text,
+            'urls': {tag: list(targets) for tag, targets in self.urls.items()},
+            'medias': {tag: list(targets) for tag, targets in self.medias.items()},
+        }
+        if self.quoted_id:
+            data['quoted_id'] = self.quoted_id
+        if self.retweeted_id:
+            data['retweeted_id'] = self.retweeted_id
+        return data
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to the t_x item dictionary shape"""
+        item = {'x_id': self.x_id, 'itemType': self.itemType, 'data': self.to_data(), 'created_at': self.created_at,
+                'entities': self.entities}
+        _copy_user_fields(self, item)
+        return item
+
+
+@dataclass(slots=True)
+class ConversationRecord:
+    """A profile-conversation module made of several tweets"""
+    x_id: str
+    tweets: List[TweetRecord]
+    itemType: str = "TimelineTimelineModule"
+    is_pinned: bool = False
+    username: Optional[str] = None
+    user_id: Optional[str] = None
+    user_link: Optional[str] = None
+
+    @property
+    def created_at(self) -> Optional[str]:
+        for tweet in self.tweets:
+            if tweet.created_at:
+                return tweet.created_at
+        return None
+
+    @property
+    def entities(self) -> Dict[str, List[str]]:
+        return merge_entities(tweet.entities for tweet in self.tweets)
+
+    @property
+    def refs(self) -> List['ReferencedTweet']:
+        return _unique_refs(ref for tweet in self.tweets for ref in tweet.refs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to the t_x item dictionary shape"""
+        item = {
+            'x_id': self.x_id,
+            'itemType': self.itemType,
+            'data': [{'x_id': tweet.x_id, 'itemType': tweet.itemType, 'data': tweet.to_data()} for tweet in self.tweets],
+        }
+        created_at = self.created_at
+        if created_at:
+            item['created_at'] = created_at
+        item['entities'] = self.entities
+        _copy_user_fields(self, item)
+        return item
+
+
+@dataclass(slots=True)
+class ReferencedTweet:
+    """A quoted or retweeted tweet, stored once in t_x_refs under its rest_id"""
+    ref_id: str
+    username: Optional[str] = None
+    created_at: Optional[str] = None
+    # 只含自身文本，不含它再引用的推文
+    full_text: Optional[str] = None
+    bookmark_count: Optional[int] = None
+    favorite_count: Optional[int] = None
+    view_count: Optional[int] = None
+    urls: Dict[str, Dict[str, None]] = field(default_factory=dict)
+    medias: Dict[str, Dict[str, None]] = field(default_factory=dict)
+    quoted_id: Optional[str] = None
+    retweeted_id: Optional[str] = None
+
+    def to_data(self) -> Dict[str, Any]:
+        return {
+            'bookmark_count': self.bookmark_count,
+            'favorite_count': self.favorite_count,
+            'view_count': self.view_count,
+            'urls': {tag: list(targets) for tag, targets in self.urls.items()},
+            'medias': {tag: list(targets) for tag, targets in self.medias.items()},
+        }
+
+
+@dataclass(slots=True)
+class ResolvedTweet:
+    """Resolution result of one tweet, memoized per response by rest_id"""
+    full_text: Optional[str] = None
+    quoted_id: Optional[str] = None
+    retweeted_id: Optional[str] = None
+    # 自身的文本；转发时为空，正文来自被转发的推文
+    own_text: Optional[str] = None
+    # 自身被引用时构建 ReferencedTweet 所需的原始字段，只保留 legacy 和 views
+    legacy: Optional[Dict[str, Any]] = None
+    views: Optional[Dict[str, Any]] = None
+    # 拼进 full_text 的被转发/被引用推文：(ref_id, screen_name, ResolvedTweet)，转发在前
+    children: tuple = ()
+    # 自身被引用时的记录，按需构建
+    ref: Optional[ReferencedTweet] = None
+    # 自身文本中的实体 (kind, value)，不含链接域名；同一响应中每条推文只提取一次，
+    # 存为元组而不是集合，解析结果在入库前一直保留，元组占用的内存小得多
+    text_entities: Optional[tuple] = None
+
+
+def _text_entities(resolved):
+    """Text entities (kind -> set) of a resolved tweet: its own text plus the tweets it retweets/quotes, each text scanned once"""
+    found = {}
+    # 引用链可能很长，用栈遍历而不是递归
+    stack = [resolved]
+    while stack:
+        node = stack.pop()
+        for kind, value in _own_entities(node):
+            found.setdefault(kind, set()).add(value)
+        for _, screen_name, child in node.children:
+            # 拼接后的文本里是 "RT @name: " / "quoted From @name: "
+            if screen_name:
+                found.setdefault('mentions', set()).add(screen_name.lower())
+            stack.append(child)
+    return found
+
+
+def _own_entities(node):
+    if node.text_entities is None:
+        found = {}
+        _scan_text(node.own_text, found)
+        node.text_entities = tuple((kind, value) for kind, values in found.items() for value in values)
+    return node.text_entities
+
+
+def _collect_refs(resolved):
+    """ReferencedTweet records of the quote/retweet chain in pre-order (retweeted before quoted), may repeat"""
+    refs = []
+    stack = list(reversed(resolved.children))
+    while stack:
+        ref_id, screen_name, child = stack.pop()
+        if not ref_id:
+            # 没有 rest_id 的推文不写入 t_x_refs，它引用的推文也不写
+            continue
+        if child.ref is None:
+            child.ref = _reference(ref_id, screen_name, child)
+        refs.append(child.ref)
+        stack.extend(reversed(child.children))
+    return refs
+
+
+def _unique_refs(refs):
+    unique = {}
+    for ref in refs:
+        unique.setdefault(ref.ref_id, ref)
+    return list(unique.values())
+
+
+def _copy_user_fields(record, item):
+    if record.username is not None or record.user_id is not None:
+        item['username'] = record.username
+        item['user_id'] = record.user_id
+        item['user_link'] = record.user_link
+
+
+def _add_targets(targets, tag_key, value_key, entities):
+    for entity in entities:
+        tag = entity.get(tag_key)
+        if tag:
+            bucket = targets.get(tag)
+            if bucket is None:
+                bucket = targets[tag] = {}
+            bucket[entity.get(value_key)] = None
+
+
+def _add_links(record, legacy):
+    # 添加外链和多媒体内容解析
+    for entities in (legacy.get('entities'), legacy.get('extended_entities')):
         if entities:
             e_urls = entities.get("urls")
             if e_urls:
-                for e_url in e_urls:
-                    url_tag = e_url.get('url')
-                    if url_tag:
-                        tmp_list = x_urls.get(url_tag, [])
-                        if e_url.get('expanded_url') not in tmp_list:
-                            tmp_list.append(e_url.get('expanded_url'))
-                        x_urls[url_tag] = tmp_list
+                _add_targets(record.urls, 'url', 'expanded_url', e_urls)
             medias = entities.get("media")
             if medias:
-                for media in medias:
-                    media_tag = media.get('url')
-                    if media_tag:
-                        tmp_list = x_medias.get(media_tag, [])
-                        if media.get('media_url_https') not in tmp_list:
-                            tmp_list.append(media.get('media_url_https'))
-                        x_medias[media_tag] = tmp_list
-
-        extended_entities = legacy.get('extended_entities')
-        if extended_entities:
-            e_urls = extended_entities.get("urls")
-            if e_urls:
-                for e_url in e_urls:
-                    url_tag = e_url.get('url')
-                    if url_tag:
-                        tmp_list = x_urls.get(url_tag, [])
-                        if e_url.get('expanded_url') not in tmp_list:
-                            tmp_list.append(e_url.get('expanded_url'))
-                        x_urls[url_tag] = tmp_list
-            medias = extended_entities.get("media")
-            if medias:
-                for media in medias:
-                    media_tag = media.get('url')
-                    if media_tag:
-                        tmp_list = x_medias.get(media_tag, [])
-                        if media.get('media_url_https') not in tmp_list:
-                            tmp_list.append(media.get('media_url_https'))
-                        x_medias[media_tag] = tmp_list
+                _add_targets(record.medias, 'url', 'media_url_https', medias)
+
+
+def _tweet_key(tweet_results):
+    key = tweet_results.get('rest_id')
+    if not key:
+        tweet = tweet_results.get('tweet') or {}
+        key = tweet.get('rest_id')
+    # 没有 rest_id 的节点只在本次解析中按对象去重
+    return key or id(tweet_results)
+
+
+def _view_count(views):
+    return int(views['count']) if views and views.get('count') else None
+
+
+def _screen_name(tweet_results):
+    user = ((tweet_results.get('core') or {}).get('user_results') or {}).get('result') or {}
+    return (user.get('legacy') or {}).get('screen_name') or (user.get('core') or {}).get('screen_name') or ''
+
+
+def _referenced_results(tweet_results):
+    """Return (body, quoted, retweeted) of a tweet: the node holding legacy and the referenced tweet results, any may be None"""
+    quoted = tweet_results.get('quoted_status_result')
+    if quoted:
+        quoted = quoted.get('result') or None
+    legacy = tweet_results.get('legacy')
+    if legacy:
+        tweet = tweet_results
+    else:
+        # TweetWithVisibilityResults 把推文包在 tweet 里
+        tweet = tweet_results.get('tweet')
+        legacy = tweet.get('legacy') if tweet else None
+        if not legacy:
+            return None, quoted, None
+    retweeted = legacy.get('retweeted_status_result')
+    if retweeted:
+        retweeted = retweeted.get('result') or None
+    return tweet, quoted, retweeted or None
+
+
+def _own_text(tweet_results, legacy):
+    note_tweet = tweet_results.get('note_tweet')
+    if note_tweet:
+        note_text = ((note_tweet.get('note_tweet_results') or {}).get('result') or {}).get('text')
+        if note_text:
+            return note_text
+    return legacy.get('full_text')
+
+
+def _reference(ref_id, screen_name, resolved):
+    """Build the t_x_refs record of a referenced tweet"""
+    legacy = resolved.legacy
+    ref = ReferencedTweet(
+        ref_id=ref_id,
+        username=screen_name or None,
+        created_at=legacy.get('created_at'),
+        full_text=resolved.own_text,
+        bookmark_count=legacy.get('bookmark_count'),
+        favorite_count=legacy.get('favorite_count'),
+        view_count=_view_count(resolved.views),
+        quoted_id=resolved.quoted_id,
+        retweeted_id=resolved.retweeted_id,
+    )
+    _add_links(ref, legacy)
+    return ref
 
-        x_data['urls'] = x_urls
-        x_data['medias'] = x_medias
 
-        x_item['data'] = x_data
+def _combine(tweet_results, tweet, quoted, retweeted):
+    """Combine a tweet with its already resolved quoted/retweeted tweets (each a (node, ResolvedTweet) or None)"""
+    if tweet is None:
+        # 已删除或不可见的推文（TweetTombstone 等）没有正文
+        return ResolvedTweet()
+    legacy = tweet['legacy']
+    own_text = full_text = _own_text(tweet_results, legacy)
+    quoted_id = retweeted_id = None
+    children = ()
+    if retweeted is not None and retweeted[1].full_text:
+        node, child = retweeted
+        screen_name = _screen_name(node)
+        retweeted_id = node.get('rest_id') or (node.get('tweet') or {}).get('rest_id')
+        children = ((retweeted_id, screen_name, child),)
+        full_text = 'RT @' + screen_name + ': ' + child.full_text
+        own_text = None
+    if quoted is not None and quoted[1].full_text:
+        node, child = quoted
+        screen_name = _screen_name(node)
+        quoted_id = node.get('rest_id') or (node.get('tweet') or {}).get('rest_id')
+        children += ((quoted_id, screen_name, child),)
+        full_text = f'{full_text}\nquoted From @{screen_name}: {child.full_text}'
+    return ResolvedTweet(full_text=full_text, quoted_id=quoted_id, retweeted_id=retweeted_id, own_text=own_text,
+                         legacy=legacy, views=tweet.get('views'), children=children)
 
-        return x_item
+
+def _combine_text(tweet_results, tweet, quoted, retweeted):
+    """Flattened text only, combined the same way as _combine"""
+    if tweet is None:
+        return None
+    text = _own_text(tweet_results, tweet['legacy'])
+    if retweeted is not None and retweeted[1]:
+        text = 'RT @' + _screen_name(retweeted[0]) + ': ' + retweeted[1]
+    if quoted is not None and quoted[1]:
+        text = f'{text}\nquoted From @{_screen_name(quoted[0])}: {quoted[1]}'
+    return text
+
+
+def _resolve_node(node, tweet, quoted, retweeted, quoted_result, retweeted_result, combine, cache):
+    """(key, result) of a tweet whose quoted/retweeted tweets are already resolved to (key, result)"""
+    key = result = None
+    if cache is not None:
+        key = (_tweet_key(node),
+               quoted_result[0] if quoted_result else None,
+               retweeted_result[0] if retweeted_result else None)
+        result = cache.get(key)
+    if result is None:
+        result = combine(node, tweet,
+                         (quoted, quoted_result[1]) if quoted_result else None,
+                         (retweeted, retweeted_result[1]) if retweeted_result else None)
+        if cache is not None:
+            cache[key] = result
+    return key, result
+
+
+def _resolve_leaf(tweet_results, combine, cache):
+    """(key, result) of a tweet that quotes/retweets nothing, None for any other tweet"""
+    tweet, quoted, retweeted = _referenced_results(tweet_results)
+    if quoted is not None or retweeted is not None:
+        return None
+    if cache is None:
+        return None, combine(tweet_results, tweet, None, None)
+    return _resolve_node(tweet_results, tweet, None, None, None, None, combine, cache)
+
+
+def _resolve(tweet_results, combine, cache=None):
+    """Post-order walk of a quote/retweet chain without recursion, combine(node, body, quoted, retweeted) per tweet"""
+    tweet, quoted, retweeted = _referenced_results(tweet_results)
+    if quoted is None and retweeted is None:
+        # 大部分推文没有引用/转发，不必进入遍历
+        return combine(tweet_results, tweet, None, None)
+    # 每帧是 [节点, 正文节点, 被引用, 被转发, 被引用的 (key, 结果), 被转发的 (key, 结果)]，
+    # 子节点解析完后把结果填进父帧中第一个空位（先被引用，后被转发）。
+    # 被引用/被转发的推文通常不再引用其他推文，这时直接填好，不必为它们入栈
+    quoted_result = _resolve_leaf(quoted, combine, cache) if quoted is not None else None
+    retweeted_result = _resolve_leaf(retweeted, combine, cache) if retweeted is not None else None
+    if (quoted is None or quoted_result) and (retweeted is None or retweeted_result):
+        return _resolve_node(tweet_results, tweet, quoted, retweeted, quoted_result, retweeted_result,
+                             combine, cache)[1]
+    stack = [[tweet_results, tweet, quoted, retweeted, quoted_result, retweeted_result]]
+    while True:
+        node, tweet, quoted, retweeted, quoted_result, retweeted_result = stack[-1]
+        child = None
+        if quoted is not None and quoted_result is None:
+            child = quoted
+        elif retweeted is not None and retweeted_result is None:
+            child = retweeted
+        if child is not None:
+            stack.append([child, *_referenced_results(child), None, None])
+            continue
+        stack.pop()
+        resolved = _resolve_node(node, tweet, quoted, retweeted, quoted_result, retweeted_result, combine, cache)
+        if not stack:
+            return resolved[1]
+        parent = stack[-1]
+        if parent[2] is not None and parent[4] is None:
+            parent[4] = resolved
+        else:
+            parent[5] = resolved
+
+
+def resolve_tweet(tweet_results, cache=None):
+    """
+    Resolve a tweet's flattened text and the tweets it quotes/retweets
+    Walks quote/retweet chains iteratively (no recursion limit) and, given a cache,
+    memoizes the result so a tweet referenced from several entries of the same
+    response is resolved once. The memo key is the rest_id together with the keys
+    of the nested references: X cuts quote chains at a fixed depth, so the same
+    rest_id may arrive with or without its own quote.
+    Args:
+        tweet_results: tweet_results.result node
+        cache: Memo shared across one response, None disables memoization
+    Returns:
+        ResolvedTweet
+    """
+    return _resolve(tweet_results, _combine, cache)
+
+
+def parse_tweet_record(entryId, itemContent, cache=None):
+    """Parse one TimelineTweet itemContent into a TweetRecord, None for other item types"""
+    itemType = itemContent.get('itemType')
+    if itemType != "TimelineTweet":
+        return None
+    tweet_results = itemContent["tweet_results"]["result"]
+    tweet = tweet_results if tweet_results.get('legacy') else tweet_results['tweet']
+    legacy = tweet['legacy']
+    resolved = resolve_tweet(tweet_results, cache)
+    record = TweetRecord(
+        x_id=extract_tweet_id(entryId),
+        created_at=legacy.get('created_at'),
+        bookmark_count=legacy.get('bookmark_count'),
+        favorite_count=legacy.get('favorite_count'),
+        view_count=_view_count(tweet.get('views')),
+        full_text=resolved.full_text,
+        quoted_id=resolved.quoted_id,
+        retweeted_id=resolved.retweeted_id,
+        resolved=resolved,
+    )
+    _add_links(record, legacy)
+    return record
+
+
+def _parse_entry(entry, cache=None):
+    """Parse a tweet or profile-conversation entry into a record, None for anything else"""
+    entryId = entry.get("entryId") or ""
+    content = entry["content"]
+    entry_type = content.get("entryType")
+    if entry_type == "TimelineTimelineItem":
+        return parse_tweet_record(entryId, content["itemContent"], cache)
+    if entry_type == "TimelineTimelineModule":
+        tweets = []
+        for item in content["items"]:
+            tweet = parse_tweet_record(item.get("entryId"), item["item"]["itemContent"], cache)
+            if tweet:
+                tweets.append(tweet)
+        if tweets:
+            x_id = 'profile-conversation-' + '-'.join(tweet.x_id for tweet in tweets)
+            return ConversationRecord(x_id=x_id, tweets=tweets)
+    return None
+
+
+def _is_timeline_entry(entry):
+    entryId = entry.get("entryId") or ""
+    return entryId.startswith("tweet-") or entryId.startswith("profile-conversation")
+
+
+def _append_entry(records, entry, cache, is_pinned=False):
+    try:
+        record = _parse_entry(entry, cache)
+        if record:
+            record.is_pinned = is_pinned
+            records.append(record)
+    except Exception as e:
+        print("解析单条twitter 错误 ", entry.get("entryId"), e)
+        traceback.print_exc()
+        metrics.inc('x_parse_errors_total')
+
+
+def _release_chain_texts(cache):
+    # 拼接好的全文只在解析时用于拼接引用它的推文，记录已各自保存 full_text；
+    # 引用链上每一层的全文都包含下一层，入库前一直保留会占用大量内存
+    for resolved in cache.values():
+        resolved.full_text = None
+
+
+@metrics.timed('x_parse_seconds', stage='user_timeline')
+def parse_user_timeline_records(data, since_id=None):
+    """
+    Parse a UserTweets response into TweetRecord/ConversationRecord objects in one pass
+    Args:
+        data: Raw GraphQL response
+        since_id: High-water mark; parsing stops at the first entry that is not newer than it
+    Returns:
+        List of records, the pinned tweet (if any, marked is_pinned) first, then newest first
+    """
+    records = []
+    # 同一响应中被多条推文引用的推文只解析一次
+    cache = {}
+    try:
+        instructions = _timeline_instructions(data)
+    except Exception as e:
+        print("获取timeline错误", e)
+        return records
+    for instruction in instructions:
+        _type = instruction.get("type")
+        if _type == "TimelinePinEntry":
+            entry = instruction.get("entry") or {}
+            if not _is_timeline_entry(entry):
+                continue
+            # 置顶推文不在时间顺序里，已抓取过时只跳过它本身
+            entry_id = entry_max_tweet_id(entry)
+            if since_id is not None and entry_id is not None and entry_id <= since_id:
+                metrics.inc('x_entries_skipped_total', reason='pinned')
+                continue
+            _append_entry(records, entry, cache, is_pinned=True)
+        elif _type == "TimelineAddEntries":
+            entries = instruction.get("entries") or []
+            for index, entry in enumerate(entries):
+                if not _is_timeline_entry(entry):
+                    continue
+                if since_id is not None:
+                    # 时间线按时间倒序，遇到已抓取过的条目即可停止
+                    entry_id = entry_max_tweet_id(entry)
+                    if entry_id is not None and entry_id <= since_id:
+                        metrics.inc('x_entries_skipped_total', len(entries) - index, reason='known')
+                        metrics.inc('x_items_parsed_total', len(records))
+                        _release_chain_texts(cache)
+                        return records
+                _append_entry(records, entry, cache)
+    metrics.inc('x_items_parsed_total', len(records))
+    _release_chain_texts(cache)
+    return records
+
+
+def parse_user_timeline(data, since_id=None):
+    """
+    Parse a UserTweets response into X item dictionaries
+    Args:
+        data: Raw GraphQL response
+        since_id: High-water mark; parsing stops at the first entry that is not newer than it
+    Returns:
+        List of X item dictionaries, newest first
+    """
+    return [record.to_dict() for record in parse_user_timeline_records(data, since_id=since_id)]
+
+
+def extract_bottom_cursor(data):
+    """Return the Bottom cursor of a UserTweets response (used to page back in time), or None"""
+    try:
+        instructions = _timeline_instructions(data)
+    except Exception:
+        return None
+    for instruction in instructions or []:
+        _type = instruction.get("type")
+        if _type == "TimelineAddEntries":
+            entries = instruction.get("entries") or []
+        elif _type == "TimelineReplaceEntry":
+            entries = [instruction.get("entry") or {}]
+        else:
+            continue
+        for entry in entries:
+            content = entry.get("content") or {}
+            if content.get("cursorType") == "Bottom":
+                return content.get("value")
+    return None
+
+
+def parse_text_from_tweet(tweet_results):
+    """Flattened text of a tweet, with retweeted/quoted text inlined as "RT @..." / "quoted From @..." """
+    # 只需要文本时不构建 ResolvedTweet
+    return _resolve(tweet_results, _combine_text)
+
+
+def parse_timeline_tweet_item(entryId, itemContent):
+    record = parse_tweet_record(entryId, itemContent)
+    if record is None:
+        return {'x_id': extract_tweet_id(entryId), 'itemType': itemContent.get('itemType')}
+    item = record.to_dict()
+    del item['created_at']
+    del item['entities']
+    return item
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""
+Schema-directed decoding of UserTweets responses
+
+Only the fields read by x_parser are declared; msgspec skips everything else
+(promoted content, user cards, feature flags ...) while decoding, without
+building Python objects for it. The decoded Structs are turned back into
+plain dicts of the same shape, so x_parser handles both decoding modes.
+"""
+import json
+from typing import Any, Dict, Optional
+
+try:
+    import msgspec
+except ImportError:  # 未安装 msgspec 时退回完整 JSON 解码
+    msgspec = None
+
+DECODE_MODES = ('json', 'schema')
+
+if msgspec:
+    class _Struct(msgspec.Struct, omit_defaults=True):
+        pass
+
+    class ScreenNameInfo(_Struct):
+        screen_name: Optional[str] = None
+
+    class UserResult(_Struct):
+        legacy: Optional[ScreenNameInfo] = None
+        core: Optional[ScreenNameInfo] = None
+
+    class UserResults(_Struct):
+        result: Optional[UserResult] = None
+
+    class TweetCore(_Struct):
+        user_results: Optional[UserResults] = None
+
+    class UrlEntity(_Struct):
+        url: Optional[str] = None
+        expanded_url: Optional[str] = None
+
+    class MediaEntity(_Struct):
+        url: Optional[str] = None
+        media_url_https: Optional[str] = None
+
+    class Entities(_Struct):
+        urls: Optional[list[UrlEntity]] = None
+        media: Optional[list[MediaEntity]] = None
+
+    class NoteTweetText(_Struct):
+        text: Optional[str] = None
+
+    class NoteTweetResults(_Struct):
+        result: Optional[NoteTweetText] = None
+
+    class NoteTweet(_Struct):
+        note_tweet_results: Optional[NoteTweetResults] = None
+
+    class TweetLegacy(_Struct):
+        created_at: Optional[str] = None
+        bookmark_count: Optional[int] = None
+        favorite_count: Optional[int] = None
+        full_text: Optional[str] = None
+        entities: Optional[Entities] = None
+        extended_entities: Optional[Entities] = None
+        retweeted_status_result: Optional['TweetResults'] = None
+
+    class Views(_Struct):
+        count: Optional[str] = None
+
+    class TweetResult(_Struct):
+        rest_id: Optional[str] = None
+        legacy: Optional[TweetLegacy] = None
+        views: Optional[Views] = None
+        # TweetWithVisibilityResults 把推文包在 tweet 字段里
+        tweet: Optional['TweetResult'] = None
+        core: Optional[TweetCore] = None
+        note_tweet: Optional[NoteTweet] = None
+        quoted_status_result: Optional['TweetResults'] = None
+
+    class TweetResults(_Struct):
+        result: Optional[TweetResult] = None
+
+    class ItemContent(_Struct):
+        itemType: Optional[str] = None
+        tweet_results: Optional[TweetResults] = None
+
+    class ModuleItemBody(_Struct):
+        itemContent: Optional[ItemContent] = None
+
+    class ModuleItem(_Struct):
+        entryId: Optional[str] = None
+        item: Optional[ModuleItemBody] = None
+
+    class EntryContent(_Struct):
+        entryType: Optional[str] = None
+        cursorType: Optional[str] = None
+        value: Optional[str] = None
+        itemContent: Optional[ItemContent] = None
+        items: Optional[list[ModuleItem]] = None
+
+    class Entry(_Struct):
+        entryId: Optional[str] = None
+        content: Optional[EntryContent] = None
+
+    class Instruction(_Struct):
+        type: Optional[str] = None
+        entries: Optional[list[Entry]] = None
+        entry: Optional[Entry] = None
+
+    class Timeline(_Struct):
+        instructions: Optional[list[Instruction]] = None
+
+    class TimelineWrapper(_Struct):
+        timeline: Optional[Timeline] = None
+
+    class TimelineUser(_Struct):
+        timeline_v2: Optional[TimelineWrapper] = None
+        timeline: Optional[TimelineWrapper] = None
+
+    class TimelineUserResult(_Struct):
+        result: Optional[TimelineUser] = None
+
+    class UserTweetsData(_Struct):
+        user: Optional[TimelineUserResult] = None
+
+    class UserTweetsResponse(_Struct):
+        data: Optional[UserTweetsData] = None
+
+    class ArchiveRecord(msgspec.Struct):
+        fetched_at: Optional[str] = None
+        operation: Optional[str] = None
+        user_id: Optional[str] = None
+        username: Optional[str] = None
+        user_link: Optional[str] = None
+        # 先保留原始字节，按 operation 选择 schema 再解码
+        data: msgspec.Raw = msgspec.Raw(b'null')
+
+    _DECODERS = {
+        'UserTweets': msgspec.json.Decoder(UserTweetsResponse),
+    }
+    _ARCHIVE_DECODER = msgspec.json.Decoder(ArchiveRecord)
+else:
+    _DECODERS = {}
+
+
+def has_schema(operation: str) -> bool:
+    return operation in _DECODERS
+
+
+def decode_response(operation: str, content: bytes, mode: str = 'json') -> Dict[str, Any]:
+    """
+    Decode a GraphQL response body
+    Args:
+        operation: GraphQL operation name, selects the schema
+        content: Raw response body
+        mode: 'schema' keeps only the fields x_parser reads (needs msgspec and a
+              schema for the operation), 'json' decodes the full payload
+    Returns:
+        Response as plain dicts/lists
+    """
+    decoder = _DECODERS.get(operation) if mode == 'schema' else None
+    if decoder is None:
+        return json.loads(content)
+    return msgspec.to_builtins(decoder.decode(content))
+
+
+def decode_archive_record(line: bytes, mode: str = 'json') -> Dict[str, Any]:
+    """Decode one raw_archive record; in 'schema' mode its data is decoded like decode_response"""
+    if mode != 'schema' or not msgspec:
+        return json.loads(line)
+    record = _ARCHIVE_DECODER.decode(line)
+    return {
+        'fetched_at': record.fetched_at,
+        'operation': record.operation,
+        'user_id': record.user_id,
+        'username': record.username,
+        'user_link': record.user_link,
+        'data': decode_response(record.operation, bytes(record.data), mode),
+    }